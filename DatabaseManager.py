@@ -1,29 +1,35 @@
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
+from supabase import Client
 from st_aggrid import AgGrid, GridOptionsBuilder
 from st_aggrid.shared import GridUpdateMode
 from io import BytesIO
 import os
+import db
+from importer import to_records
+import snapshot_cache
+import change_feed
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize Supabase client 
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Shared Supabase client (see db)
+supabase: Client = db.client()
+
+# Load data from Supabase. Served from a local snapshot that only pulls changed rows (see snapshot_cache.load), or
+# that the Realtime change feed keeps current when it is connected (see change_feed).
+change_feed.subscribe('user_data', key='id')
 
-# Load data from Supabase
-@st.cache_data(ttl=60)
 def load_data():
-    response = supabase.table('user_data').select('*').execute()
-    return pd.DataFrame(response.data)
+    return snapshot_cache.load('user_data', key='id')
 
 def update_data(data):
-    for index, row in data.iterrows():
-        supabase.table('user_data').update(row.to_dict()).eq('id', row['id']).execute()
+    # JSON-safe rows: typed columns (timestamps, nullable ints) are converted back, see importer.to_records
+    for row in to_records(data):
+        supabase.table('user_data').update(row).eq('id', row['id']).execute()
+    snapshot_cache.refresh_rows('user_data', data['id'].tolist(), key='id')
 
 def upload_data(df):
+    updated_ids = []
     for index, row in df.iterrows():
         email = row['email']
         tag_list = row['tag_list'].split(',') if 'tag_list' in row else []
@@ -37,12 +43,16 @@ def upload_data(df):
             current_tag_list = existing_user.data[0]['tag_list']
             updated_tag_list = list(set(current_tag_list + tag_list))
             supabase.table('user_data').update({'tag_list': updated_tag_list}).eq('id', user_id).execute()
+            updated_ids.append(user_id)
         else:
             # User does not exist, insert new record
             new_user = row.to_dict()
             #new_user['tag_list'] = tag_list
             supabase.table('user_data').insert(new_user).execute()
 
+    # tag updates don't move created_at, so fetch those rows again; new rows arrive with the next delta sync
+    snapshot_cache.refresh_rows('user_data', updated_ids, key='id')
+
 # Page 1: View, Filter, Edit, and Download Data
 def page_one():
     st.title("Manage Users Data")
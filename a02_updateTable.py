@@ -1,6 +1,7 @@
 import os
 import pandas as pd
 from supabase import create_client, Client
+from importer import merge_tags
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -40,12 +41,8 @@ def import_data(df: pd.DataFrame):
             user_id = existing_user.data[0]['id']
             current_tags = existing_user.data[0]['tags']
 
-            try:
-                current_tags = current_tags+", "+tags # if user has existing tags
-            except:
-                current_tags = tags # if user has no tags
-
-            updated_tags = current_tags
+            # merge, strip & de-duplicate tags. Same rules as the dashboard import.
+            updated_tags = merge_tags(current_tags, tags)
 
             supabase.table('users').update({'tags': updated_tags}).eq('id', user_id).execute()
 
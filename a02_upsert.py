@@ -1,60 +1,28 @@
 import os
 import json
 import pandas as pd
-from supabase import create_client, Client
-from dotenv import load_dotenv
-load_dotenv()
+from supabase import Client
+import db
+from importer import merge_chunks, collapse_duplicates
+from identity_index import normalize_emails
 
-# Initialize Supabase client
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Shared Supabase client (see db)
+supabase: Client = db.client()
 
 
-# Function to check if user exists and append tags if so
+# Function to check if user exists and append tags if so.
+# Runs on the server (merge_users in sql/merge_members.sql): one call per chunk matches users by email, updates
+# them with the tags unioned, and inserts the rest. Raises the APIError when merge_users isn't installed.
 def import_data(df: pd.DataFrame):
-    for index, row in df.iterrows():
-        first_name = row['first_name']
-        last_name = row['last_name']
-        email = row['email']
-        phone_number = row['phone_number']
-        address_city = row['address_city']
-        tags = row['tags'] # when not defined as an array use:  .split(',') 
+    df = df[['first_name', 'last_name', 'email', 'phone_number', 'address_city', 'tags']].reset_index(drop=True)
 
-        # Check if user already exists inside table
-        existing_user  = supabase.table("users").select("*").eq("first_name", first_name).execute()
+    # one row per email, repeated rows are folded together (tags merged). Rows without an email stay on their own.
+    groups = normalize_emails(df['email']).fillna(pd.Series(df.index.astype(str), index=df.index))
+    records, owner = collapse_duplicates(df.rename(columns={'tags': 'tag_list'}), groups)
+    records = records.rename(columns={'tag_list': 'tags'})
 
-        if existing_user.data:
-            # User exists, update their tags
-            user_id = existing_user.data[0]['id']
-            current_tags = existing_user.data[0]['tags']
-
-            try:
-                current_tags = current_tags+", "+tags # if user has existing tags
-            except:
-                current_tags = tags # if user has no tags
-
-            updated_tags = current_tags
-
-            supabase.table('users').update({'tags': updated_tags}).eq('id', user_id).execute()
-
-            # DEBUG
-            print('Updating tags for', user_id, email)
-
-        else:
-            # User does not exist, insert new record
-            new_user = {
-                "first_name": first_name,
-                "last_name": last_name,
-                "email": email,
-                "phone_number": phone_number,
-                "address_city": address_city,
-                "tags": tags
-            }
-            supabase.table('users').insert(new_user).execute()
-
-            # DEBUG
-            print('Creating new user', email)
+    result = merge_chunks(records, 'merge_users', key='id')
+    return result.loc[owner.values].set_index(df.index).rename(columns={'nationbuilder_id': 'id'})
 
 def uploadData(df):
     data = supabase.table("users").upsert(df).execute() # , on_conflict='email'
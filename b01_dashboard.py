@@ -2,28 +2,29 @@
 
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
+from supabase import Client
 from st_aggrid import AgGrid, GridOptionsBuilder
 from st_aggrid.shared import GridUpdateMode
 from io import BytesIO
 import os
+import db
+from importer import to_records
+import loader
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize Supabase client
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Shared Supabase client (see db)
+supabase: Client = db.client()
 
 # Load data from Supabase
 @st.cache_data(ttl=60)
 def load_data():
-    response = supabase.table('users').select('*').execute()
-    return pd.DataFrame(response.data)
+    return loader.load_data('users', key='id')
 
 def update_data(data):
-    for index, row in data.iterrows():
-        supabase.table('users').update(row.to_dict()).eq('id', row['id']).execute()
+    # JSON-safe rows: typed columns (timestamps, nullable ints) are converted back, see importer.to_records
+    for row in to_records(data):
+        supabase.table('users').update(row).eq('id', row['id']).execute()
 
 # Page 1: View, Filter, Edit, and Download Data
 def page_one():
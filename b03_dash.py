@@ -1,27 +1,28 @@
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
+from supabase import Client
 from st_aggrid import AgGrid, GridOptionsBuilder
 from st_aggrid.shared import GridUpdateMode
 from io import BytesIO
 import os
+import db
+from importer import to_records
+import loader
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize Supabase client
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Shared Supabase client (see db)
+supabase: Client = db.client()
 
 # Load data from Supabase
 @st.cache_data(ttl=60)
 def load_data():
-    response = supabase.table('user_data').select('*').execute()
-    return pd.DataFrame(response.data)
+    return loader.load_data('user_data', key='id')
 
 def update_data(data):
-    for index, row in data.iterrows():
-        supabase.table('user_data').update(row.to_dict()).eq('id', row['id']).execute()
+    # JSON-safe rows: typed columns (timestamps, nullable ints) are converted back, see importer.to_records
+    for row in to_records(data):
+        supabase.table('user_data').update(row).eq('id', row['id']).execute()
 
 def upload_data(df):
     for index, row in df.iterrows():
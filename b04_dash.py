@@ -1,29 +1,30 @@
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
+from supabase import Client
 from st_aggrid import AgGrid, GridOptionsBuilder
 from st_aggrid.shared import GridUpdateMode
 from io import BytesIO
 import os
+import db
+from importer import to_records
+import loader
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize Supabase client 
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Shared Supabase client (see db)
+supabase: Client = db.client()
 
 # Load data from Supabase
 @st.cache_data(ttl=60)
 def load_data(supabase_table):
-    response = supabase.table(supabase_table).select('*').execute()
-    return pd.DataFrame(response.data)
+    return loader.load_data(supabase_table)
 
 def update_data(data, supabase_table):
-    for index, row in data.iterrows():
+    # JSON-safe rows: typed columns (timestamps, nullable ints) are converted back, see importer.to_records
+    for index, row in enumerate(to_records(data)):
         #DEBUG
         st.write('updating:', index, row)
-        supabase.table(supabase_table).update(row.to_dict()).eq('nationbuilder_id', row['nationbuilder_id']).execute()
+        supabase.table(supabase_table).update(row).eq('nationbuilder_id', row['nationbuilder_id']).execute()
 
 def update_user(existing_user, new_data_on_user):
     row = new_data_on_user
@@ -1,128 +1,114 @@
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
+from supabase import Client
 from st_aggrid import AgGrid, GridOptionsBuilder
 from st_aggrid.shared import GridUpdateMode
 from io import BytesIO
 from datetime import datetime
 from dateutil import parser
 import os
+import db
+import csv_ingest
+import import_jobs
+import snapshot_cache
+import filters
+import grid_paging
+import export
+import grid_edits
+import schema
+import instrumentation
+import change_feed
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize Supabase client 
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Shared Supabase client (see db)
+supabase: Client = db.client()
 
-# Load data from Supabase
-# @st.cache_data
-def load_data(supabase_table):
-    response = supabase.table(supabase_table).select('*').execute()
-    return pd.DataFrame(response.data)
-
-# updates batch of users. Simply overwrites old data.
-def update_manyUsers(new_user_data, supabase_table_name):
-    for index, row in new_user_data.iterrows():
-        supabase.table(supabase_table_name).update(row.to_dict()).eq('nationbuilder_id', row['nationbuilder_id']).execute()
-
-# for a single user, combines old tag data with new tag data.
-def combine_tags(existing_user, new_data_on_user):
-    row = new_data_on_user
-
-    # For a given user, update their tag_list
-    current_tag_list = existing_user.data[0]['tag_list']
-
-    # if new tags are being added, process them:
-    tag_list = row['tag_list'] if 'tag_list' in row else []
-    if tag_list:
-
-        # Merge tags. Else if no prior tags, simply overwrite
-        if current_tag_list:
-            updated_tag_list = current_tag_list.split(',') + tag_list.split(',')
-
-        else:
-            updated_tag_list = tag_list.split(',')
-
-        # Remove spaces, only keep unique values, format list into human friendly string. 
-        updated_tag_list = [x.strip() for x in updated_tag_list]
-        updated_tag_list = list(set(updated_tag_list))
-        updated_tag_list = ', '.join(str(x) for x in updated_tag_list)
-        new_data_on_user['tag_list'] = updated_tag_list
-        #new_data_on_user.data[0]['tag_list'] = updated_tag_list
-    
-    return new_data_on_user
+SUPABASE_TABLE = 'db_2'
 
-# Processes CSV imports. Updates/Inserts user information.
-def upload_data(df, supabase_table):
+# edits made anywhere are pushed into the snapshot by the Realtime change feed instead of polled (see change_feed)
+change_feed.subscribe(SUPABASE_TABLE)
 
-    # List of rows that failed to upload. Shared as a report after. 
-    error_list = []
+# Parts of a page that rerun on their own when one of their widgets changes, instead of the whole app:
+# st.fragment, st.experimental_fragment before Streamlit 1.37.
+fragment = getattr(st, 'fragment', None) or st.experimental_fragment
 
-    # Loop through each row. Search for user, update user. If user not found, create new entry.
-    for index, row in df.iterrows():
-        
-     # search & match user by email
-        try:
-
-            # Check if user already exists
-            existing_user = supabase.table(supabase_table).select('*').eq('email', row['email']).execute()
-          
-            if existing_user.data: # if user exists: combine tags, then update that user
-                new_data_on_user = combine_tags(existing_user, row)
-
-                user_id = existing_user.data[0]['nationbuilder_id']                
-                supabase.table(supabase_table).update(new_data_on_user.to_dict()).eq('nationbuilder_id', user_id).execute()
-
-                         
-            else:
-                # User does not exist, insert new record
-                new_user = row.to_dict()
-                supabase.table(supabase_table).insert(new_user).execute()
-
-            
-            
-
-     # if no email, search & match user by phone number
-        except Exception as error_track:
-
-            st.write('DEBUG upload_data:',error_track)
-            st.write('---')
-
-            try:
-                # Check if user already exists
-                existing_user = supabase.table(supabase_table).select('*').eq('phone_number', row['phone_number']).execute()
-                if existing_user.data:
-                    # if user exists: combine tags, then update that user
-                    new_data_on_user = combine_tags(existing_user, row)
-                    user_id = existing_user.data[0]['nationbuilder_id']
-                    supabase.table(supabase_table).update(new_data_on_user.to_dict()).eq('nationbuilder_id', user_id).execute()
-                            
-                else:
-                    # User does not exist, insert new record
-                    new_user = row.to_dict()
-                    supabase.table(supabase_table).insert(new_user).execute()
-            
-     # neither email, nor phone number, show error
-            except: 
-                error_list += [row]
-
-     # display all the rows that had import errors
-    if error_list:
+# every rerun gets its own entry in the request log (see instrumentation and the Diagnostics page)
+instrumentation.start_run()
+instrumentation.serve_metrics()
+
+# Load data from Supabase. The first load reads the table page by page (with a progress bar), later reruns only
+# pull the rows that changed since (see snapshot_cache.load).
+def load_data(supabase_table):
+    progress_bar = st.empty()
+    def show_progress(loaded, total):
+        progress_bar.progress(min(loaded / total, 1.0), text=f'Loading data... {loaded}/{total} rows')
+
+    data = snapshot_cache.load(supabase_table, progress=show_progress)
+    progress_bar.empty()
+    return data
+
+# updates batch of users. Only the cells that differ from the loaded data are sent, see grid_edits.write_changes.
+# Returns the report of the changed rows (outcome and error per row).
+def update_manyUsers(new_user_data, supabase_table_name, loaded_data):
+    report = grid_edits.write_changes(loaded_data, new_user_data, supabase_table_name)
+    snapshot_cache.refresh_rows(supabase_table_name, report['nationbuilder_id'].tolist())
+    return report
+
+# Processes CSV imports. The upload becomes a background job (see import_jobs): the file is streamed in chunks and
+# every chunk is matched and written in bulk by a worker thread, so the session stays responsive. Returns the job id.
+def upload_data(uploaded_file, column_mapping, supabase_table):
+    job_id = import_jobs.submit(uploaded_file, column_mapping, supabase_table)
+    st.session_state['import_job'] = job_id
+    return job_id
+
+# Progress, throughput and rejected rows of an import job. While the job is queued or running only its panel
+# refreshes, every second (import_job_progress); the rest of the page stays as it is.
+def show_import_job(job_id):
+    job = import_jobs.get_job(job_id)
+    if job is None:
+        st.write(f'No import job {job_id}.')
+    elif job['status'] in ('queued', 'running'):
+        import_job_progress(job_id)
+    else:
+        import_job_panel(job)
+
+@fragment(run_every=1)
+def import_job_progress(job_id):
+    job = import_jobs.get_job(job_id)
+    # finished: one whole rerun shows the outcome and stops the refresh
+    if job['status'] not in ('queued', 'running'):
+        st.rerun()
+    import_job_panel(job)
+
+def import_job_panel(job):
+    job_id = job['id']
+    total = max(job['rows_total'], job['rows_done'], 1)
+    st.progress(min(job['rows_done'] / total, 1.0), text=f"Job {job_id} ({job['file_name']}): {job['status']} · {job['rows_done']}/{total} rows · {import_jobs.throughput(job):,.0f} rows/s")
+    st.write(f"Inserted: {job['inserted']} · Updated: {job['updated']} · Rejected: {job['rejected']}")
+
+    if job['status'] == 'failed':
+        st.error(f"Import stopped: {job['error']}")
+        if st.button('Retry', key=f'retry_{job_id}'):
+            import_jobs.retry(job_id)
+            st.rerun()
+
+    # display all the rows that had import errors, and the rows imported without an invalid value
+    if job['rejected']:
         st.title('(!) error uploading')
         st.write('Some of your data was not uploaded. Every line needs either an email or phone number. Please check & re-upload.')
-        st.dataframe(error_list)
+    errors = import_jobs.job_errors(job_id)
+    if not errors.empty:
+        st.dataframe(errors)
 
 # reorder columns of a dataset to display most relevant first. Uses standard items.  
+# (the grid gets its blocks in this order already, see grid_paging.display_columns)
 def reorder_columns(data, featured_columns):
-    # Using desired order to change column
-    df = data
-    featured_columns = ['nationbuilder_id', 'first_name', 'last_name', 'address_city', 'tag_list', 'email', 'phone_number']
-    df2 = df[ featured_columns + [ col for col in df.columns if col not in featured_columns]]
-    return df2
+    return data[grid_paging.display_columns(data.columns)]
 
 
 
+@instrumentation.timed('plot')
 def plot_line_graph(data, title, x_col, y_col, x_label, y_label):
     import streamlit as st
     import pandas as pd
@@ -166,6 +152,7 @@ def plot_line_graph(data, title, x_col, y_col, x_label, y_label):
     # Display the chart in Streamlit
     st.plotly_chart(fig, use_container_width=True)
 
+@instrumentation.timed('plot')
 def plot_bar_chart(data, title, x_col, y_col, x_label, y_label):
     import streamlit as st
     import pandas as pd
@@ -207,80 +194,76 @@ def plot_bar_chart(data, title, x_col, y_col, x_label, y_label):
 
 
 # Page 1: View, Filter, Edit, and Download Data
-def page_one(supabase_table):
+# The filters, the grid and the export are one fragment: typing a filter or paging reruns it only, and the export
+# always offers the rows the grid shows (a separate fragment would keep a download of the previous filters).
+@instrumentation.timed('page')
+def page_one(supabase_table=SUPABASE_TABLE):
     st.title("Manage User's Data")
-    
-    # Load data & re-order
-    data = load_data(supabase_table)
-    data = reorder_columns(data, 'standard')
-    #csv_data = data.to_csv(index=False).encode()
-
- 
-    # Filter setup            
-    full_tag_list = data['tag_list'].str.split(',').explode().unique()
-    preselected_tags = []
-    
-    
-    # Filter options
-    st.sidebar.subheader('Filter Data')
-    filter_firstname = st.sidebar.text_input('First name')
-    filter_lastname = st.sidebar.text_input('Last name')
-    filter_city = st.sidebar.text_input('City')
-    filter_tag = st.sidebar.multiselect("Tags", full_tag_list, preselected_tags)
-
-
-    if filter_firstname:
-        data = data[data['first_name'].str.contains(filter_firstname, case=False, na=False)]
-
-    if filter_lastname:
-        data = data[data['last_name'].str.contains(filter_lastname, case=False, na=False)]
-
-    if filter_city:
-        data = data[data['address_city'].str.contains(filter_city, case=False, na=False)]
-    
-    if filter_tag:
-
-        st.title('Table 1')
-        data2 = data['tag_list'].str.split(',')
-        st.write(data2)
-
-        st.title('Filter 1')
-        data = data[data['tag_list'].apply(lambda x: filter_tag in x)]
-
-        # Simple text search within the tags
-        # Search by multiple tags
-        # data2 = data['tag_list'].str.split(',').explode() #.to_list()
-        # data = data[data['tag_list'].str.contains(filter_tag, case=False, na=False)]
-
-        
-
-
+    # the first load of the table, with its progress bar; the grid then works on the snapshot
+    if snapshot_cache.version(supabase_table) is None:
+        load_data(supabase_table)
+    member_grid(supabase_table)
 
 
-    # Display the filtered users
+@fragment
+@instrumentation.timed('fragment')
+def member_grid(supabase_table):
+    # Filter setup: tag options come from the inverted tag index, built once per data load
+    full_tag_list = snapshot_cache.tag_index(supabase_table).tags()
+    preselected_tags = []
 
-        
+    # Filter options (in the page, fragments can't write to the sidebar)
+    with st.expander('Filter Data', expanded=True):
+        search = st.text_input('Search anything', help='Names, email and city. Accents and small typos are ignored.')
+        col1, col2, col3 = st.columns(3)
+        filter_firstname = col1.text_input('First name')
+        filter_lastname = col2.text_input('Last name')
+        filter_city = col3.text_input('City')
+        col1, col2 = st.columns([3, 1])
+        filter_tag = col1.multiselect("Tags", full_tag_list, preselected_tags)
+        tag_mode = col2.radio('Users with', ['all selected tags', 'any selected tag'])
+        col1, col2 = st.columns(2)
+        page_size = col1.selectbox('Rows per page', [50, 100, 500, 1000], index=1)
+        page_number = col2.number_input('Page', min_value=1, value=1, step=1)
+
+    # Only the visible block of rows is sent to the grid. Filters and the grid's own sort and column filters
+    # (kept in the session from the last grid event) are answered from the snapshot or with a ranged query, see grid_paging.
+    grid_state = st.session_state.get('grid_state', {})
+    predicates = filters.compile_filters({'search': search, 'first_name': filter_firstname, 'last_name': filter_lastname,
+                                          'city': filter_city, 'tags': filter_tag,
+                                          'tag_mode': 'or' if tag_mode == 'any selected tag' else 'and'})
+    predicates += grid_paging.grid_predicates(grid_state)
+    order = grid_paging.grid_order(grid_state)
+    data, total_rows = grid_paging.fetch_block(supabase_table, predicates, order, page_number - 1, page_size)
+    st.caption(f'{total_rows} matching users · page {page_number} of {max(1, -(-total_rows // page_size))}')
 
 
     # Editable data grid
     #st.subheader("User Data")
     gb = GridOptionsBuilder.from_dataframe(data)
-    gb.configure_pagination()
-    gb.configure_default_column(editable=True)
+    gb.configure_default_column(editable=True, sortable=True, filter=True)
     grid_options = gb.build()
+    grid_options['initialState'] = grid_state
 
     grid_response = AgGrid(
         data,
         gridOptions=grid_options,
         update_mode=GridUpdateMode.MODEL_CHANGED,
+        update_on=['sortChanged', 'filterChanged'],
         allow_unsafe_jscode=True
     )
 
+    # a new sort or column filter in the grid: fetch the block again with it
+    new_grid_state = {name: (grid_response.grid_state or {}).get(name) for name in ('sort', 'filter')}
+    if new_grid_state != {name: grid_state.get(name) for name in ('sort', 'filter')}:
+        st.session_state['grid_state'] = new_grid_state
+        st.rerun()
+
     updated_data = grid_response['data']
     selected_rows = grid_response['selected_rows']
 
-   # Create three buttons in three columns side by side
-    col1, col2, col3 = st.columns(3)
+   # Create two buttons side by side
+    col1, col2 = st.columns(2)
 
 
     with col1:
@@ -290,66 +273,87 @@ def page_one(supabase_table):
     with col2: # update data
         if st.button("Update data"):
 
-            # remove artificially added column
-            try:
-                updated_data = updated_data.drop('created_date', axis=1)
-            except:
-                updated_data = updated_data
+            # only columns that were loaded are compared, so the artificially added 'created_date' is ignored
+            report = update_manyUsers(pd.DataFrame(updated_data), supabase_table, data)
+            failed = report[report['outcome'] == 'failed']
+            st.success(f"Data updated successully! {len(report) - len(failed)} rows changed.")
+            if not failed.empty:
+                st.warning(f'{len(failed)} rows could not be updated:')
+                st.dataframe(failed[['nationbuilder_id', 'error']])
 
-            update_manyUsers(pd.DataFrame(updated_data), supabase_table)
-            st.success('Data updated successully!')
-        
+    member_export(supabase_table, predicates, order, total_rows)
 
 
-    # preparing data for export:
-    csv_data = data.to_csv(index=False).encode()
+# export of every matching user (not just this page), built only on request and cached, see export.export
+def member_export(supabase_table, predicates, order, total_rows):
+    col1, col2 = st.columns(2)
+    export_format = col1.selectbox('Export format', export.available_formats(), label_visibility='collapsed')
+    export_path = export.cached_path(supabase_table, predicates, order, export_format)
+    if export_path is None and col2.button('Prepare export'):
+        export_path = export.export(supabase_table, predicates, order, export_format)
 
-    with col3:
-        st.download_button(
-        label="Download as CSV",
-        data=csv_data,
-        file_name='user_data.csv',
-        mime='text/csv')
+    if export_path is not None:
+        mime, extension = export.FORMATS[export_format]
+        with open(export_path, 'rb') as export_file:
+            col2.download_button(
+            label=f"Download {total_rows} users as {export_format.upper()}",
+            data=export_file,
+            file_name=f'user_data.{extension}',
+            mime=mime)
 
 
 # Page 2: Key Statistics
-def page_two(supabase_table):
+# Each chart is a fragment with its own options, changing them redraws that chart only.
+@instrumentation.timed('page')
+def page_two(supabase_table=SUPABASE_TABLE):
     st.title("User Statistics")
     
-    data = load_data(supabase_table)
+    # every figure comes from precomputed summary tables, kept current from row deltas (see member_stats)
+    stats = snapshot_cache.member_stats(supabase_table)
 
     st.subheader("Total Number of Users")
-    total_users = data.shape[0]
+    total_users = stats.total
     st.write(total_users)
 
     st.subheader("Number of Users with Phone Numbers")
-    users_with_phones = data['phone_number'].dropna().nunique()
+    users_with_phones = stats.users_with_phones()
     st.write(users_with_phones)
 
     st.subheader("Most Popular Cities")
-    popular_cities = data['address_city'].value_counts().head(10).reset_index()
-    plot_bar_chart(data=popular_cities, title='Cities', x_col='address_city', y_col='count', x_label='City', y_label='#')
-    st.write(popular_cities)
+    cities_chart(supabase_table)
 
 
     st.subheader("Most Popular Tags")
-    # tags cleanly separated. Useful for reference and use.
-    all_tags_separated = data['tag_list'].str.split(',')
-
-    # frequency of tags. For combinations of tags remove [str.split()]
-    all_tags = data['tag_list'].str.split(', ').explode().value_counts()
+    # frequency of tags
+    all_tags = stats.popular_tags()
     st.write(all_tags)
 
-    # when users signed up
+    # when users signed up, per year-week
     st.subheader('Signup Trends')
-    # convert to datetime, extract weeknum & monthnum
-    data['created_at'] = pd.to_datetime(data['created_at'])
-    data['created_at_week'] = data['created_at'].dt.strftime('%U')
-    data['created_at_month'] =  data['created_at'].dt.month    
-    df_weeknum = data.groupby(['created_at_week']).count() # index displays week_num
-    df_weeknum = df_weeknum['email']  # only select one column to show count_number
-    df_weeknum = df_weeknum.reset_index()
-    plot_line_graph(data=df_weeknum, title='Signup Trends', x_col='created_at_week', y_col='email', x_label='Signup week', y_label='# signups')
+    signups_chart(supabase_table)
+
+
+@fragment
+@instrumentation.timed('fragment')
+def cities_chart(supabase_table):
+    city_count = st.slider('Cities shown', min_value=5, max_value=50, value=10, step=5)
+    popular_cities = snapshot_cache.member_stats(supabase_table).popular_cities(city_count)
+    plot_bar_chart(data=popular_cities, title='Cities', x_col='address_city', y_col='count', x_label='City', y_label='#')
+    st.write(popular_cities)
+
+
+# Signup weeks shown -> number of weeks (None = all)
+SIGNUP_PERIODS = {'All time': None, 'Last year': 52, 'Last 3 months': 13}
+
+
+@fragment
+@instrumentation.timed('fragment')
+def signups_chart(supabase_table):
+    period = st.radio('Period', list(SIGNUP_PERIODS), horizontal=True)
+    df_weeknum = snapshot_cache.member_stats(supabase_table).weekly_signups()
+    if SIGNUP_PERIODS[period] is not None:
+        df_weeknum = df_weeknum.tail(SIGNUP_PERIODS[period])
+    plot_line_graph(data=df_weeknum, title='Signup Trends', x_col='created_at_week', y_col='signups', x_label='Signup week', y_label='# signups')
     st.write(df_weeknum)
 
 
@@ -358,12 +362,14 @@ def page_two(supabase_table):
 
     
 # Page 3: Upload CSV and Match Columns
-def page_three(supabase_table):
+@instrumentation.timed('page')
+def page_three(supabase_table=SUPABASE_TABLE):
     st.title("Upload CSV Data")
 
     uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
     if uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
+        # only the first rows are parsed here, the whole file is streamed at upload time
+        df = csv_ingest.preview(uploaded_file)
         st.subheader("1. Upload Data")
         st.write('Here is the file you uploaded:')
         st.write(df.head())
@@ -391,29 +397,58 @@ def page_three(supabase_table):
         st.subheader("3. Review & Send to Database")
         st.write(df.head())
 
-        if st.button('Upload Data'):
-            upload_data(df[selected_columns],supabase_table)
-            st.success('Data uploaded successfully!')
-
-        
-
-# Sidebar Navigation
-st.sidebar.title("Navigation")
-page = st.sidebar.radio("Go to", ["Manage Database", "Key Stats", "Import Data", 'Bonus'])
-
-supabase_table = 'db_2'
-
-if page == "Manage Database":
-    page_one(supabase_table)
-elif page == "Key Stats":
-    page_two(supabase_table)
-elif page == "Import Data":
-    page_three(supabase_table)
-else:
+        if st.button('Upload Data') and column_mapping:
+            upload_data(uploaded_file, column_mapping, supabase_table)
+            st.success('Import started. It keeps running if you leave this page.')
+
+    # Import jobs run in the background, pick any of them to follow its progress
+    st.subheader("Import Jobs")
+    jobs = import_jobs.list_jobs()
+    if jobs:
+        job_ids = [job['id'] for job in jobs]
+        current = st.session_state.get('import_job', job_ids[0])
+        job_id = st.selectbox('Job', job_ids, index=job_ids.index(current) if current in job_ids else 0,
+                              format_func=lambda job_id: next(f"#{job['id']} {job['file_name']} ({job['status']})" for job in jobs if job['id'] == job_id))
+        st.session_state['import_job'] = job_id
+        show_import_job(job_id)
+    else:
+        st.write('No imports yet.')
+
+
+# Hidden page: Supabase calls and section timings of the previous rerun. Open the app with ?diagnostics=1 to see it.
+def page_diagnostics():
+    st.title("Diagnostics")
+    run = instrumentation.last_run()
+    if run is None:
+        st.write('No rerun recorded yet.')
+        return
+
+    calls = instrumentation.calls_frame(run)
+    st.caption(f"Previous rerun: {len(calls)} Supabase calls, {calls['seconds'].sum():.2f}s in requests, "
+               f"{calls['rows'].sum()} rows, {(calls['bytes_sent'].sum() + calls['bytes_received'].sum()) / 1e6:.2f} MB")
+
+    st.subheader("Slowest Calls")
+    st.dataframe(instrumentation.slowest_calls(run))
+
+    st.subheader("N+1 Patterns")
+    st.caption(f'The same query shape sent at least {instrumentation.N_PLUS_ONE_CALLS} times with different values.')
+    st.dataframe(instrumentation.n_plus_one(run))
+
+    st.subheader("Pages and Charts")
+    st.dataframe(instrumentation.sections(run))
+
+
+# Bonus page: the whole table
+def page_bonus(supabase_table=SUPABASE_TABLE):
     st.subheader('Select a page')
     st.text('Review database:')
     st.dataframe(load_data(supabase_table))
 
+    # memory saved by the typed columns (see schema.cast), measured on the last full load
+    memory = schema.memory_report(supabase_table)
+    if memory:
+        st.caption(f'Memory: {memory[1] / 1e6:.1f} MB typed, {memory[0] / 1e6:.1f} MB as loaded ({1 - memory[1] / memory[0]:.0%} saved)')
+
     # REORDER COLUMNS
     # data = load_data(supabase_table)
     # data = reorder_columns(data, 'standard')
@@ -424,3 +459,13 @@ else:
     
 
 
+# Navigation: a multipage app, only the selected page runs on a rerun. The app's root opens Manage Database, or
+# the page named by ?page=<url_path>.
+start_page = st.query_params.get('page', 'manage')
+pages = [st.Page(page_one, title="Manage Database", url_path='manage', default=start_page == 'manage'),
+         st.Page(page_two, title="Key Stats", url_path='stats', default=start_page == 'stats'),
+         st.Page(page_three, title="Import Data", url_path='import', default=start_page == 'import'),
+         st.Page(page_bonus, title='Bonus', url_path='bonus', default=start_page == 'bonus')]
+if st.query_params.get('diagnostics'):
+    pages.append(st.Page(page_diagnostics, title='Diagnostics', url_path='diagnostics'))
+st.navigation(pages).run()
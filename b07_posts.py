@@ -0,0 +1,93 @@
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+import snapshot_cache
+import thumbnails
+import change_feed
+from post_stats import ACCOUNTS, TOP_K
+from dotenv import load_dotenv
+load_dotenv()
+
+# Instagram posts dashboard (see Plan): key stats per account, weekly evolution and "Top Posts of the Week".
+# Every figure is read from the precomputed weekly rollup and top posts of post_stats, kept current from row deltas
+# by snapshot_cache, so rendering doesn't depend on the number of posts.
+
+supabase_table = 'posts'
+
+# new and edited posts are pushed into the snapshot (and the weekly rollup) by the Realtime change feed
+change_feed.subscribe(supabase_table, key='id')
+
+
+def format_rate(rate):
+    return '–' if pd.isna(rate) else f'{rate:.2%}'
+
+
+# Three wide grid of posts: image, likes, engagement rate and a link to the post.
+# Images are served from the local thumbnail cache (see thumbnails), all of the grid's misses fetched at once.
+def show_posts_grid(posts):
+    if posts.empty:
+        st.write('No posts this week.')
+        return
+
+    images = thumbnails.thumbnails(posts['image_link'].tolist()) if 'image_link' in posts.columns else {}
+    columns = st.columns(3)
+    for position, post in enumerate(posts.itertuples(index=False)):
+        with columns[position % 3]:
+            image = images.get(getattr(post, 'image_link', None))
+            if image is not None:
+                st.image(image, use_column_width=True)
+            st.write(f'**{post.account}** · ❤️ {post.likes:,} · 💬 {post.comments:,}')
+            st.write(f'Engagement rate: {format_rate(post.engagement_rate)}')
+            if pd.notna(getattr(post, 'post_link', None)):
+                st.markdown(f'[View on Instagram]({post.post_link})')
+
+
+def plot_evolution(data, y_col, title, y_label):
+    fig = px.line(data, x='week', y=y_col, color='account', title=title, labels={y_col: y_label, 'week': 'Week'}, markers=True)
+    fig.update_layout(plot_bgcolor='white', paper_bgcolor='white', yaxis=dict(showgrid=True, gridcolor='#E5ECF6'))
+    st.plotly_chart(fig, use_container_width=True)
+
+
+# Page 1: key stats and top posts of one account
+def page_one(stats):
+    st.title("Account Statistics")
+    account = st.selectbox('Account', ACCOUNTS)
+
+    key_stats = stats.key_stats(account)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric('Posts', f"{key_stats['posts']:,.0f}")
+    col2.metric('Avg. likes per post', '–' if pd.isna(key_stats['avg_likes']) else f"{key_stats['avg_likes']:,.0f}")
+    col3.metric('Avg. comments per post', '–' if pd.isna(key_stats['avg_comments']) else f"{key_stats['avg_comments']:,.0f}")
+    col4.metric('Avg. engagement rate', format_rate(key_stats['avg_engagement']))
+
+    week = stats.latest_week(account)
+    st.subheader('Top Posts of the Week' + (f" ({week:%d %b %Y})" if week is not None else ''))
+    show_posts_grid(stats.top_posts(account, week, TOP_K))
+
+
+# Page 2: weekly evolution of the key stats and top posts across the accounts
+def page_two(stats):
+    st.title("Evolution Over Time")
+    evolution = stats.weekly_evolution(ACCOUNTS)
+    if evolution.empty:
+        st.write('No posts yet.')
+    else:
+        plot_evolution(evolution, 'posts', 'Posts per Week', '# posts')
+        plot_evolution(evolution, 'avg_likes', 'Average Likes per Post', 'Likes')
+        plot_evolution(evolution, 'avg_comments', 'Average Comments per Post', 'Comments')
+        plot_evolution(evolution, 'avg_engagement', 'Average Engagement Rate', 'Engagement rate')
+
+    week = stats.latest_week(ACCOUNTS)
+    st.subheader('Top Posts of the Week' + (f" ({week:%d %b %Y})" if week is not None else ''))
+    show_posts_grid(stats.top_posts(ACCOUNTS, week, TOP_K))
+
+
+# Sidebar Navigation
+st.sidebar.title("Navigation")
+page = st.sidebar.radio("Go to", ["Accounts", "Evolution"])
+
+stats = snapshot_cache.post_stats(supabase_table)
+if page == "Accounts":
+    page_one(stats)
+else:
+    page_two(stats)
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+import supabase
+from streamlit.testing.v1 import AppTest
+import db
+import snapshot_cache
+import instrumentation
+from bench_suite import make_members
+from fake_supabase import FakeStore, FakeClient, FakeAsyncClient
+
+# Benchmark: latency of dashboard interactions with streamlit.testing AppTest, over the Supabase fake, for this
+# dashboard (b06_dash) and the baseline one (b06_dash.py of BASELINE_COMMIT, read with git show, its create_client
+# pointed at the same fake). For every interaction the same change is made in both apps and timed wall-clock:
+#   baseline_s     the baseline script rerun (it had no fragments: every interaction reran everything)
+#   full_rerun_s   this script rerun as a whole (AppTest always reruns the whole script, as a page load does)
+#   fragment_s     the time of the fragment holding the widget within that same run (its 'fragment' section, see
+#                  instrumentation.timed): what the interaction reruns in the browser, without Streamlit's own
+#                  overhead of running the script
+# Every number is the median of REPEATS runs after one untimed run of the same change, which pays the one-time
+# costs (the search index is built on the first search, for example). Widgets the baseline doesn't have are n/a.
+# Usage: python bench_app.py [rows] [output.json]
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(DIRECTORY, 'b06_dash.py')
+
+BASELINE_COMMIT = 'a290712'
+
+REPEATS = 3
+
+# (page, widget kind, widget label, value, fragment holding the widget). No widget: opening the page.
+INTERACTIONS = [('manage', None, None, None, None),
+                ('manage', 'text_input', 'First name', 'ma', 'member_grid'),
+                ('manage', 'text_input', 'Last name', 'ro', 'member_grid'),
+                ('manage', 'text_input', 'City', 'ro', 'member_grid'),
+                ('manage', 'text_input', 'Search anything', 'mario', 'member_grid'),
+                ('manage', 'number_input', 'Page', 3, 'member_grid'),
+                ('manage', 'selectbox', 'Export format', 'parquet', 'member_grid'),
+                ('stats', None, None, None, None),
+                ('stats', 'slider', 'Cities shown', 20, 'cities_chart'),
+                ('stats', 'radio', 'Period', 'Last year', 'signups_chart')]
+
+# Pages of the baseline's sidebar radio, and the page opened in between to time opening another one.
+BASELINE_PAGES = {'manage': 'Manage Database', 'stats': 'Key Stats', 'import': 'Import Data'}
+
+
+def widget(app, kind, label):
+    return next((element for element in getattr(app, kind) if element.label == label), None)
+
+
+# Rerun the app and return (wall time of the whole script, sections of the run).
+def rerun(app):
+    start = time.perf_counter()
+    app.run()
+    wall = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    instrumentation.start_run()
+    return wall, instrumentation.sections(instrumentation.last_run())
+
+
+# Go to a page, untimed. This app's pages are st.Page functions, AppTest.switch_page only knows page files: it is
+# opened with ?page=. The baseline has a radio in the sidebar.
+def open_page(app, page, baseline):
+    if baseline:
+        widget(app, 'radio', 'Go to').set_value(BASELINE_PAGES[page])
+    else:
+        app.query_params['page'] = page
+    rerun(app)
+
+
+# Median (wall seconds, fragment seconds) of one interaction, or None when the app doesn't have the widget.
+def time_interaction(app, page, kind, label, value, fragment, baseline):
+    open_page(app, page, baseline)
+    if kind is not None and widget(app, kind, label) is None:
+        return None
+    previous = widget(app, kind, label).value if kind is not None else None
+
+    walls, fragments = [], []
+    for _ in range(REPEATS + 1):
+        if kind is None:
+            open_page(app, 'import', baseline)
+            if baseline:
+                widget(app, 'radio', 'Go to').set_value(BASELINE_PAGES[page])
+            else:
+                app.query_params['page'] = page
+        else:
+            widget(app, kind, label).set_value(value)
+        wall, sections = rerun(app)
+        walls.append(wall)
+        fragments.append(sections.loc[sections['name'] == fragment, 'seconds'].sum() if fragment else wall)
+        if kind is not None:
+            widget(app, kind, label).set_value(previous)
+            rerun(app)
+    # the first run pays the one-time costs
+    return statistics.median(walls[1:]), statistics.median(fragments[1:])
+
+
+# The baseline dashboard, written next to the work files.
+def baseline_script(work_dir):
+    source = subprocess.run(['git', 'show', f'{BASELINE_COMMIT}:b06_dash.py'], cwd=DIRECTORY, capture_output=True, check=True).stdout
+    path = os.path.join(work_dir, 'b06_dash_baseline.py')
+    with open(path, 'wb') as file:
+        file.write(source)
+    return path
+
+
+def run(rows):
+    members = make_members(rows)
+    store = FakeStore({'db_2': members}, keys={'db_2': 'nationbuilder_id'})
+    db.set_clients(FakeClient(store), FakeAsyncClient(store))
+    work_dir = tempfile.mkdtemp(prefix='bench_app_')
+    snapshot_cache.SNAPSHOT_DIR = os.path.join(work_dir, 'snapshots')
+    create_client = supabase.create_client
+    # the baseline creates its own client: the same fake
+    supabase.create_client = lambda url, key: FakeClient(store)
+    results = []
+    try:
+        snapshot_cache.load('db_2')
+        app = AppTest.from_file(SCRIPT, default_timeout=300)
+        baseline = AppTest.from_file(baseline_script(work_dir), default_timeout=300)
+        baseline.run()
+        for page, kind, label, value, fragment in INTERACTIONS:
+            name = label or f'open {page}'
+            before = time_interaction(baseline, page, kind, label, value, fragment, baseline=True)
+            wall, fragment_seconds = time_interaction(app, page, kind, label, value, fragment, baseline=False)
+            results.append({'page': page, 'interaction': name, 'fragment': fragment,
+                            'baseline_s': None if before is None else round(before[0], 4),
+                            'full_rerun_s': round(wall, 4), 'fragment_s': round(fragment_seconds, 4) if fragment else None})
+            print(f"{name:<16} baseline {'n/a' if before is None else f'{before[0]:.3f}s':>8}   full rerun {wall:7.3f}s"
+                  + (f'   {fragment} {fragment_seconds:7.3f}s' if fragment else ''), file=sys.stderr)
+    finally:
+        supabase.create_client = create_client
+        snapshot_cache._snapshots.pop('db_2', None)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    output = sys.argv[2] if len(sys.argv) > 2 else None
+
+    report = {'rows': rows, 'baseline': BASELINE_COMMIT, 'repeats': REPEATS, 'results': run(rows)}
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
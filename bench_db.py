@@ -0,0 +1,36 @@
+import time
+import db
+import loader
+from importer import chunks, LOOKUP_CHUNK_SIZE
+
+# Benchmark: the same reads sent one after the other on the sync client vs concurrently on the shared async client.
+# Runs read-only queries against the configured Supabase project (SUPABASE_URL / SUPABASE_KEY).
+# Usage: python bench_db.py [table] [key]
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    import sys
+    supabase_table = sys.argv[1] if len(sys.argv) > 1 else 'db_2'
+    key = sys.argv[2] if len(sys.argv) > 2 else 'nationbuilder_id'
+
+    # whole table: sequential keyset pages vs concurrent key ranges
+    serial, serial_time = timed(lambda: loader.concat_pages(list(loader.iter_pages(supabase_table, key))))
+    concurrent, concurrent_time = timed(lambda: loader.load_data(supabase_table, key))
+    print(f'table: {supabase_table}  rows: {len(concurrent)}  max concurrency: {db.MAX_CONCURRENCY}')
+    print(f'load (serial pages):      {serial_time:.3f}s')
+    print(f'load (concurrent ranges): {concurrent_time:.3f}s')
+
+    # import lookups: in_() chunks one by one vs all at once
+    ids = concurrent[key].tolist() if len(concurrent) else []
+    builders = [lambda client, chunk=chunk: client.table(supabase_table).select('*').in_(key, chunk) for chunk in chunks(ids, LOOKUP_CHUNK_SIZE)]
+    _, serial_time = timed(lambda: [build(db.client()).execute() for build in builders])
+    _, concurrent_time = timed(lambda: db.execute_all(builders))
+    print(f'lookups ({len(builders)} chunks of {LOOKUP_CHUNK_SIZE}):')
+    print(f'  serial:     {serial_time:.3f}s')
+    print(f'  concurrent: {concurrent_time:.3f}s')
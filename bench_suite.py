@@ -0,0 +1,200 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+from faker import Faker
+from faker.providers.address.it_IT import Provider as ItalianAddresses
+import db
+import loader
+import filters
+import grid_edits
+import grid_paging
+import csv_ingest
+import snapshot_cache
+from fake_supabase import FakeStore, FakeClient, FakeAsyncClient
+
+# Benchmark suite for the dashboard's data paths (b06_dash), run against an in-process fake of the Supabase API
+# (fake_supabase) filled with synthetic members. For every scale it times the work behind load_data, the page_one
+# filters, the page_two stats, update_manyUsers and upload_data, and records wall time, requests sent and the step's
+# peak RSS. Every scale runs in its own process, so memory held from an earlier scale doesn't count, and on Linux the
+# peak is reset before every step (see reset_peak_rss); elsewhere it is the peak of the scale's run up to that step.
+# Results are printed (or written) as JSON, so runs can be compared across changes.
+# Usage: python bench_suite.py [scales] [output.json] [latency seconds per request]
+#   e.g. python bench_suite.py 1000,10000,100000,1000000 results.json 0.005
+
+SCALES = [1_000, 10_000, 100_000]
+
+TAGS = ['TV', 'Donatore', 'Supervolontario', 'Volantinaggio', 'Evento Milano', 'Newsletter', 'Iscritto', 'Banchetto']
+
+
+# Synthetic db_2 members. Faker draws pools of Italian names and cities, numpy combines them (Faker per row would
+# take minutes at 1M rows). Emails are unique, ~20% of members have no phone number, cities are skewed.
+def make_members(rows, seed=0):
+    fake = Faker('it_IT')
+    fake.seed_instance(seed)
+    rng = np.random.default_rng(seed)
+    first_names = np.array([fake.first_name() for _ in range(300)], dtype=object)
+    last_names = np.array([fake.last_name() for _ in range(600)], dtype=object)
+    # the provider keeps its cities in a set: sorted first, so the draw doesn't depend on hash order
+    cities = rng.choice(np.array(sorted(ItalianAddresses.cities), dtype=object), 300, replace=False)
+    city_weights = 1 / np.arange(1, len(cities) + 1)
+
+    first = pd.Series(rng.choice(first_names, rows), dtype='string')
+    last = pd.Series(rng.choice(last_names, rows), dtype='string')
+    ids = pd.Series(np.arange(1, rows + 1))
+    email = first.str.lower().str.replace(r'[^a-z]', '', regex=True) + '.' + last.str.lower().str.replace(r'[^a-z]', '', regex=True) + ids.astype('string') + '@example.com'
+    phone = ('3' + pd.Series(rng.integers(100_000_000, 999_999_999, rows)).astype('string')).mask(rng.random(rows) < 0.2)
+    tag_counts = rng.integers(0, 4, rows)
+    tag_list = pd.Series([', '.join(rng.choice(TAGS, count, replace=False)) for count in tag_counts]).replace('', None)
+    created = pd.Timestamp.now(tz='UTC') - pd.to_timedelta(rng.integers(0, 3 * 365 * 86400, rows), unit='s')
+    created_at = pd.Series(created.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00'))
+
+    return pd.DataFrame({'nationbuilder_id': ids, 'first_name': first.astype(object), 'last_name': last.astype(object),
+                         'email': email.astype(object), 'phone_number': phone.astype(object),
+                         'address_city': rng.choice(cities, rows, p=city_weights / city_weights.sum()),
+                         'tag_list': tag_list, 'created_at': created_at, 'updated_at': created_at})
+
+
+# CSV upload of `rows` lines: half are existing members (same email, a new tag), half are new people.
+def make_upload(members, rows, seed=1):
+    rng = np.random.default_rng(seed)
+    existing = members.sample(min(rows // 2, len(members)), random_state=seed)[['first_name', 'last_name', 'email', 'phone_number', 'address_city']]
+    existing = existing.assign(tag_list='Import ' + str(seed))
+    new = make_members(rows - len(existing), seed=seed + 100).drop(columns=['nationbuilder_id', 'created_at', 'updated_at'])
+    new['email'] = 'new.' + new['email']
+    new['phone_number'] = None
+    upload = pd.concat([existing, new], ignore_index=True).sample(frac=1, random_state=seed)
+    upload.columns = ['First Name', 'Last Name', 'Email', 'Phone', 'City', 'Tags']
+    return io.BytesIO(upload.to_csv(index=False).encode())
+
+
+UPLOAD_MAPPING = {'First Name': 'first_name', 'Last Name': 'last_name', 'Email': 'email', 'Phone': 'phone_number',
+                  'City': 'address_city', 'Tags': 'tag_list'}
+
+
+# Peak RSS in MB since the last reset_peak_rss(): the kernel's high-water mark (VmHWM) on Linux, otherwise the
+# process peak so far.
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Start a new peak at the current RSS (Linux only: writing 5 to clear_refs resets VmHWM). True if it was reset.
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# Run one step and record its wall time, the requests it sent (per table and operation), its peak RSS and (with a
+# per-step peak) the RSS it started from.
+def measure(store, results, scale, step, function):
+    before = dict(store.requests)
+    # right after a reset the peak is the current RSS: what the step starts from
+    per_step = reset_peak_rss()
+    rss_before = peak_rss_mb() if per_step else None
+    start = time.perf_counter()
+    result = function()
+    wall = time.perf_counter() - start
+    requests = {f'{table}.{operation}': count - before.get((table, operation), 0)
+                for (table, operation), count in store.requests.items() if count != before.get((table, operation), 0)}
+    results.append({'scale': scale, 'step': step, 'wall_s': round(wall, 4), 'requests': sum(requests.values()),
+                    'requests_by_call': requests, 'peak_rss_mb': round(peak_rss_mb(), 1),
+                    'rss_before_mb': None if rss_before is None else round(rss_before, 1), 'peak_rss_per_step': per_step})
+    print(f'{scale:>9,}  {step:<32} {wall:8.3f}s  {sum(requests.values()):6} requests', file=sys.stderr)
+    return result
+
+
+# page_one: the sidebar filters and a grid sort, one 100 row block each.
+def page_one_filters(supabase_table, data):
+    city = data['address_city'].mode().iloc[0]
+    states = [{'city': str(city)}, {'tags': ['Donatore']}, {'tags': ['TV', 'Newsletter'], 'tag_mode': 'or'},
+              {'first_name': 'ma', 'last_name': 'ro'}, {'search': 'mario rossi'}]
+    for state in states:
+        grid_paging.fetch_block(supabase_table, filters.compile_filters(state), order=[('last_name', False)])
+
+
+# page_two: the summary tables and every figure shown.
+def page_two_stats(supabase_table):
+    stats = snapshot_cache.member_stats(supabase_table)
+    return stats.total, stats.users_with_phones(), stats.popular_cities(10), stats.popular_tags(), stats.weekly_signups()
+
+
+# update_manyUsers: edit the tags of every 10th row of a 1000 row grid block, write the changes, refresh the snapshot.
+def update_many(supabase_table):
+    block, _ = grid_paging.fetch_block(supabase_table, [], page_size=1000)
+    edited = block.copy()
+    edited.loc[edited.index[::10], 'tag_list'] = 'Benchmark'
+    report = grid_edits.write_changes(block, edited, supabase_table)
+    snapshot_cache.refresh_rows(supabase_table, report['nationbuilder_id'].tolist())
+    return report
+
+
+def run_scale(scale, latency=0.0, supabase_table='db_2'):
+    members = make_members(scale)
+    store = FakeStore({supabase_table: members}, keys={supabase_table: 'nationbuilder_id'}, latency=latency)
+    db.set_clients(FakeClient(store), FakeAsyncClient(store))
+    work_dir = tempfile.mkdtemp(prefix='bench_suite_')
+    snapshot_cache.SNAPSHOT_DIR = os.path.join(work_dir, 'snapshots')
+    csv_ingest.CHECKPOINT_DIR = os.path.join(work_dir, 'imports')
+    snapshot_cache._snapshots.pop(supabase_table, None)
+    results = []
+    try:
+        # without a snapshot page_one pages on the server
+        measure(store, results, scale, 'page_one filters (server)', lambda: page_one_filters(supabase_table, members))
+        data = measure(store, results, scale, 'load_data (cold)', lambda: snapshot_cache.load(supabase_table))
+        snapshot_cache._snapshots.pop(supabase_table, None)
+        measure(store, results, scale, 'load_data (restart, disk)', lambda: snapshot_cache.load(supabase_table))
+        measure(store, results, scale, 'load_data (warm)', lambda: snapshot_cache.load(supabase_table))
+        measure(store, results, scale, 'page_one filters (snapshot)', lambda: page_one_filters(supabase_table, data))
+        measure(store, results, scale, 'page_two stats (build)', lambda: page_two_stats(supabase_table))
+        measure(store, results, scale, 'page_two stats (cached)', lambda: page_two_stats(supabase_table))
+        measure(store, results, scale, 'update_manyUsers', lambda: update_many(supabase_table))
+        upload = make_upload(members, max(100, scale // 10))
+        measure(store, results, scale, 'upload_data (ingest)', lambda: csv_ingest.ingest(upload, UPLOAD_MAPPING, supabase_table))
+    finally:
+        snapshot_cache._snapshots.pop(supabase_table, None)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+# Run one scale in a fresh Python process (`bench_suite.py --scale <rows> <latency>`), return its results.
+def run_scale_process(scale, latency=0.0):
+    finished = subprocess.run([sys.executable, os.path.abspath(__file__), '--scale', str(scale), str(latency)],
+                              stdout=subprocess.PIPE, check=True)
+    return json.loads(finished.stdout)
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ['--scale']:
+    print(json.dumps(run_scale(int(sys.argv[2]), float(sys.argv[3]))))
+
+elif __name__ == "__main__":
+    scales = [int(scale) for scale in sys.argv[1].split(',')] if len(sys.argv) > 1 else SCALES
+    output = sys.argv[2] if len(sys.argv) > 2 else None
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+    results = []
+    for scale in scales:
+        results += run_scale_process(scale, latency)
+    report = {'scales': scales, 'latency_s': latency, 'max_concurrency': db.MAX_CONCURRENCY, 'results': results}
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
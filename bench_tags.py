@@ -0,0 +1,38 @@
+import time
+import numpy as np
+import pandas as pd
+from importer import merge_tags
+from tag_index import merge_tag_columns
+
+# Benchmark: merging tag_list for N matched users, row by row (importer.merge_tags) vs whole batch (merge_tag_columns).
+# Usage: python bench_tags.py [rows]
+
+def make_tag_columns(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    tags = np.array(['TV', 'Donatore', 'Supervolontario', 'Volantinaggio', 'Evento Milano', 'Newsletter', 'Iscritto', 'Banchetto'])
+
+    def tag_lists(max_tags, empty_share):
+        counts = rng.integers(1, max_tags + 1, size=rows)
+        values = [', '.join(rng.choice(tags, size=count)) for count in counts]
+        return pd.Series(values).mask(rng.random(rows) < empty_share)
+
+    return tag_lists(4, 0.2), tag_lists(3, 0.1)
+
+
+if __name__ == "__main__":
+    import sys
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    existing, incoming = make_tag_columns(rows)
+
+    start = time.perf_counter()
+    row_by_row = [merge_tags(current, new) for current, new in zip(existing.astype(object).where(existing.notna(), None), incoming.astype(object).where(incoming.notna(), None))]
+    row_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = merge_tag_columns(existing, incoming)
+    batch_time = time.perf_counter() - start
+
+    assert batch.tolist() == row_by_row, 'batch merge differs from merge_tags'
+    print(f'rows: {rows}')
+    print(f'merge_tags (row by row):   {row_time:.3f}s  {rows / row_time:,.0f} rows/s')
+    print(f'merge_tag_columns (batch): {batch_time:.3f}s  {rows / batch_time:,.0f} rows/s')
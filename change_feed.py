@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import websockets
+from realtime.channel import Channel
+from realtime.connection import Socket
+import db
+import snapshot_cache
+
+# Realtime change feed for the table snapshots.
+# One websocket per process to Supabase Realtime (with the realtime client), with a channel per subscribed table
+# listening to its INSERT/UPDATE/DELETE events. Events are batched for FLUSH_INTERVAL seconds and applied to the
+# snapshot and its derived indexes and stats in place (snapshot_cache.apply_feed), so edits from anywhere show up
+# within about a second. A table stops polling for deltas only once Realtime confirmed its subscription: after the
+# join reply and, with Realtime v2, the 'system' message saying the postgres_changes subscription is up. It then
+# catches up once with a delta sync and a delete check, covering the events missed before. A refused join or a
+# failed subscription leaves the table polling, and so does a dropped connection until it is confirmed again.
+# Opt-in with SUPABASE_REALTIME=1: the tables must be in the supabase_realtime publication, or no events arrive.
+
+ENABLED = os.environ.get('SUPABASE_REALTIME') == '1'
+
+# Websocket endpoint of Supabase Realtime, derived from SUPABASE_URL unless set.
+REALTIME_URL = os.environ.get('REALTIME_URL') or (
+    db.url.replace('https://', 'wss://').replace('http://', 'ws://').rstrip('/') + '/realtime/v1/websocket' if db.url else None)
+
+# Seconds events are collected before they are applied together.
+FLUSH_INTERVAL = 0.5
+
+# Seconds between heartbeats, and before reconnecting after the connection dropped.
+HEARTBEAT_INTERVAL = 25
+RECONNECT_DELAY = 5
+
+_feed = None
+_guard = threading.Lock()
+
+
+# A Realtime channel for the changes of one table. realtime-py 1.0 joins with an empty payload, Realtime v2 wants the
+# postgres_changes configuration (and the key) in the join.
+class TableChannel(Channel):
+
+    def __init__(self, socket, supabase_table, ref, schema='public'):
+        super().__init__(socket, f'realtime:{schema}:{supabase_table}',
+                         {'config': {'postgres_changes': [{'event': '*', 'schema': schema, 'table': supabase_table}]},
+                          'access_token': db.key})
+        self.ref = ref
+
+    # the reply to the join carries the same ref
+    async def _join(self):
+        await self.socket.ws_connection.send(json.dumps({'topic': self.topic, 'event': 'phx_join', 'payload': self.params, 'ref': self.ref}))
+
+
+# Postgres change event -> (type, record, old_record). Realtime v2 wraps it in payload['data'] (the 'postgres_changes'
+# event), older servers send it as the payload of an INSERT/UPDATE/DELETE event.
+def parse_change(payload):
+    change = payload.get('data', payload) if isinstance(payload, dict) else {}
+    return change.get('type') or change.get('eventType'), change.get('record') or {}, change.get('old_record') or {}
+
+
+class ChangeFeed:
+
+    def __init__(self, url=None):
+        self.url = url or REALTIME_URL
+        self.tables = {}
+        self.topics = {}
+        self.joins = {}
+        self.pending = {}
+        self.socket = None
+        self.loop = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='change_feed', daemon=True)
+        self.flusher = threading.Thread(target=self._flush_loop, name='change_feed_flush', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.flusher.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.loop is not None and self.loop.is_running() and self.socket is not None and self.socket.ws_connection.open:
+            asyncio.run_coroutine_threadsafe(self.socket._close(), self.loop)
+        self.thread.join(timeout=5)
+
+    # Listen to a table. Joined right away when connected, otherwise on the next connect.
+    def subscribe(self, supabase_table, key='nationbuilder_id'):
+        with self.lock:
+            if supabase_table in self.tables:
+                return
+            self.tables[supabase_table] = key
+        if self.loop is not None and self.socket is not None and self.socket.connected:
+            asyncio.run_coroutine_threadsafe(self._join(supabase_table), self.loop)
+
+    def _on_change(self, supabase_table, payload):
+        change_type, record, old_record = parse_change(payload)
+        key = self.tables[supabase_table]
+        if change_type not in ('INSERT', 'UPDATE', 'DELETE'):
+            return
+        with self.lock:
+            # per key, the last event wins; a changed key also removes the old one
+            pending = self.pending.setdefault(supabase_table, {})
+            old_key = old_record.get(key)
+            if change_type == 'DELETE' or (old_key is not None and old_key != record.get(key)):
+                pending[old_key] = None
+            if change_type != 'DELETE' and record.get(key) is not None:
+                pending[record[key]] = record
+
+    # Apply the collected events, one batch per table.
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for supabase_table, changes in pending.items():
+            rows = [record for record in changes.values() if record is not None]
+            removed = [row_key for row_key, record in changes.items() if record is None]
+            try:
+                snapshot_cache.apply_feed(supabase_table, rows, removed, self.tables[supabase_table])
+            except Exception:
+                logging.exception('Could not apply the changes of %s, falling back to polling', supabase_table)
+                snapshot_cache.set_live(supabase_table, False)
+
+    def _flush_loop(self):
+        while not self.stopped.wait(FLUSH_INTERVAL):
+            self.flush()
+
+    # Join a table's channel. It goes live when Realtime confirms the subscription (see _on_reply, _on_system).
+    async def _join(self, supabase_table):
+        channel = TableChannel(self.socket, supabase_table, ref=str(len(self.joins) + 1))
+        self.topics[channel.topic] = supabase_table
+        self.joins[channel.ref] = supabase_table
+        self.socket.channels[channel.topic].append(channel)
+        await channel._join()
+
+    def _on_reply(self, supabase_table, payload, ref):
+        if self.joins.get(ref) != supabase_table:
+            return
+        if payload.get('status') != 'ok':
+            logging.warning('Realtime refused to join %s (%s), it keeps polling', supabase_table, payload.get('response'))
+        elif 'postgres_changes' not in (payload.get('response') or {}):
+            # servers before Realtime v2 don't send a system message: the join is the subscription
+            self._confirmed(supabase_table)
+
+    # Realtime v2 reports the outcome of the postgres_changes subscription in a 'system' message after the join.
+    def _on_system(self, supabase_table, payload):
+        if payload.get('extension') != 'postgres_changes':
+            return
+        if payload.get('status') == 'ok':
+            self._confirmed(supabase_table)
+        else:
+            logging.warning('Realtime could not subscribe to %s (%s), it keeps polling', supabase_table, payload.get('message'))
+            snapshot_cache.set_live(supabase_table, False)
+
+    # Catch up on what happened before the subscription (in a worker thread, it sends HTTP requests), then go live.
+    def _confirmed(self, supabase_table):
+        asyncio.get_running_loop().run_in_executor(None, self._catch_up, supabase_table, self.socket)
+
+    def _catch_up(self, supabase_table, socket):
+        try:
+            snapshot_cache.catch_up(supabase_table, self.tables[supabase_table])
+        except Exception:
+            logging.exception('Could not catch up on %s, it keeps polling', supabase_table)
+            snapshot_cache.set_live(supabase_table, False)
+            return
+        # the connection dropped meanwhile: polling until the next one is confirmed
+        if socket is not self.socket or not socket.ws_connection.open:
+            snapshot_cache.set_live(supabase_table, False)
+
+    # Messages of the connection until it closes. realtime-py's own loop drops the replies, which are needed here.
+    async def _listen(self):
+        while True:
+            try:
+                message = json.loads(await self.socket.ws_connection.recv())
+            except websockets.ConnectionClosed:
+                return
+            supabase_table = self.topics.get(message.get('topic'))
+            if supabase_table is None:
+                continue
+            event, payload = message.get('event'), message.get('payload') or {}
+            if event == 'phx_reply':
+                self._on_reply(supabase_table, payload, message.get('ref'))
+            elif event == 'system':
+                self._on_system(supabase_table, payload)
+            elif event in ('phx_error', 'phx_close'):
+                snapshot_cache.set_live(supabase_table, False)
+            else:
+                self._on_change(supabase_table, payload)
+
+    async def _session(self):
+        self.socket = Socket(f'{self.url}?apikey={db.key}&vsn=1.0.0', hb_interval=HEARTBEAT_INTERVAL)
+        await self.socket._connect()
+        with self.lock:
+            tables = list(self.tables)
+        for supabase_table in tables:
+            await self._join(supabase_table)
+        # until the connection closes; the heartbeats would only notice at their next beat
+        keep_alive = asyncio.ensure_future(self.socket._keep_alive())
+        try:
+            await self._listen()
+        finally:
+            keep_alive.cancel()
+
+    # Connection loop of the feed thread: connect, listen until the connection drops, poll meanwhile, reconnect.
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        while not self.stopped.is_set():
+            try:
+                self.loop.run_until_complete(self._session())
+            except Exception:
+                logging.exception('Realtime connection failed')
+            with self.lock:
+                tables = list(self.tables)
+            for supabase_table in tables:
+                snapshot_cache.set_live(supabase_table, False)
+            self.stopped.wait(RECONNECT_DELAY)
+        # let the close started by stop() finish
+        self.loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(self.loop), return_exceptions=True))
+
+
+# Keep a table's snapshot current from the change feed (one feed per process, started on first use).
+# Unless the feed is enabled (and there is a Realtime endpoint) the snapshot keeps polling.
+def subscribe(supabase_table, key='nationbuilder_id'):
+    global _feed
+    with _guard:
+        if not ENABLED or REALTIME_URL is None:
+            return None
+        if _feed is None:
+            _feed = ChangeFeed().start()
+    _feed.subscribe(supabase_table, key)
+    return _feed
@@ -0,0 +1,157 @@
+import io
+import os
+import json
+import hashlib
+import pandas as pd
+import importer
+import snapshot_cache
+
+# Streaming CSV ingestion.
+# The upload is read INGEST_CHUNK_SIZE rows at a time with explicit text dtypes, the column mapping is applied to each
+# chunk and the chunk is matched against the snapshot's identity index and written (importer.import_data) before the
+# next one is read, so memory stays bounded by the chunk size. After every committed chunk a checkpoint is written; if the session dies, uploading the
+# same file again continues after the last committed chunk. Checkpoints and rejected rows are kept per import (the file, table and
+# mapping, or the background job running it, see import_jobs), so imports of the same file never share or clear each other's.
+
+# Rows per chunk.
+INGEST_CHUNK_SIZE = 5000
+
+CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', '.imports')
+
+# Every imported column is text: phone numbers keep leading zeros and '+', ids are never parsed as floats.
+COLUMN_DTYPE = 'string'
+
+
+# Content hash of an uploaded file (so a re-upload of the same file finds its checkpoint) and its number of data
+# lines, used as the row total for progress. Reads the file in blocks, it is never parsed as a whole.
+def scan_file(file):
+    digest = hashlib.sha1()
+    lines = 0
+    file.seek(0)
+    for block in iter(lambda: file.read(1 << 20), b''):
+        digest.update(block)
+        lines += block.count(b'\n')
+    file.seek(0)
+    return digest.hexdigest(), max(lines - 1, 0)
+
+
+# First rows of the file, to show the columns for mapping without reading it all.
+def preview(file, rows=5):
+    file.seek(0)
+    head = pd.read_csv(file, nrows=rows, dtype=COLUMN_DTYPE)
+    file.seek(0)
+    return head
+
+
+# Chunks of the file with the mapping applied: only mapped columns are parsed, then renamed to table columns.
+def read_chunks(file, column_mapping, chunk_size=INGEST_CHUNK_SIZE):
+    file.seek(0)
+    # our own text wrapper, detached afterwards: pandas would close the uploaded file together with its wrapper
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    try:
+        for chunk in pd.read_csv(text, usecols=list(column_mapping), dtype=COLUMN_DTYPE, chunksize=chunk_size):
+            yield chunk.rename(columns=column_mapping)[list(column_mapping.values())]
+    finally:
+        text.detach()
+
+
+# Name of the checkpoint of an import of a file (by its digest) into a table with a mapping.
+def import_name(digest, supabase_table, column_mapping):
+    key = json.dumps([digest, supabase_table, column_mapping])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _paths(name):
+    return os.path.join(CHECKPOINT_DIR, f'{name}.json'), os.path.join(CHECKPOINT_DIR, f'{name}.errors.csv')
+
+
+def new_checkpoint(supabase_table, column_mapping, rows_total=0):
+    return {'table': supabase_table, 'mapping': column_mapping, 'chunks_done': 0, 'rows_done': 0, 'rows_total': rows_total,
+            'inserted': 0, 'updated': 0, 'rejected': 0, 'finished': False}
+
+
+# Checkpoint of an earlier run of the import, or None.
+def read_checkpoint(name, supabase_table, column_mapping):
+    checkpoint_path, _ = _paths(name)
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint['table'] != supabase_table or checkpoint['mapping'] != column_mapping:
+        return None
+    return checkpoint
+
+
+def save_checkpoint(name, checkpoint):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    checkpoint_path, _ = _paths(name)
+    with open(checkpoint_path + '.tmp', 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+
+# Rejected rows (with the error) and rows imported with a warning of every committed chunk, appended as chunks finish.
+def append_errors(name, rejected):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    _, errors_path = _paths(name)
+    rejected.to_csv(errors_path, mode='a', header=not os.path.exists(errors_path), index=False)
+
+
+def read_errors(name):
+    _, errors_path = _paths(name)
+    return pd.read_csv(errors_path, dtype=COLUMN_DTYPE) if os.path.exists(errors_path) else pd.DataFrame()
+
+
+# Forget an import, so its next run starts from the first row.
+def clear_checkpoint(name):
+    for path in _paths(name):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Import one chunk and fold its outcome into the checkpoint. Returns the chunk's rejected rows and the rows imported
+# with a warning.
+def ingest_chunk(chunk, supabase_table, checkpoint):
+    report = importer.import_data(chunk, supabase_table, identity=snapshot_cache.identity_index(supabase_table))
+    snapshot_cache.refresh_rows(supabase_table, report['nationbuilder_id'].tolist())
+
+    outcomes = report['outcome'].value_counts()
+    for outcome in ('inserted', 'updated', 'rejected'):
+        checkpoint[outcome] += int(outcomes.get(outcome, 0))
+    checkpoint['chunks_done'] += 1
+    checkpoint['rows_done'] += len(chunk)
+
+    to_check = (report['outcome'] == 'rejected') | report['warning'].notna()
+    return chunk.reset_index(drop=True)[to_check].join(report[['error', 'warning']])
+
+
+# Import a CSV file chunk by chunk, resuming after the last committed chunk of an earlier run.
+# `name` is the checkpoint to use (see import_name, the default). `progress(checkpoint, rejected_rows)` is called
+# after every chunk. Returns the final checkpoint.
+def ingest(file, column_mapping, supabase_table, chunk_size=INGEST_CHUNK_SIZE, progress=None, name=None):
+    digest, rows_total = scan_file(file)
+    name = name or import_name(digest, supabase_table, column_mapping)
+    checkpoint = read_checkpoint(name, supabase_table, column_mapping)
+    if checkpoint is None or checkpoint['finished']:
+        clear_checkpoint(name)
+        checkpoint = new_checkpoint(supabase_table, column_mapping, rows_total)
+
+    rows_seen = 0
+    for chunk in read_chunks(file, column_mapping, chunk_size):
+        # rows committed by an earlier run are read (to move through the file) but not sent again
+        rows_seen += len(chunk)
+        if rows_seen <= checkpoint['rows_done']:
+            continue
+        chunk = chunk.iloc[max(0, len(chunk) - (rows_seen - checkpoint['rows_done'])):]
+
+        rejected = ingest_chunk(chunk, supabase_table, checkpoint)
+        if not rejected.empty:
+            append_errors(name, rejected)
+        save_checkpoint(name, checkpoint)
+        if progress:
+            progress(checkpoint, rejected)
+
+    checkpoint['finished'] = True
+    checkpoint['rows_total'] = checkpoint['rows_done']
+    save_checkpoint(name, checkpoint)
+    return checkpoint
@@ -0,0 +1,149 @@
+import os
+import asyncio
+import threading
+import httpx
+from concurrent.futures import as_completed
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential
+from supabase import create_client, acreate_client, Client
+from postgrest import APIError
+import instrumentation
+from dotenv import load_dotenv
+load_dotenv()
+
+# Shared data access.
+# One Supabase client per process instead of a fresh create_client() in every module. Next to the plain synchronous
+# client there is an asyncio path: an async client living on a background event loop, so independent queries run
+# concurrently (bounded by MAX_CONCURRENCY), with retries and backoff, over the same keep-alive connection pool.
+# Only reads and idempotent writes are retried after errors that may have left them applied (see is_retryable).
+
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_KEY")
+
+# Queries in flight at the same time on the async path.
+MAX_CONCURRENCY = int(os.environ.get("SUPABASE_MAX_CONCURRENCY", 8))
+
+# Attempts per query (first try included) and backoff between them, in seconds.
+RETRY_ATTEMPTS = 4
+RETRY_WAIT_MIN = 0.5
+RETRY_WAIT_MAX = 8
+
+_client = None
+_async_client = None
+_loop = None
+_semaphore = None
+_async_guard = None
+_guard = threading.Lock()
+
+
+# The synchronous client, created on first use. Its requests are recorded by instrumentation.
+def client() -> Client:
+    global _client
+    with _guard:
+        if _client is None:
+            _client = create_client(url, key)
+        return instrumentation.instrument(_client)
+
+
+# Use other clients, e.g. a local stand-in for benchmarks. Either may be None to keep the current one.
+def set_clients(sync_client=None, async_client=None):
+    global _client, _async_client
+    with _guard:
+        if sync_client is not None:
+            _client = sync_client
+        if async_client is not None:
+            _async_client = async_client
+
+
+# Background event loop that owns the async client, so its connection pool survives between Streamlit reruns.
+def _event_loop():
+    global _loop
+    with _guard:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='supabase-async', daemon=True).start()
+        return _loop
+
+
+# The async client, created on first use. Only on the background loop: the semaphore and lock are created before any
+# await, and the lock keeps concurrent first tasks from each creating (and leaking) a client.
+async def _get_async_client():
+    global _async_client, _semaphore, _async_guard
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        _async_guard = asyncio.Lock()
+    if _async_client is None:
+        async with _async_guard:
+            if _async_client is None:
+                _async_client = await acreate_client(url, key)
+    return instrumentation.instrument(_async_client)
+
+
+# Errors after which nothing was done, so any request can be sent again: no connection made, too many connections,
+# PostgREST without a database connection or still loading its schema cache, or a transaction Postgres rolled back
+# on a deadlock or serialization failure. A statement timeout (57014) is not retried: the same query would time out again.
+def is_transient(error):
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if isinstance(error, APIError):
+        return str(error.code) in ('PGRST000', 'PGRST001', 'PGRST002', '53300', '40001', '40P01')
+    return False
+
+
+# Errors after which the request may or may not have been applied (e.g. a read timeout): only reads and idempotent
+# writes are sent again, an insert or RPC could be applied twice.
+def is_retryable(error, idempotent):
+    return is_transient(error) or (idempotent and isinstance(error, httpx.TransportError))
+
+
+# Reads, updates, deletes and upserts give the same result when sent twice; inserts and RPCs may not.
+def is_idempotent(query):
+    method = getattr(query, 'http_method', 'POST').upper()
+    return method in ('GET', 'HEAD', 'PATCH', 'DELETE') or 'resolution=merge-duplicates' in getattr(query, 'headers', {}).get('prefer', '')
+
+
+# `idempotent` is a bool, or a function of the async client deciding it (see submit_query).
+async def _run_task(task, idempotent=False):
+    async_client = await _get_async_client()
+    if callable(idempotent):
+        idempotent = idempotent(async_client)
+    async for attempt in AsyncRetrying(retry=retry_if_exception(lambda error: is_retryable(error, idempotent)), reraise=True,
+                                       stop=stop_after_attempt(RETRY_ATTEMPTS),
+                                       wait=wait_exponential(min=RETRY_WAIT_MIN, max=RETRY_WAIT_MAX)):
+        with attempt:
+            # the backoff between attempts doesn't hold a slot
+            async with _semaphore:
+                return await task(async_client)
+
+
+# Schedule `task(async_client)` (a coroutine function) on the background loop. Returns a concurrent.futures.Future.
+# Pass idempotent=True for tasks that only read (or only write idempotently), so they are retried after ambiguous errors too.
+def submit(task, idempotent=False):
+    return asyncio.run_coroutine_threadsafe(_run_task(task, idempotent), _event_loop())
+
+
+# Run tasks concurrently, results in the same order as the tasks.
+def run_all(tasks, idempotent=False):
+    futures = [submit(task, idempotent) for task in tasks]
+    return [future.result() for future in futures]
+
+
+# Run tasks concurrently, yielding results as they finish (handy for progress bars).
+def run_as_completed(tasks, idempotent=False):
+    for future in as_completed([submit(task, idempotent) for task in tasks]):
+        yield future.result()
+
+
+# Schedule one query. `build(client)` returns a query builder, e.g.
+#   lambda client: client.table('db_2').select('*').in_('email', chunk)
+# Returns a concurrent.futures.Future with the response. Retried after ambiguous errors only if idempotent (see
+# is_idempotent).
+def submit_query(build):
+    async def task(async_client):
+        return await build(async_client).execute()
+    return submit(task, idempotent=lambda async_client: is_idempotent(build(async_client)))
+
+
+# Execute query builders concurrently, responses in the same order.
+def execute_all(builders):
+    futures = [submit_query(build) for build in builders]
+    return [future.result() for future in futures]
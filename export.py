@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import hashlib
+import pyarrow as pa
+import pyarrow.parquet as pq
+import db
+import loader
+import filters
+import snapshot_cache
+from query_plan import QueryPlan
+
+# Export of the filtered member table.
+# The file is only built when someone asks for it, and then written chunk by chunk (CSV appended, Parquet row groups,
+# XLSX rows in constant-memory mode, on more sheets past Excel's row limit), so no full copy of the data is held as
+# one string or byte array. Rows come from the snapshot when it is loaded, otherwise they are paged from the server
+# with the filters applied there. Finished files are cached on disk, keyed on table, filters, order, format and data
+# version.
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR', '.exports')
+
+# Rows written per chunk.
+EXPORT_CHUNK_SIZE = 10000
+
+# Exports kept on disk, newest first.
+EXPORT_CACHE_FILES = 20
+
+# Without a snapshot there is no data version: server exports are reused for this many seconds.
+EXPORT_TTL = 60
+
+# format -> (mime type, file extension)
+FORMATS = {'csv': ('text/csv', 'csv'),
+           'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+           'parquet': ('application/vnd.apache.parquet', 'parquet')}
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+
+# Formats that can be written here (XLSX needs XlsxWriter).
+def available_formats():
+    return [name for name in FORMATS if name != 'xlsx' or xlsxwriter is not None]
+
+
+# Matching rows in chunks, from the snapshot when it is loaded. `order` is a list of (column, descending).
+def iter_rows(supabase_table, predicates, order=None, key='nationbuilder_id', chunk_size=EXPORT_CHUNK_SIZE):
+    data = snapshot_cache.current(supabase_table, key)
+    if data is not None:
+        tag_index = snapshot_cache.tag_index(supabase_table, key) if any(p[1] in ('has_tag', 'has_any_tag') for p in predicates) else None
+        search_index = snapshot_cache.search_index(supabase_table, key) if any(map(filters.uses_search_index, predicates)) else None
+        yield from QueryPlan(data, key).where(predicates, tag_index, search_index).order_by(order).chunks(chunk_size)
+        return
+
+    # from the server: ranged queries in the requested order, refined locally where the server can't filter
+    page_size = 1000
+    start = 0
+    while True:
+        query = filters.apply_remote(db.client().table(supabase_table).select('*'), predicates)
+        for column, descending in order or []:
+            query = query.order(column, desc=descending)
+        rows = query.order(key).range(start, start + page_size - 1).execute().data
+        if not rows:
+            return
+        start += len(rows)
+        page = filters.apply_local(loader.page_frame(rows), predicates, local_only=True)
+        if not page.empty:
+            yield page
+
+
+def write_csv(chunks, path):
+    with open(path, 'w', newline='') as file:
+        for number, chunk in enumerate(chunks):
+            chunk.to_csv(file, header=number == 0, index=False)
+
+
+def write_parquet(chunks, path):
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({}), path)
+
+
+# Rows per worksheet, the header included (Excel's limit). Longer exports continue on more sheets, 'members 2' etc.
+XLSX_SHEET_ROWS = 1_048_576
+
+
+def write_xlsx(chunks, path, sheet_rows=XLSX_SHEET_ROWS):
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    sheets, sheet, row = 0, None, sheet_rows
+    for chunk in chunks:
+        header = [str(column) for column in chunk.columns]
+        for values in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+            if row == sheet_rows:
+                sheets += 1
+                sheet = workbook.add_worksheet('members' if sheets == 1 else f'members {sheets}')
+                sheet.write_row(0, 0, header)
+                row = 1
+            sheet.write_row(row, 0, [value if isinstance(value, (int, float, bool)) or value is None else str(value) for value in values])
+            row += 1
+    if sheet is None:
+        workbook.add_worksheet('members')
+    workbook.close()
+
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx, 'parquet': write_parquet}
+
+
+def cache_key(supabase_table, predicates, order, fmt):
+    version = snapshot_cache.version(supabase_table)
+    version = version if version is not None else f'ttl:{int(time.time() // EXPORT_TTL)}'
+    state = json.dumps([supabase_table, predicates, order or [], fmt, version], default=str)
+    return hashlib.sha1(state.encode()).hexdigest()
+
+
+# Keep the newest EXPORT_CACHE_FILES exports.
+def evict():
+    paths = [os.path.join(EXPORT_DIR, name) for name in os.listdir(EXPORT_DIR) if not name.endswith('.tmp')]
+    for path in sorted(paths, key=os.path.getmtime, reverse=True)[EXPORT_CACHE_FILES:]:
+        os.remove(path)
+
+
+def export_path(supabase_table, predicates, order, fmt):
+    return os.path.join(EXPORT_DIR, f'{cache_key(supabase_table, predicates, order, fmt)}.{FORMATS[fmt][1]}')
+
+
+# Path of a finished export for this filter state and data version, or None.
+def cached_path(supabase_table, predicates, order=None, fmt='csv'):
+    path = export_path(supabase_table, predicates, order, fmt)
+    return path if os.path.exists(path) else None
+
+
+# Build (or reuse) an export of the matching rows. Returns the path of the file.
+def export(supabase_table, predicates, order=None, fmt='csv', key='nationbuilder_id'):
+    # bring the snapshot up to date first, so the version in the cache key matches the rows written
+    snapshot_cache.current(supabase_table, key)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = export_path(supabase_table, predicates, order, fmt)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    WRITERS[fmt](iter_rows(supabase_table, predicates, order, key), path + '.tmp')
+    os.replace(path + '.tmp', path)
+    evict()
+    return path
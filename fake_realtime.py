@@ -0,0 +1,92 @@
+import json
+import asyncio
+import threading
+from datetime import datetime, timezone
+import websockets
+
+# Local stand-in for Supabase Realtime, for checking change_feed without a project.
+# A websocket server speaking the Phoenix protocol Realtime uses: clients join 'realtime:<schema>:<table>' topics,
+# heartbeats are answered, and every row written to a FakeStore (fake_supabase) is sent to the clients that joined its
+# table as a postgres_changes event, like Realtime v2 does. Joins are confirmed like Realtime v2 too: a reply listing
+# the postgres_changes subscription, then a 'system' message. Joins of `refused` tables get an error reply.
+#   store = FakeStore({'db_2': members}, keys={'db_2': 'nationbuilder_id'})
+#   server = FakeRealtimeServer(store).start()
+#   change_feed.ChangeFeed(server.url).start().subscribe('db_2')
+
+
+class FakeRealtimeServer:
+
+    def __init__(self, store, host='127.0.0.1', port=0, refused=()):
+        self.store = store
+        self.refused = set(refused)
+        self.host = host
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+        self.clients = {}
+        self.events_sent = 0
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='fake_realtime', daemon=True)
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}/realtime/v1/websocket'
+
+    def start(self):
+        self.thread.start()
+        self.started.wait()
+        self.store.listeners.append(self.emit)
+        return self
+
+    def stop(self):
+        self.store.listeners.remove(self.emit)
+        self.loop.call_soon_threadsafe(self.server.close)
+
+    # Drop every connection, as a network failure would.
+    def disconnect(self):
+        for websocket in list(self.clients):
+            asyncio.run_coroutine_threadsafe(websocket.close(), self.loop)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(websockets.serve(self._handle, self.host, self.port))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        self.loop.run_forever()
+
+    async def _handle(self, websocket):
+        self.clients[websocket] = set()
+        try:
+            async for raw in websocket:
+                message = json.loads(raw)
+                topic = message['topic']
+                if message['event'] != 'phx_join':
+                    await self._send(websocket, topic, 'phx_reply', {'status': 'ok', 'response': {}}, message.get('ref'))
+                elif topic.split(':')[-1] in self.refused:
+                    await self._send(websocket, topic, 'phx_reply', {'status': 'error', 'response': {'reason': 'unauthorized'}}, message.get('ref'))
+                else:
+                    self.clients[websocket].add(topic)
+                    changes = message['payload'].get('config', {}).get('postgres_changes', [])
+                    response = {'postgres_changes': [{**change, 'id': index} for index, change in enumerate(changes)]}
+                    await self._send(websocket, topic, 'phx_reply', {'status': 'ok', 'response': response}, message.get('ref'))
+                    await self._send(websocket, topic, 'system', {'status': 'ok', 'extension': 'postgres_changes',
+                                                                  'channel': topic.split(':', 1)[-1], 'message': 'Subscribed to PostgreSQL'})
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.clients.pop(websocket, None)
+
+    async def _send(self, websocket, topic, event, payload, ref=None):
+        await websocket.send(json.dumps({'topic': topic, 'event': event, 'payload': payload, 'ref': ref}))
+
+    # FakeStore listener: one postgres_changes event per written row.
+    def emit(self, supabase_table, change_type, record, old_record, schema='public'):
+        topic = f'realtime:{schema}:{supabase_table}'
+        payload = {'data': {'type': change_type, 'schema': schema, 'table': supabase_table, 'record': record,
+                            'old_record': old_record, 'commit_timestamp': datetime.now(timezone.utc).isoformat(), 'errors': None},
+                   'ids': []}
+        message = json.dumps({'topic': topic, 'event': 'postgres_changes', 'payload': payload, 'ref': None})
+        for websocket, topics in list(self.clients.items()):
+            if topic in topics:
+                self.events_sent += 1
+                asyncio.run_coroutine_threadsafe(websocket.send(message), self.loop)
@@ -0,0 +1,441 @@
+import re
+import json
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from postgrest import APIError
+from importer import merge_tags
+
+# In-process stand-in for the parts of supabase-py this app uses, for benchmarks (see bench_suite.py).
+# Implements the PostgREST query builder surface (select/insert/upsert/update/delete, eq/neq/gt/gte/lt/lte/in_/ilike,
+# or_, filter imatch, order/limit/range, count='exact') and the merge_members/merge_users functions of
+# sql/merge_members.sql over pandas frames, with a sync and an async client sharing the same tables. Every request is
+# counted per (table, operation), and an optional latency per request stands in for the network:
+#   store = FakeStore({'db_2': members}, keys={'db_2': 'nationbuilder_id'}, latency=0.005)
+#   db.set_clients(FakeClient(store), FakeAsyncClient(store))
+
+# Looks like an ISO timestamp: compared as a time, not as text.
+TIMESTAMP_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}')
+
+# One condition of an or_ filter: column.operator.value, the value possibly double quoted.
+OR_CONDITION = re.compile(r'[^,"]+(?:"[^"]*")?')
+
+
+def now_iso():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+
+
+# ilike pattern -> regex. \% and \_ are literal characters.
+def like_regex(pattern):
+    parts = []
+    position = 0
+    while position < len(pattern):
+        character = pattern[position]
+        if character == '\\' and position + 1 < len(pattern):
+            parts.append(re.escape(pattern[position + 1]))
+            position += 2
+            continue
+        parts.append('.*' if character == '%' else '.' if character == '_' else re.escape(character))
+        position += 1
+    return '^' + ''.join(parts) + '$'
+
+
+class FakeResponse:
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+# The tables (one frame each, rows as PostgREST would return them) and the request counters.
+# Text and timestamp versions of columns and value -> row lookups are cached until the table is written.
+class FakeStore:
+
+    def __init__(self, tables=None, keys=None, latency=0.0):
+        self.tables = {name: frame.reset_index(drop=True) for name, frame in (tables or {}).items()}
+        self.keys = keys or {}
+        self.latency = latency
+        self.requests = {}
+        self.lock = threading.RLock()
+        self.columns_cache = {}
+        self.lookups = {}
+        # called as listener(table, type, record, old_record) for every row written, see fake_realtime
+        self.listeners = []
+
+    def key(self, supabase_table):
+        return self.keys.get(supabase_table, 'nationbuilder_id')
+
+    def count(self, supabase_table, operation):
+        self.requests[(supabase_table, operation)] = self.requests.get((supabase_table, operation), 0) + 1
+
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def frame(self, supabase_table):
+        return self.tables.get(supabase_table, pd.DataFrame(columns=[self.key(supabase_table)]))
+
+    def text(self, supabase_table, column):
+        if (supabase_table, column, 'text') not in self.columns_cache:
+            self.columns_cache[(supabase_table, column, 'text')] = self.frame(supabase_table)[column].astype('string')
+        return self.columns_cache[(supabase_table, column, 'text')]
+
+    def timestamps(self, supabase_table, column):
+        if (supabase_table, column, 'time') not in self.columns_cache:
+            values = self.frame(supabase_table)[column]
+            self.columns_cache[(supabase_table, column, 'time')] = pd.to_datetime(values, utc=True, format='ISO8601', errors='coerce')
+        return self.columns_cache[(supabase_table, column, 'time')]
+
+    # value -> row position of a column (lowercased for case-insensitive matches). First row wins.
+    def lookup(self, supabase_table, column, lower=False):
+        if (supabase_table, column, lower) not in self.lookups:
+            frame = self.frame(supabase_table)
+            values = frame[column].astype('string') if column in frame.columns else pd.Series([], dtype='string')
+            values = values.str.lower() if lower else values
+            lookup = {}
+            for position, value in zip(frame.index[values.notna()], values[values.notna()]):
+                lookup.setdefault(value, position)
+            self.lookups[(supabase_table, column, lower)] = lookup
+        return self.lookups[(supabase_table, column, lower)]
+
+    # Tell the listeners about written rows (frames of the new and old versions, aligned).
+    def notify(self, supabase_table, change_type, rows=None, old_rows=None):
+        if not self.listeners:
+            return
+        records = FakeStore.to_json_rows(rows) if rows is not None else [{}] * len(old_rows)
+        old_records = FakeStore.to_json_rows(old_rows) if old_rows is not None else [{}] * len(rows)
+        for record, old_record in zip(records, old_records):
+            for listener in self.listeners:
+                listener(supabase_table, change_type, record, old_record)
+
+    # Forget the caches of a table. `columns` limits it to the columns written (lookups of other columns stay valid).
+    def written(self, supabase_table, columns=None):
+        self.columns_cache = {entry: values for entry, values in self.columns_cache.items() if entry[0] != supabase_table}
+        self.lookups = {entry: lookup for entry, lookup in self.lookups.items()
+                        if entry[0] != supabase_table or (columns is not None and entry[1] not in columns)}
+
+    def next_ids(self, supabase_table, n):
+        frame = self.frame(supabase_table)
+        key = self.key(supabase_table)
+        start = 1 if frame.empty else int(pd.to_numeric(frame[key]).max()) + 1
+        return list(range(start, start + n))
+
+    # New rows get created_at/updated_at like the table defaults would set them.
+    def append(self, supabase_table, rows):
+        current = self.frame(supabase_table)
+        stamp = now_iso()
+        new = pd.DataFrame(rows, index=range(len(current), len(current) + len(rows)))
+        for column in ('created_at', 'updated_at'):
+            if column in current.columns:
+                new[column] = new[column].fillna(stamp) if column in new.columns else stamp
+        self.tables[supabase_table] = new if current.empty else pd.concat([current, new])
+        self.notify(supabase_table, 'INSERT', self.tables[supabase_table].loc[new.index])
+
+        self.columns_cache = {entry: values for entry, values in self.columns_cache.items() if entry[0] != supabase_table}
+        for (table, column, lower), lookup in self.lookups.items():
+            if table == supabase_table and column in new.columns:
+                values = new[column].astype('string')
+                for position, value in zip(new.index[values.notna()], values[values.notna()]):
+                    lookup.setdefault(value.lower() if lower else value, position)
+
+    # Write values into one row, bumping updated_at like the table's update trigger.
+    def set_row(self, supabase_table, position, values):
+        frame = self.tables[supabase_table]
+        old_row = frame.loc[[position]] if self.listeners else None
+        for column, value in values.items():
+            if column not in frame.columns:
+                frame[column] = None
+            frame.at[position, column] = value
+        if 'updated_at' in frame.columns:
+            frame.at[position, 'updated_at'] = now_iso()
+        self.notify(supabase_table, 'UPDATE', frame.loc[[position]], old_row)
+
+    @staticmethod
+    def to_json_rows(frame):
+        return json.loads(frame.to_json(orient='records', date_format='iso'))
+
+
+class FakeQuery:
+
+    def __init__(self, store, supabase_table):
+        self.store = store
+        self.table = supabase_table
+        self.operation = 'select'
+        self.columns = '*'
+        self.count_method = None
+        self.payload = None
+        self.on_conflict = None
+        self.conditions = []
+        self.orders = []
+        self.offset = 0
+        self.row_limit = None
+
+    # operations
+    def select(self, *columns, count=None):
+        self.operation, self.columns, self.count_method = 'select', ','.join(columns) or '*', count
+        return self
+
+    def insert(self, json, **kwargs):
+        self.operation, self.payload = 'insert', json if isinstance(json, list) else [json]
+        return self
+
+    def upsert(self, json, on_conflict='', **kwargs):
+        self.operation, self.payload, self.on_conflict = 'upsert', json if isinstance(json, list) else [json], on_conflict
+        return self
+
+    def update(self, json, **kwargs):
+        self.operation, self.payload = 'update', json
+        return self
+
+    def delete(self, **kwargs):
+        self.operation = 'delete'
+        return self
+
+    # filters: every condition maps the table frame to a boolean mask
+    def _where(self, condition):
+        self.conditions.append(condition)
+        return self
+
+    # The column and the value in comparable form: numbers as numbers, timestamps as times, the rest as text.
+    def _comparable(self, frame, column, value):
+        values = frame[column]
+        if pd.api.types.is_numeric_dtype(values):
+            number = pd.to_numeric(pd.Series([value]), errors='coerce')[0]
+            if pd.notna(number):
+                return values, number
+        if isinstance(value, str) and TIMESTAMP_PATTERN.match(value):
+            stamp = pd.Timestamp(value)
+            return self.store.timestamps(self.table, column), stamp.tz_localize('UTC') if stamp.tzinfo is None else stamp.tz_convert('UTC')
+        return self.store.text(self.table, column), str(value)
+
+    def _compare(self, column, compare, value):
+        return self._where(lambda frame: compare(*self._comparable(frame, column, value)))
+
+    def eq(self, column, value):
+        return self._compare(column, lambda values, value: values == value, value)
+
+    def neq(self, column, value):
+        return self._compare(column, lambda values, value: values != value, value)
+
+    def gt(self, column, value):
+        return self._compare(column, lambda values, value: values > value, value)
+
+    def gte(self, column, value):
+        return self._compare(column, lambda values, value: values >= value, value)
+
+    def lt(self, column, value):
+        return self._compare(column, lambda values, value: values < value, value)
+
+    def lte(self, column, value):
+        return self._compare(column, lambda values, value: values <= value, value)
+
+    def in_(self, column, values):
+        values = {str(value) for value in values}
+        return self._where(lambda frame: self.store.text(self.table, column).isin(values))
+
+    def ilike(self, column, pattern):
+        return self._where(lambda frame: self.store.text(self.table, column).str.contains(like_regex(pattern), case=False, regex=True))
+
+    def filter(self, column, operator, criteria):
+        if operator in ('imatch', 'match'):
+            return self._where(lambda frame: self.store.text(self.table, column).str.contains(criteria, case=operator == 'match', regex=True))
+        return getattr(self, operator)(column, criteria)
+
+    # or_('column.operator.value,...'): any of the conditions. Only ilike and eq are understood (what filters sends).
+    def or_(self, filters, **kwargs):
+        conditions = []
+        for condition in OR_CONDITION.findall(filters):
+            column, operator, value = condition.split('.', 2)
+            value = value[1:-1] if value.startswith('"') else value
+            if operator == 'ilike':
+                regex = like_regex(value.replace('*', '%'))
+                conditions.append(lambda frame, column=column, regex=regex: self.store.text(self.table, column).str.contains(regex, case=False, regex=True))
+            elif operator == 'eq':
+                conditions.append(lambda frame, column=column, value=value: self.store.text(self.table, column) == value)
+            else:
+                raise ValueError(f'or_ operator not supported by the fake: {operator}')
+        return self._where(lambda frame: pd.Series(np.logical_or.reduce([condition(frame).fillna(False).to_numpy(bool) for condition in conditions]), index=frame.index))
+
+    # modifiers
+    def order(self, column, desc=False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size, **kwargs):
+        self.row_limit = size
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.offset, self.row_limit = start, end - start + 1
+        return self
+
+    def _mask(self, frame):
+        mask = pd.Series(True, index=frame.index)
+        for condition in self.conditions:
+            mask &= condition(frame).fillna(False).astype(bool)
+        return mask
+
+    def execute(self):
+        if self.store.latency:
+            time.sleep(self.store.latency)
+        return self._run()
+
+    def _run(self):
+        with self.store.lock:
+            self.store.count(self.table, self.operation)
+            return getattr(self, f'_{self.operation}')()
+
+    def _select(self):
+        frame = self.store.frame(self.table)
+        matching = frame[self._mask(frame)] if self.conditions else frame
+        total = len(matching)
+        # rows are kept in key order, so ordering by the key alone needs no sort
+        if self.orders and not (self.orders == [(self.store.key(self.table), False)] and matching[self.orders[0][0]].is_monotonic_increasing):
+            columns = [column for column, _ in self.orders]
+            matching = matching.sort_values(columns, ascending=[not desc for _, desc in self.orders], kind='stable', na_position='last')
+        matching = matching.iloc[self.offset:]
+        if self.row_limit is not None:
+            matching = matching.iloc[:self.row_limit]
+        if self.columns != '*':
+            matching = matching[[column.strip() for column in self.columns.split(',')]]
+        return FakeResponse(FakeStore.to_json_rows(matching), total if self.count_method else None)
+
+    def _insert(self):
+        key = self.store.key(self.table)
+        rows = [dict(row) for row in self.payload]
+        new_ids = iter(self.store.next_ids(self.table, len(rows)))
+        for row in rows:
+            if row.get(key) is None:
+                row[key] = next(new_ids)
+        self.store.append(self.table, rows)
+        return FakeResponse(FakeStore.to_json_rows(self.store.tables[self.table].iloc[-len(rows):]))
+
+    def _upsert(self):
+        key = self.on_conflict or self.store.key(self.table)
+        lookup = self.store.lookup(self.table, key)
+        new_rows, positions = [], []
+        for row in self.payload:
+            position = lookup.get(str(row.get(key)))
+            if position is None:
+                new_rows.append(dict(row))
+            else:
+                self.store.set_row(self.table, position, row)
+                positions.append(position)
+        self.store.written(self.table, columns={column for row in self.payload for column in row if column != key})
+        if new_rows:
+            self.store.append(self.table, new_rows)
+            positions += list(self.store.tables[self.table].index[-len(new_rows):])
+        return FakeResponse(FakeStore.to_json_rows(self.store.tables[self.table].loc[positions]))
+
+    def _update(self):
+        frame = self.store.frame(self.table)
+        positions = frame.index[self._mask(frame)]
+        for position in positions:
+            self.store.set_row(self.table, position, self.payload)
+        self.store.written(self.table, columns=set(self.payload))
+        return FakeResponse(FakeStore.to_json_rows(self.store.tables[self.table].loc[positions]))
+
+    def _delete(self):
+        frame = self.store.frame(self.table)
+        mask = self._mask(frame)
+        self.store.tables[self.table] = frame[~mask].reset_index(drop=True)
+        self.store.written(self.table)
+        self.store.notify(self.table, 'DELETE', old_rows=frame[mask])
+        return FakeResponse(FakeStore.to_json_rows(frame[mask]))
+
+
+# supabase.rpc stand-in for the functions of sql/merge_members.sql: non-empty incoming values overwrite, tags are
+# merged with importer.merge_tags, rows that match nothing are inserted. Returns (ord, id, outcome) per written row.
+class FakeRPC:
+
+    # function -> (table, key, tag column, column matched on, case-insensitive match)
+    FUNCTIONS = {'merge_members': ('db_2', 'nationbuilder_id', 'tag_list', 'nationbuilder_id', False),
+                 'merge_users': ('users', 'id', 'tags', 'email', True)}
+
+    def __init__(self, store, function, params):
+        self.store = store
+        self.function = function
+        self.params = params or {}
+
+    def execute(self):
+        if self.store.latency:
+            time.sleep(self.store.latency)
+        return self._run()
+
+    def _run(self):
+        if self.function not in self.FUNCTIONS:
+            # what PostgREST answers for a function the database doesn't have
+            raise APIError({'code': 'PGRST202', 'message': f'Could not find the function public.{self.function} in the schema cache'})
+        supabase_table, key, tag_column, match_column, lower = self.FUNCTIONS[self.function]
+        with self.store.lock:
+            self.store.count(self.function, 'rpc')
+            lookup = self.store.lookup(supabase_table, match_column, lower)
+            frame = self.store.frame(supabase_table)
+
+            result, new_rows, written = [], [], set()
+            for ord, row in enumerate(self.params.get('payload', []), 1):
+                value = row.get(match_column)
+                value = None if value is None else str(value).lower() if lower else str(value)
+                position = lookup.get(value) if value is not None else None
+                if position is None:
+                    # merge_members only inserts rows without an id (an id that no longer exists is skipped)
+                    if match_column == key and value is not None:
+                        continue
+                    new_rows.append((ord, {column: row[column] for column in row if column != key}))
+                    continue
+
+                values = {column: value for column, value in row.items() if value is not None and column not in (key, tag_column, match_column)}
+                if tag_column in row:
+                    current = frame.at[position, tag_column] if tag_column in frame.columns else None
+                    values[tag_column] = merge_tags(None if pd.isna(current) else current, row[tag_column])
+                self.store.set_row(supabase_table, position, values)
+                written |= set(values)
+                result.append({'ord': ord, key: int(frame.at[position, key]), 'outcome': 'updated'})
+
+            self.store.written(supabase_table, columns=written)
+            if new_rows:
+                for (ord, row), new_id in zip(new_rows, self.store.next_ids(supabase_table, len(new_rows))):
+                    row[key] = new_id
+                    result.append({'ord': ord, key: new_id, 'outcome': 'inserted'})
+                self.store.append(supabase_table, [row for _, row in new_rows])
+            return FakeResponse(sorted(result, key=lambda entry: entry['ord']))
+
+
+class FakeClient:
+
+    def __init__(self, store):
+        self.store = store
+
+    def table(self, table_name):
+        return FakeQuery(self.store, table_name)
+
+    def rpc(self, fn, params=None):
+        return FakeRPC(self.store, fn, params)
+
+
+# Async flavour for db's background loop: same builders, awaitable execute().
+class FakeAsyncQuery(FakeQuery):
+
+    async def execute(self):
+        if self.store.latency:
+            await asyncio.sleep(self.store.latency)
+        return self._run()
+
+
+class FakeAsyncRPC(FakeRPC):
+
+    async def execute(self):
+        if self.store.latency:
+            await asyncio.sleep(self.store.latency)
+        return self._run()
+
+
+class FakeAsyncClient(FakeClient):
+
+    def table(self, table_name):
+        return FakeAsyncQuery(self.store, table_name)
+
+    def rpc(self, fn, params=None):
+        return FakeAsyncRPC(self.store, fn, params)
@@ -0,0 +1,161 @@
+import re
+from operator import eq, gt, ge, lt, le
+import pandas as pd
+import db
+import loader
+from search_index import SEARCH_COLUMNS, scan_mask
+
+# Filter compiler for the member table.
+# Turns the page_one sidebar state into predicates that PostgREST can evaluate (ilike for text boxes, a regex match
+# for whole tags inside the comma separated tag_list), so typing a filter fetches only the matching rows.
+# Predicates the server can't express are evaluated locally on the rows that come back.
+
+# Sidebar text boxes -> column they search in (case-insensitive substring).
+TEXT_FILTERS = {'first_name': 'first_name', 'last_name': 'last_name', 'city': 'address_city'}
+
+# Column holding the comma separated tags.
+TAG_COLUMN = 'tag_list'
+
+
+# Predicate = (column, operator, value). Operators: 'contains' (substring, any case), 'has_tag' (whole tag) and
+# 'has_any_tag' (at least one of a tuple of tags). state['tag_mode'] is 'and' (all selected tags) or 'or' (any).
+# state['search'] (the "search anything" box) becomes ('*', 'search', text): every word of the text in one of the
+# search_index.SEARCH_COLUMNS, accents ignored, as a substring or a word prefix with a typo or two.
+# Grid column filters add 'equals', 'starts_with', 'ends_with' (text, any case) and 'eq', 'gt', 'gte', 'lt', 'lte' (numbers).
+def compile_filters(state):
+    predicates = []
+    search = (state.get('search') or '').strip()
+    if search:
+        predicates.append(('*', 'search', search))
+
+    for name, column in TEXT_FILTERS.items():
+        value = (state.get(name) or '').strip()
+        if value:
+            predicates.append((column, 'contains', value))
+
+    tags = tuple(str(tag).strip() for tag in state.get('tags') or [] if str(tag).strip())
+    if state.get('tag_mode') == 'or' and len(tags) > 1:
+        predicates.append((TAG_COLUMN, 'has_any_tag', tags))
+    else:
+        predicates += [(TAG_COLUMN, 'has_tag', tag) for tag in tags]
+    return predicates
+
+
+# Comparison operators, evaluated the same way on the server and in pandas.
+COMPARISONS = {'eq': eq, 'gt': gt, 'gte': ge, 'lt': lt, 'lte': le}
+
+# Text operators as like patterns ({} is the escaped value).
+LIKE_PATTERNS = {'contains': '%{}%', 'equals': '{}', 'starts_with': '{}%', 'ends_with': '%{}'}
+
+
+# PostgREST uses * as the like wildcard and offers no way to escape it in the URL, so such values stay local.
+# So do searches with like wildcards or quotes, which can't be escaped inside an or=() filter.
+def is_remote(predicate):
+    column, operator, value = predicate
+    values = value if isinstance(value, tuple) else (value,)
+    special = '*\\%_"' if operator == 'search' else '*\\'
+    return not any(isinstance(v, str) and any(character in v for character in special) for v in values)
+
+
+# Predicates answered by the trigram search index when the snapshot is loaded.
+def uses_search_index(predicate):
+    column, operator, value = predicate
+    return operator == 'search' or (operator == 'contains' and column in SEARCH_COLUMNS)
+
+
+# Regex (valid in Python and Postgres) matching a whole tag, or any of several, inside "tag1, tag2,tag3".
+def tag_pattern(tags):
+    tags = tags if isinstance(tags, tuple) else (tags,)
+    return r'(?:^|,)\s*(?:' + '|'.join(re.escape(tag) for tag in tags) + r')\s*(?:,|$)'
+
+
+# Add the server side predicates to a query builder.
+def apply_remote(query, predicates):
+    for column, operator, value in filter(is_remote, predicates):
+        if operator in LIKE_PATTERNS:
+            escaped = value.replace('%', r'\%').replace('_', r'\_')
+            query = query.ilike(column, LIKE_PATTERNS[operator].format(escaped))
+        elif operator in COMPARISONS:
+            query = getattr(query, operator)(column, value)
+        elif operator in ('has_tag', 'has_any_tag'):
+            query = query.filter(column, 'imatch', tag_pattern(value))
+        elif operator == 'search':
+            # substring only on the server (no accent folding or typos): every word in one of the columns
+            for term in value.split():
+                query = query.or_(','.join(f'{column}.ilike."*{term}*"' for column in SEARCH_COLUMNS))
+    return query
+
+
+# Boolean mask for one predicate, evaluated in pandas. Tag predicates use the inverted tag index when one is given,
+# text searches the trigram search index.
+def predicate_mask(data, predicate, tag_index=None, search_index=None):
+    column, operator, value = predicate
+    if search_index is not None and uses_search_index(predicate):
+        if operator == 'search':
+            return search_index.mask(data, value, typos=True)
+        return search_index.mask(data, value, columns=[column], phrase=True)
+    if operator == 'search':
+        return scan_mask(data, value)
+    if column not in data.columns:
+        return pd.Series(False, index=data.index)
+
+    if tag_index is not None and operator in ('has_tag', 'has_any_tag'):
+        tags = value if isinstance(value, tuple) else (value,)
+        return tag_index.mask(data, tags, 'and' if operator == 'has_tag' else 'or')
+
+    if operator in COMPARISONS:
+        mask = COMPARISONS[operator](pd.to_numeric(data[column], errors='coerce'), value)
+        return mask.fillna(False).astype(bool)
+
+    values = data[column].astype('string')
+    if operator == 'contains':
+        mask = values.str.contains(value, case=False, regex=False)
+    elif operator == 'equals':
+        mask = values.str.lower() == value.lower()
+    elif operator == 'starts_with':
+        mask = values.str.lower().str.startswith(value.lower())
+    elif operator == 'ends_with':
+        mask = values.str.lower().str.endswith(value.lower())
+    else:
+        mask = values.str.contains(tag_pattern(value), case=False, regex=True)
+    return mask.fillna(False).astype(bool)
+
+
+# Evaluate predicates locally. By default all of them; with local_only just those the server could not handle.
+def apply_local(data, predicates, local_only=False, tag_index=None, search_index=None):
+    mask = pd.Series(True, index=data.index)
+    for predicate in predicates:
+        if local_only and is_remote(predicate):
+            continue
+        mask &= predicate_mask(data, predicate, tag_index, search_index)
+    return data[mask]
+
+
+# Sort rows by `order`, a list of (column, descending), with the key as tie-breaker. Missing values go last.
+def sort_rows(data, order=None, key='nationbuilder_id'):
+    order = [(column, descending) for column, descending in order or [] if column in data.columns and column != key]
+    columns = [column for column, _ in order] + [key]
+    return data.sort_values(columns, ascending=[not descending for _, descending in order] + [True], kind='stable', na_position='last')
+
+
+# One page of matching rows, straight from the server. Returns (rows, total number of matching rows).
+# `order` is a list of (column, descending); rows are in key order by default.
+# When some predicate has to run locally the server can't count or page for us, so the matching rows are streamed
+# page by page, refined locally, and the requested page is cut from the result.
+def fetch_page(supabase_table, predicates, page=0, page_size=100, key='nationbuilder_id', order=None):
+    if all(is_remote(predicate) for predicate in predicates):
+        query = apply_remote(db.client().table(supabase_table).select('*', count='exact'), predicates)
+        for column, descending in order or []:
+            query = query.order(column, desc=descending)
+        query = query.order(key).range(page * page_size, (page + 1) * page_size - 1)
+        response = query.execute()
+        return loader.page_frame(response.data), response.count
+
+    matching = [apply_local(rows, predicates, local_only=True)
+                for rows in loader.iter_pages(supabase_table, key, where=lambda query: apply_remote(query, predicates))]
+    matching = [rows for rows in matching if not rows.empty]
+    if not matching:
+        return pd.DataFrame(), 0
+
+    matching = sort_rows(loader.concat_pages(matching), order, key)
+    return matching.iloc[page * page_size:(page + 1) * page_size].reset_index(drop=True), len(matching)
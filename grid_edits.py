@@ -0,0 +1,78 @@
+import json
+import pandas as pd
+import db
+from importer import LOOKUP_CHUNK_SIZE, chunks, to_records
+
+# Diff-only write-back for the AgGrid editor.
+# Compares the frame that was handed to the grid with what came back and only sends the cells that changed.
+
+
+# True if every non-empty value of the column is a number
+def is_numeric(values):
+    return pd.to_numeric(values, errors='coerce').notna().sum() == values.notna().sum()
+
+
+# Compare two versions of one column so that the grid round trip alone does not count as a change
+# (5 vs 5.0, None vs NaN vs '', a timestamp vs its ISO string).
+def cells_changed(old, new):
+    # timestamps come back from the grid as ISO strings
+    if isinstance(old.dtype, pd.DatetimeTZDtype) or pd.api.types.is_datetime64_dtype(old):
+        old, new = pd.to_datetime(old, utc=True), pd.to_datetime(new, utc=True, format='ISO8601', errors='coerce')
+        return (old != new) & ~(old.isna() & new.isna())
+
+    if is_numeric(old) and is_numeric(new):
+        old, new = pd.to_numeric(old, errors='coerce'), pd.to_numeric(new, errors='coerce')
+        return (old != new) & ~(old.isna() & new.isna())
+
+    old = old.astype('string').fillna('').str.strip()
+    new = new.astype('string').fillna('').str.strip()
+    return old != new
+
+
+# Cell-level diff. Returns a boolean frame (rows = key, columns = editable columns) that is True where a cell changed.
+def diff_frames(original, edited, key='nationbuilder_id'):
+    edited = pd.DataFrame(edited)
+    columns = [c for c in original.columns if c in edited.columns and c != key]
+
+    before = original.set_index(key)[columns]
+    after = edited.set_index(key)[columns].reindex(before.index)
+
+    changed = pd.DataFrame(False, index=before.index, columns=columns)
+    for column in columns:
+        changed[column] = cells_changed(before[column], after[column]).astype(bool)
+
+    # rows that disappeared from the grid response are not edits
+    changed = changed[before.index.isin(edited[key])]
+    return changed[changed.any(axis=1)]
+
+
+# Send only the changed cells, as updates of existing rows: rows setting the same columns to the same values are
+# grouped into one update(...).in_(key, ids) request (at most LOOKUP_CHUNK_SIZE keys, sent concurrently). An update
+# never inserts: a row deleted meanwhile stays deleted and is reported, and only UPDATE rights are needed.
+# Returns a report, one row per changed row: the key, the outcome ('updated' or 'failed') and the error.
+def write_changes(original, edited, supabase_table, key='nationbuilder_id'):
+    changed = diff_frames(original, edited, key)
+    if changed.empty:
+        return pd.DataFrame(columns=[key, 'outcome', 'error'])
+
+    edited = pd.DataFrame(edited).set_index(key)
+    records = to_records(edited.loc[changed.index, changed.columns])
+    groups = {}
+    for row_key, record, row_changed in zip(changed.index.tolist(), records, changed.to_numpy()):
+        values = {column: record[column] for column, is_changed in zip(changed.columns, row_changed) if is_changed}
+        groups.setdefault(json.dumps(values, sort_keys=True), (values, []))[1].append(row_key)
+    batches = [(values, ids) for values, group in groups.values() for ids in chunks(group, LOOKUP_CHUNK_SIZE)]
+    futures = [db.submit_query(lambda client, values=values, ids=ids: client.table(supabase_table).update(values).in_(key, ids))
+               for values, ids in batches]
+
+    report = pd.DataFrame({key: changed.index.tolist(), 'outcome': 'updated', 'error': None}).set_index(key)
+    for (values, ids), future in zip(batches, futures):
+        try:
+            written = {row[key] for row in future.result().data}
+        except Exception as error_track:
+            report.loc[ids, ['outcome', 'error']] = ['failed', str(error_track)]
+            continue
+        missing = [row_key for row_key in ids if row_key not in written]
+        if missing:
+            report.loc[missing, ['outcome', 'error']] = ['failed', 'row no longer exists']
+    return report.reset_index()
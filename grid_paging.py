@@ -0,0 +1,63 @@
+import filters
+import schema
+import snapshot_cache
+from query_plan import QueryPlan
+
+# Server-side paging for the member grid.
+# The grid only ever receives the visible block of rows. Its sort and column filters (ag-grid's sort and filter model,
+# sent back to Python through the grid state) are turned into an order and predicates, and the block is cut from the
+# table snapshot when it is in memory, or fetched with a ranged query otherwise. The payload sent to the browser
+# depends on the block size, not on the size of the table.
+
+# Columns shown first in the grid, the others follow in table order.
+FEATURED_COLUMNS = ['nationbuilder_id', 'first_name', 'last_name', 'address_city', 'tag_list', 'email', 'phone_number']
+
+# ag-grid text filter types -> filters operators
+TEXT_OPERATORS = {'contains': 'contains', 'equals': 'equals', 'startsWith': 'starts_with', 'endsWith': 'ends_with'}
+
+# ag-grid number filter types -> filters operators
+NUMBER_OPERATORS = {'equals': 'eq', 'greaterThan': 'gt', 'greaterThanOrEqual': 'gte', 'lessThan': 'lt', 'lessThanOrEqual': 'lte'}
+
+
+# Sort model of the grid state -> list of (column, descending).
+def grid_order(grid_state):
+    sort_model = ((grid_state or {}).get('sort') or {}).get('sortModel') or []
+    return [(entry['colId'], entry.get('sort') == 'desc') for entry in sort_model if entry.get('sort')]
+
+
+# Filter model of the grid state -> predicates. Only simple text and number conditions are supported, others are ignored.
+def grid_predicates(grid_state):
+    filter_model = ((grid_state or {}).get('filter') or {}).get('filterModel') or {}
+    predicates = []
+    for column, condition in filter_model.items():
+        value = condition.get('filter')
+        if value is None or value == '':
+            continue
+        if condition.get('filterType') == 'text' and condition.get('type') in TEXT_OPERATORS:
+            predicates.append((column, TEXT_OPERATORS[condition['type']], str(value)))
+        elif condition.get('filterType') == 'number' and condition.get('type') in NUMBER_OPERATORS:
+            predicates.append((column, NUMBER_OPERATORS[condition['type']], value))
+    return predicates
+
+
+# Grid column order: the featured columns present, then the rest.
+def display_columns(columns):
+    featured = [column for column in FEATURED_COLUMNS if column in columns]
+    return featured + [column for column in columns if column not in featured]
+
+
+# One block of rows for the grid, columns in display order. Returns (rows, total number of matching rows).
+# `columns` limits the block to those columns.
+def fetch_block(supabase_table, predicates, order=None, page=0, page_size=100, key='nationbuilder_id', columns=None):
+    data = snapshot_cache.current(supabase_table, key)
+    if data is None:
+        data, total = filters.fetch_page(supabase_table, predicates, page, page_size, key, order)
+        data = schema.cast(data, supabase_table)
+        return data[display_columns([column for column in columns or data.columns if column in data.columns])], total
+
+    # answered from the snapshot (kept in key order) with a lazy plan: one mask for all filters, only the matching
+    # rows sorted, and a single take of the block
+    tag_index = snapshot_cache.tag_index(supabase_table, key) if any(p[1] in ('has_tag', 'has_any_tag') for p in predicates) else None
+    search_index = snapshot_cache.search_index(supabase_table, key) if any(map(filters.uses_search_index, predicates)) else None
+    plan = QueryPlan(data, key).select(display_columns(columns or data.columns)).where(predicates, tag_index, search_index).order_by(order)
+    return plan.take(page * page_size, (page + 1) * page_size), plan.count()
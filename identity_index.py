@@ -0,0 +1,122 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Identity resolution index for imports.
+# Maps normalized emails and E.164 phone numbers to member keys (nationbuilder_id), built from the cached table
+# snapshot and patched as rows change. An import batch is resolved against it in one pass before anything is written:
+# every row gets the id of an existing member (or none, i.e. a new member) and a group shared with the other rows of
+# the file that have the same email or phone number, so each member is written once per import.
+
+# Country code for numbers written without one (the members are mostly Italian).
+DEFAULT_COUNTRY_CODE = os.environ.get('DEFAULT_COUNTRY_CODE', '39')
+
+
+# Emails compared case-insensitively, surrounding spaces removed. Values without '@' are not emails.
+def normalize_emails(values):
+    emails = pd.Series(values).astype('string').str.strip().str.lower()
+    return emails.where(emails.str.contains('@', regex=False, na=False))
+
+
+# Phone numbers in E.164 ("+393331234567"). Spaces, dashes, dots and brackets are dropped, a '00' prefix becomes '+',
+# numbers without a country code get DEFAULT_COUNTRY_CODE. Anything that isn't 8 to 15 digits is not a phone number.
+# Numbers read from CSV as floats ("3331234567.0") are handled too.
+def normalize_phones(values, country_code=DEFAULT_COUNTRY_CODE):
+    phones = pd.Series(values).astype('string').str.strip().str.replace(r'\.0$', '', regex=True)
+    international = phones.str.startswith('+') | phones.str.startswith('00')
+    digits = phones.str.replace(r'[^0-9]', '', regex=True)
+    digits = digits.where(~phones.str.startswith('00'), digits.str[2:])
+
+    # national numbers: Italian mobiles start with 3, landlines with 0; a leading country code is kept as is
+    has_country = international | (digits.str.startswith(country_code) & (digits.str.len() > 10))
+    digits = digits.where(has_country, country_code + digits)
+    valid = digits.str.len().between(8, 15) & digits.notna()
+    return ('+' + digits).where(valid.fillna(False))
+
+
+class IdentityIndex:
+
+    def __init__(self, key='nationbuilder_id'):
+        self.key = key
+        self.emails = {}    # normalized email -> key
+        self.phones = {}    # E.164 phone -> key
+        self.entries = {}   # key -> (email, phone), to un-index changed or deleted rows
+
+    @classmethod
+    def from_frame(cls, data, key='nationbuilder_id'):
+        index = cls(key)
+        index.add(data)
+        return index
+
+    # Index new or changed rows. When two members share an email or phone, the one indexed first keeps it.
+    def add(self, data):
+        if data is None or data.empty:
+            return
+        self.remove(data[self.key])
+
+        emails = normalize_emails(data['email']) if 'email' in data.columns else pd.Series(pd.NA, index=data.index, dtype='string')
+        phones = normalize_phones(data['phone_number']) if 'phone_number' in data.columns else pd.Series(pd.NA, index=data.index, dtype='string')
+        for member, email, phone in zip(data[self.key].tolist(), emails.tolist(), phones.tolist()):
+            email = None if pd.isna(email) else email
+            phone = None if pd.isna(phone) else phone
+            self.entries[member] = (email, phone)
+            if email is not None:
+                self.emails.setdefault(email, member)
+            if phone is not None:
+                self.phones.setdefault(phone, member)
+
+    # Drop rows (deleted members, or the old version of changed ones).
+    def remove(self, keys):
+        for member in pd.Series(keys).tolist():
+            email, phone = self.entries.pop(member, (None, None))
+            if email is not None and self.emails.get(email) == member:
+                del self.emails[email]
+            if phone is not None and self.phones.get(phone) == member:
+                del self.phones[phone]
+
+    # Resolve a batch of incoming rows in one pass. Returns a frame aligned with `df`:
+    #   nationbuilder_id  existing member (email match first, then phone), NA for a new member
+    #   group             position of the first row of the file describing the same member
+    #   email, phone      normalized keys
+    # Rows are in the same group when they share an email, a phone number or the existing member they resolve to
+    # (transitively, through a small union-find).
+    def resolve(self, df):
+        emails = normalize_emails(df['email']) if 'email' in df.columns else pd.Series(pd.NA, index=df.index, dtype='string')
+        phones = normalize_phones(df['phone_number']) if 'phone_number' in df.columns else pd.Series(pd.NA, index=df.index, dtype='string')
+        emails, phones = emails.tolist(), phones.tolist()
+
+        parent = list(range(len(df)))
+
+        def find(row):
+            while parent[row] != row:
+                parent[row] = parent[parent[row]]
+                row = parent[row]
+            return row
+
+        matched = [None] * len(df)
+        first_row = {}   # ('email' | 'phone' | 'id', value) -> first row holding it
+        for row in range(len(df)):
+            email = None if pd.isna(emails[row]) else emails[row]
+            phone = None if pd.isna(phones[row]) else phones[row]
+            member = self.emails.get(email) if email is not None else None
+            if member is None and phone is not None:
+                member = self.phones.get(phone)
+            matched[row] = member
+
+            for name, value in (('email', email), ('phone', phone), ('id', member)):
+                if value is None:
+                    continue
+                other = first_row.setdefault((name, value), row)
+                if other != row:
+                    # the earlier row's root stays the root, so groups are named after their first row
+                    root, other_root = find(row), find(other)
+                    if root != other_root:
+                        parent[max(root, other_root)] = min(root, other_root)
+
+        groups = np.array([find(row) for row in range(len(df))], dtype=np.int64)
+
+        # a group resolves to the member of its first matched row
+        matched = pd.Series(matched, dtype='object')
+        group_ids = matched.groupby(groups).transform('first')
+        return pd.DataFrame({'nationbuilder_id': group_ids.where(group_ids.notna(), pd.NA).to_numpy(), 'group': groups,
+                             'email': emails, 'phone': phones}, index=df.index)
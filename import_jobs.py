@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import logging
+import uuid
+import shutil
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import csv_ingest
+
+# Background import jobs.
+# An upload is copied to disk and recorded as a job in a small SQLite table, then imported by a worker thread that
+# lives outside the Streamlit rerun cycle. The worker streams the file with csv_ingest.ingest, so every committed chunk
+# is checkpointed; the job row mirrors the checkpoint for the UI. Several app processes can share the jobs table: a
+# job is owned by the process that queued or claimed it, which renews a lease on it every HEARTBEAT_INTERVAL seconds.
+# Jobs whose lease ran out (their process stopped) are claimed by another process, or after a restart, and continue
+# from their last committed chunk; a claim is a single conditional update, so a job never runs in two places.
+
+JOBS_DB = os.path.join(csv_ingest.CHECKPOINT_DIR, 'jobs.sqlite')
+
+# Imports running at the same time.
+JOB_WORKERS = int(os.environ.get('IMPORT_JOB_WORKERS', 2))
+
+STATUSES = ['queued', 'running', 'done', 'failed']
+
+# Seconds between lease renewals, and without one before a job is taken over.
+HEARTBEAT_INTERVAL = 10
+LEASE_SECONDS = 60
+
+# This process, as the owner of the jobs it runs.
+OWNER = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+_executor = None
+_scheduled = set()
+_guard = threading.Lock()
+
+
+# Connection to the jobs table, committed and closed when the block ends.
+@contextmanager
+def _connect():
+    os.makedirs(csv_ingest.CHECKPOINT_DIR, exist_ok=True)
+    connection = sqlite3.connect(JOBS_DB, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute('''create table if not exists jobs (
+        id integer primary key autoincrement, digest text, file_name text, supabase_table text, mapping text,
+        status text, rows_total integer default 0, rows_done integer default 0, inserted integer default 0,
+        updated integer default 0, rejected integer default 0, error text,
+        created_at real, started_at real, start_rows integer default 0, updated_at real)''')
+    columns = {row['name'] for row in connection.execute('pragma table_info(jobs)')}
+    for column, column_type in (('owner', 'text'), ('heartbeat_at', 'real')):
+        if column not in columns:
+            connection.execute(f'alter table jobs add column {column} {column_type}')
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def _update(job_id, **values):
+    values['updated_at'] = time.time()
+    with _connect() as connection:
+        connection.execute(f"update jobs set {', '.join(f'{column} = ?' for column in values)} where id = ?", [*values.values(), job_id])
+
+
+def _file_path(digest):
+    return os.path.join(csv_ingest.CHECKPOINT_DIR, f'{digest}.csv')
+
+
+# Checkpoint (and rejected rows) of a job, its own even when other jobs import the same file.
+def _checkpoint_name(job_id):
+    return f'job-{job_id}'
+
+
+# Worker pool, created on first use, with the thread keeping this process's leases and taking over abandoned jobs.
+def _pool():
+    global _executor
+    with _guard:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='import-job')
+            threading.Thread(target=_heartbeat_loop, name='import-job-heartbeat', daemon=True).start()
+        return _executor
+
+
+# Renew the leases of this process's jobs, and queue the jobs whose lease ran out (including those of an earlier run
+# of the app) to be claimed here.
+def _heartbeat_loop():
+    while True:
+        now = time.time()
+        try:
+            with _connect() as connection:
+                connection.execute("update jobs set heartbeat_at = ? where owner = ? and status in ('queued', 'running')", (now, OWNER))
+                abandoned = [row['id'] for row in connection.execute(
+                    "select id from jobs where status in ('queued', 'running') and (heartbeat_at is null or heartbeat_at < ?) order by id",
+                    (now - LEASE_SECONDS,))]
+            for job_id in abandoned:
+                _schedule(job_id)
+        except sqlite3.Error:
+            logging.exception('Could not renew the import job leases')
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+# Hand a job to the worker pool, once per process until it has run.
+def _schedule(job_id):
+    pool = _pool()
+    with _guard:
+        if job_id in _scheduled:
+            return
+        _scheduled.add(job_id)
+    pool.submit(run_job, job_id)
+
+
+# Take a job for this process: queued here (or by a version without owners), or its lease ran out. False if another
+# process holds it, or it finished meanwhile.
+def _claim(job_id):
+    now = time.time()
+    with _connect() as connection:
+        claimed = connection.execute(
+            "update jobs set status = 'running', owner = ?, heartbeat_at = ?, updated_at = ? where id = ? and "
+            "((status = 'queued' and (owner = ? or owner is null)) or (status in ('queued', 'running') and (heartbeat_at is null or heartbeat_at < ?)))",
+            (OWNER, now, now, job_id, OWNER, now - LEASE_SECONDS)).rowcount
+    return claimed == 1
+
+
+# Remove a job's copy of the file once no other job still needs it (queued, running, or failed and retryable).
+# Under the database's write lock, so a job queued for the same file at the same time either sees the file or copies it again.
+def _release_file(job):
+    with _connect() as connection:
+        connection.execute('begin immediate')
+        others = connection.execute("select count(*) from jobs where digest = ? and id != ? and status in ('queued', 'running', 'failed')",
+                                    (job['digest'], job['id'])).fetchone()[0]
+        if not others and os.path.exists(_file_path(job['digest'])):
+            os.remove(_file_path(job['digest']))
+
+
+# Run one job to the end, unless another process holds it. Progress is written to the job row after every chunk.
+def run_job(job_id):
+    try:
+        if _claim(job_id):
+            _run_claimed(job_id)
+    finally:
+        with _guard:
+            _scheduled.discard(job_id)
+
+
+def _run_claimed(job_id):
+    job = get_job(job_id)
+    _update(job_id, started_at=time.time(), start_rows=job['rows_done'], error=None)
+
+    def save_progress(checkpoint, rejected):
+        _update(job_id, heartbeat_at=time.time(), **{column: checkpoint[column] for column in ('rows_total', 'rows_done', 'inserted', 'updated', 'rejected')})
+
+    try:
+        with open(_file_path(job['digest']), 'rb') as file:
+            checkpoint = csv_ingest.ingest(file, json.loads(job['mapping']), job['supabase_table'], progress=save_progress,
+                                           name=_checkpoint_name(job_id))
+        save_progress(checkpoint, None)
+        _update(job_id, status='done')
+        _release_file(job)
+    except Exception as error_track:
+        _update(job_id, status='failed', error=str(error_track))
+
+
+# Queue an import of an uploaded file. The same file, table and mapping already queued or running is not started twice,
+# and a failed one is resumed. Returns the job id.
+def submit(uploaded_file, column_mapping, supabase_table):
+    digest, rows_total = csv_ingest.scan_file(uploaded_file)
+    mapping = json.dumps(column_mapping)
+
+    # copied aside first, put in place together with the new job row (see _release_file)
+    uploaded_file.seek(0)
+    copy_path = f'{_file_path(digest)}.{uuid.uuid4().hex}.tmp'
+    with open(copy_path, 'wb') as copy:
+        shutil.copyfileobj(uploaded_file, copy)
+    uploaded_file.seek(0)
+
+    now = time.time()
+    with _connect() as connection:
+        connection.execute('begin immediate')
+        running = connection.execute("select id, status from jobs where digest = ? and supabase_table = ? and mapping = ? "
+                                     "and status in ('queued', 'running', 'failed') order by id desc",
+                                     (digest, supabase_table, mapping)).fetchone()
+        if running is None:
+            job_id = connection.execute('insert into jobs (digest, file_name, supabase_table, mapping, status, rows_total, created_at, updated_at, owner, heartbeat_at) '
+                                        'values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        (digest, getattr(uploaded_file, 'name', ''), supabase_table, mapping, 'queued', rows_total, now, now, OWNER, now)).lastrowid
+            if not os.path.exists(_file_path(digest)):
+                os.replace(copy_path, _file_path(digest))
+    if os.path.exists(copy_path):
+        os.remove(copy_path)
+    if running is not None:
+        if running['status'] == 'failed':
+            retry(running['id'])
+        return running['id']
+
+    _schedule(job_id)
+    return job_id
+
+
+# Run a failed job again. It continues after its last committed chunk. Only while it is failed: a second retry
+# (another session or process) doesn't queue it again once it runs.
+def retry(job_id):
+    now = time.time()
+    with _connect() as connection:
+        queued = connection.execute("update jobs set status = 'queued', error = null, owner = ?, heartbeat_at = ?, updated_at = ? "
+                                    "where id = ? and status = 'failed'", (OWNER, now, now, job_id)).rowcount
+    if queued:
+        _schedule(job_id)
+
+
+def get_job(job_id):
+    _pool()
+    with _connect() as connection:
+        row = connection.execute('select * from jobs where id = ?', (job_id,)).fetchone()
+    return None if row is None else dict(row)
+
+
+# Most recent jobs first.
+def list_jobs(limit=20):
+    _pool()
+    with _connect() as connection:
+        return [dict(row) for row in connection.execute('select * from jobs order by id desc limit ?', (limit,))]
+
+
+# Rows imported per second by the current (or last) run of a job.
+def throughput(job):
+    if not job['started_at']:
+        return 0.0
+    elapsed = (job['updated_at'] or job['started_at']) - job['started_at']
+    return (job['rows_done'] - job['start_rows']) / elapsed if elapsed > 0 else 0.0
+
+
+# Rejected rows of a job, with the error for each, and the rows imported with a warning.
+def job_errors(job_id):
+    return csv_ingest.read_errors(_checkpoint_name(job_id))
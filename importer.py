@@ -0,0 +1,272 @@
+import os
+import json
+import logging
+import pandas as pd
+from postgrest import APIError
+import db
+import schema
+from tag_index import merge_tag_columns
+from identity_index import IdentityIndex, normalize_emails, normalize_phones
+
+# Bulk import engine for CSV uploads.
+# Instead of one select + one update/insert per row, all candidate matches for a batch are fetched
+# with a handful of in_() queries, matched in memory and written back with chunked bulk calls (concurrently, see db).
+
+# Values per in_() lookup. Keeps the request URL well under PostgREST/proxy limits.
+LOOKUP_CHUNK_SIZE = 200
+
+# Rows per bulk upsert/insert request.
+WRITE_CHUNK_SIZE = 500
+
+# Columns used to recognise an existing user, in order of priority.
+MATCH_COLUMNS = ['email', 'phone_number']
+
+# Postgres function that upserts a chunk and unions tags in one statement (sql/merge_members.sql), per table.
+MERGE_FUNCTIONS = {'db_2': 'merge_members'}
+
+# SUPABASE_MERGE_RPC=1 once those functions are installed. Otherwise tags are merged here and written with
+# upsert/insert, which is also the fallback when the database turns out not to have the function.
+USE_MERGE_RPC = os.environ.get('SUPABASE_MERGE_RPC') == '1'
+
+# Error codes of a call to a function the database doesn't have (PostgREST, Postgres).
+MISSING_FUNCTION_CODES = ('PGRST202', '42883')
+
+
+# split a list into pieces of at most `size` items
+def chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+# DataFrame -> list of JSON-safe dicts. NaN becomes None, whole-number floats (e.g. phone numbers with gaps) stay ints.
+def to_records(df):
+    return json.loads(df.convert_dtypes().to_json(orient='records', date_format='iso'))
+
+
+# Turn a column into comparable string keys. Phone numbers read from CSV can be ints or floats ("4321678901.0").
+def match_keys(values):
+    keys = values.astype('string').str.strip()
+    keys = keys.str.replace(r'\.0$', '', regex=True)
+    return keys.mask(keys == '')
+
+
+# for a single user, combines old tag data with new tag data (formerly b06_dash.combine_tags).
+# tag_index.merge_tag_columns applies the same rules to whole columns.
+def merge_tags(current_tag_list, tag_list):
+    if not isinstance(tag_list, str) or not tag_list.strip():
+        return current_tag_list
+
+    # Merge tags. Else if no prior tags, simply overwrite
+    if isinstance(current_tag_list, str) and current_tag_list:
+        updated_tag_list = current_tag_list.split(',') + tag_list.split(',')
+    else:
+        updated_tag_list = tag_list.split(',')
+
+    # Remove spaces, only keep unique values (first seen wins), format list into human friendly string.
+    updated_tag_list = [x.strip() for x in updated_tag_list]
+    updated_tag_list = list(dict.fromkeys(x for x in updated_tag_list if x))
+    return ', '.join(updated_tag_list)
+
+
+# Fetch every existing user that shares an email or phone number with the batch. The chunked in_() lookups for one
+# column run concurrently. Values are looked up as written in the file and normalized (see identity_index).
+# Phone numbers are only looked up for rows that did not already match by email.
+def fetch_matches(supabase_table, df):
+    found = []
+    unmatched = df
+    for column, normalize in (('email', normalize_emails), ('phone_number', normalize_phones)):
+        if column not in unmatched.columns:
+            continue
+
+        normalized = normalize(unmatched[column])
+        variants = [match_keys(unmatched[column]), normalized]
+        if column == 'phone_number':
+            variants.append(normalized.str[1:])
+        values = pd.concat(variants).dropna().unique().tolist()
+        responses = db.execute_all([lambda client, column=column, chunk=chunk: client.table(supabase_table).select('*').in_(column, chunk)
+                                    for chunk in chunks(values, LOOKUP_CHUNK_SIZE)])
+        for response in responses:
+            found += response.data
+
+        if found and column in pd.DataFrame(found).columns:
+            unmatched = unmatched[~normalized.isin(set(normalize(pd.DataFrame(found)[column]).dropna()))]
+
+    existing = pd.DataFrame(found)
+    if existing.empty:
+        return pd.DataFrame(columns=['nationbuilder_id'] + MATCH_COLUMNS)
+
+    return existing.drop_duplicates('nationbuilder_id').reset_index(drop=True)
+
+
+# Current rows of the given members, for merging incoming values into them.
+def fetch_members(supabase_table, ids):
+    responses = db.execute_all([lambda client, chunk=chunk: client.table(supabase_table).select('*').in_('nationbuilder_id', chunk)
+                                for chunk in chunks(list(ids), LOOKUP_CHUNK_SIZE)])
+    rows = [row for response in responses for row in response.data]
+    return pd.DataFrame(rows) if rows else pd.DataFrame(columns=['nationbuilder_id'])
+
+
+# Fold several rows that describe the same user into one. Later non-empty values win, tags are merged.
+def collapse_rows(rows):
+    merged = rows.iloc[0].copy()
+    for _, row in rows.iloc[1:].iterrows():
+        tag_list = merge_tags(merged.get('tag_list'), row.get('tag_list'))
+        merged = row.combine_first(merged)
+        if 'tag_list' in merged:
+            merged['tag_list'] = tag_list
+    return merged
+
+
+# One record per user. `groups` holds a label per row, the same for all rows describing the same user.
+# Returns the records (indexed by the first row of each group) and, for every row, the record it went into.
+def collapse_duplicates(df, groups):
+    owner = df.index.to_series().groupby(groups, sort=False).transform('first')
+    repeated = groups.duplicated(keep=False)
+    if not repeated.any():
+        return df, owner
+
+    folded = pd.DataFrame([collapse_rows(group) for _, group in df[repeated].groupby(groups[repeated], sort=False)])
+    folded.index = owner[repeated].unique()
+    return pd.concat([df[~repeated], folded]).sort_index(), owner
+
+
+# Send records in chunks of WRITE_CHUNK_SIZE, all chunks concurrently. `query(client, rows)` returns the write query.
+# Yields (batch, response, error) per batch written or given up on. A batch Postgres rejects over a bad value (one
+# row fails the whole statement, so nothing of it was written) is split in halves and sent again, down to the rows at
+# fault, so only those are rejected. Other errors give up on the batch.
+def send_chunks(records, query):
+    batches = [records.iloc[start:start + WRITE_CHUNK_SIZE] for start in range(0, len(records), WRITE_CHUNK_SIZE)]
+    pending = [(batch, db.submit_query(lambda client, rows=to_records(batch): query(client, rows))) for batch in batches]
+    while pending:
+        split = []
+        for batch, future in pending:
+            try:
+                yield batch, future.result(), None
+            except Exception as error_track:
+                if len(batch) > 1 and is_row_error(error_track):
+                    split += [batch.iloc[:len(batch) // 2], batch.iloc[len(batch) // 2:]]
+                else:
+                    yield batch, None, error_track
+        pending = [(batch, db.submit_query(lambda client, rows=to_records(batch): query(client, rows))) for batch in split]
+
+
+# Errors caused by the values of some rows (SQLSTATE classes 22, data exception, and 23, constraint violation).
+def is_row_error(error):
+    return isinstance(error, APIError) and str(error.code)[:2] in ('22', '23')
+
+
+# Send records to the database in chunks (see send_chunks). `build(client, rows)` returns the write query.
+# Returns outcome, nationbuilder_id and error per record.
+def write_chunks(records, build, outcome):
+    result = pd.DataFrame({'outcome': outcome, 'nationbuilder_id': pd.NA, 'error': pd.NA}, index=records.index, dtype='object')
+    for batch, response, error_track in send_chunks(records, build):
+        if error_track is not None:
+            result.loc[batch.index, 'outcome'] = 'rejected'
+            result.loc[batch.index, 'error'] = str(error_track)
+            continue
+        ids = [row.get('nationbuilder_id') for row in response.data]
+        if len(ids) == len(batch):
+            result.loc[batch.index, 'nationbuilder_id'] = ids
+    return result
+
+
+# Send records to a merge function (see MERGE_FUNCTIONS) in chunks (see send_chunks), one round trip each.
+# The function answers with (ord, id, outcome) for every row it wrote. Returns outcome, nationbuilder_id and error per record.
+# Raises the APIError if the function isn't installed (nothing was written then).
+def merge_chunks(records, function, key='nationbuilder_id'):
+    result = pd.DataFrame({'outcome': 'rejected', 'nationbuilder_id': pd.NA, 'error': 'member not found'}, index=records.index, dtype='object')
+    for batch, response, error_track in send_chunks(records, lambda client, rows: client.rpc(function, {'payload': rows})):
+        if error_track is not None:
+            if isinstance(error_track, APIError) and str(error_track.code) in MISSING_FUNCTION_CODES:
+                raise error_track
+            result.loc[batch.index, 'error'] = str(error_track)
+            continue
+        for row in response.data:
+            result.loc[batch.index[row['ord'] - 1], ['outcome', 'nationbuilder_id', 'error']] = [row['outcome'], row[key], pd.NA]
+    return result
+
+
+# Processes CSV imports in bulk. Updates/Inserts user information.
+# `identity` is an IdentityIndex over the table (e.g. snapshot_cache.identity_index); rows are then resolved in memory
+# and only the matched users are read back. Without it the matching users are looked up first.
+# Tables with a merge function (MERGE_FUNCTIONS) are written through it, other tables with bulk upserts and inserts.
+# Returns a report with one line per incoming row: outcome (inserted, updated, rejected), nationbuilder_id, error, and
+# a warning for values that were left out (an invalid phone number next to a valid email).
+def import_data(df, supabase_table, identity=None):
+    df = df.reset_index(drop=True)
+    report = pd.DataFrame({'outcome': pd.NA, 'nationbuilder_id': pd.NA, 'error': pd.NA, 'warning': pd.NA}, index=df.index, dtype='object')
+
+    # Every line needs either an email or phone number.
+    has_key = pd.Series(False, index=df.index)
+    for column in MATCH_COLUMNS:
+        if column in df.columns:
+            has_key |= match_keys(df[column]).notna()
+    report.loc[~has_key, 'outcome'] = 'rejected'
+    report.loc[~has_key, 'error'] = 'missing email and phone number'
+
+    # Values that are given must be valid, checked for the whole batch at once (see schema.validate). The phone number
+    # is optional next to an email: an invalid one is left out and the row goes in with a warning.
+    invalid = schema.validate(df).where(has_key)
+    if 'email' in df.columns and 'phone_number' in df.columns:
+        bad_phone = invalid.isin(['invalid phone number']) & match_keys(df['email']).notna()
+        df['phone_number'] = df['phone_number'].mask(bad_phone)
+        report.loc[bad_phone, 'warning'] = 'invalid phone number left out'
+        invalid = invalid.mask(bad_phone)
+    report.loc[invalid.notna(), 'outcome'] = 'rejected'
+    report.loc[invalid.notna(), 'error'] = invalid[invalid.notna()]
+    df_valid = df[has_key & invalid.isna()]
+    if df_valid.empty:
+        return report
+
+    # resolve every row to an existing user (or a new one) and to its group of duplicate rows inside the file. Without
+    # an identity index from the snapshot, one is built from the users that match the batch.
+    existing = None
+    if identity is None:
+        existing = fetch_matches(supabase_table, df_valid)
+        identity = IdentityIndex.from_frame(existing)
+    resolved = identity.resolve(df_valid)
+    groups = pd.Series(df_valid.index[resolved['group'].to_numpy()], index=df_valid.index)
+    records, owner = collapse_duplicates(df_valid, groups)
+    record_ids = resolved.loc[records.index, 'nationbuilder_id']
+
+    # merge on the server: one statement per chunk updates existing users (tags unioned under the row lock) and
+    # inserts new ones, so nothing has to be read back and concurrent imports can't lose tags
+    merge_function = MERGE_FUNCTIONS.get(supabase_table) if USE_MERGE_RPC else None
+    if merge_function is not None:
+        merged = records.copy()
+        merged.insert(0, 'nationbuilder_id', record_ids)
+        try:
+            outcomes = merge_chunks(merged, merge_function)
+        except APIError:
+            logging.warning('%s is not installed (see sql/merge_members.sql), merging tags here instead', merge_function)
+        else:
+            report.loc[df_valid.index, outcomes.columns] = outcomes.loc[owner.values].values
+            return report
+
+    if existing is None:
+        existing = fetch_members(supabase_table, record_ids.dropna().unique())
+
+    # existing users: keep stored values where the file is empty, merge tags
+    updates = records[record_ids.notna()].copy()
+    updates.insert(0, 'nationbuilder_id', record_ids[updates.index])
+    if not updates.empty:
+        current = existing.set_index('nationbuilder_id').reindex(updates['nationbuilder_id'])
+        current.index = updates.index
+        shared_columns = [c for c in updates.columns if c in current.columns]
+        updates[shared_columns] = updates[shared_columns].where(updates[shared_columns].notna(), current[shared_columns])
+        if 'tag_list' in updates.columns and 'tag_list' in current.columns:
+            incoming_tags = records.loc[updates.index, 'tag_list']
+            updates['tag_list'] = merge_tag_columns(current['tag_list'], incoming_tags).to_numpy()
+
+    # new users
+    inserts = records[record_ids.isna()]
+
+    # write back: updates as bulk upserts on nationbuilder_id, new users as bulk inserts
+    updated = write_chunks(updates, lambda client, rows: client.table(supabase_table).upsert(rows, on_conflict='nationbuilder_id'), 'updated')
+    updated['nationbuilder_id'] = updates['nationbuilder_id']
+    inserted = write_chunks(inserts, lambda client, rows: client.table(supabase_table).insert(rows), 'inserted')
+
+    # every row reports the outcome of the record it was folded into
+    outcomes = pd.concat([updated, inserted])
+    report.loc[df_valid.index, outcomes.columns] = outcomes.loc[owner.values].values
+    return report
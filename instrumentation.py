@@ -0,0 +1,192 @@
+import os
+import re
+import time
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+import httpx
+import pandas as pd
+from prometheus_client import Counter, Histogram, start_http_server
+
+# Request-level instrumentation.
+# httpx event hooks on the shared clients' PostgREST sessions record every Supabase call (table, filter, rows,
+# payload bytes, latency), and timed() measures dashboard sections (page_* functions, plotly renders). Everything goes
+# to Prometheus metrics (served on METRICS_PORT when set) and to a per-rerun log that the Diagnostics page reads to
+# show the slowest calls and N+1 patterns: the same query shape sent over and over with different values.
+# The log is per process: with several sessions open, their reruns interleave.
+
+# Port for the Prometheus /metrics endpoint. 0 = not served.
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+
+# Reruns kept in the log (the current one included).
+RUNS_KEPT = 5
+
+# Calls of the same shape in one rerun from which they count as an N+1 pattern.
+N_PLUS_ONE_CALLS = 5
+
+# Query parameters that don't select rows.
+NON_FILTER_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+REQUESTS = Counter('supabase_requests_total', 'Supabase requests', ['table', 'method', 'status'])
+REQUEST_SECONDS = Histogram('supabase_request_seconds', 'Supabase request latency', ['table', 'method'])
+ROWS = Counter('supabase_rows_total', 'Rows returned by Supabase requests', ['table', 'method'])
+PAYLOAD_BYTES = Counter('supabase_payload_bytes_total', 'Bytes sent to and received from Supabase', ['table', 'direction'])
+SECTION_SECONDS = Histogram('dashboard_section_seconds', 'Time spent in dashboard sections', ['kind', 'name'])
+
+_lock = threading.Lock()
+_runs = deque([{'started': time.time(), 'calls': [], 'sections': []}], maxlen=RUNS_KEPT)
+_metrics_served = False
+
+
+# Start a new rerun in the log. Call at the top of the script.
+def start_run():
+    with _lock:
+        _runs.append({'started': time.time(), 'calls': [], 'sections': []})
+
+
+# The last finished rerun (the one before the current), or None.
+def last_run():
+    with _lock:
+        return _runs[-2] if len(_runs) > 1 else None
+
+
+def serve_metrics():
+    global _metrics_served
+    with _lock:
+        if METRICS_PORT and not _metrics_served:
+            start_http_server(METRICS_PORT)
+            _metrics_served = True
+
+
+# "/rest/v1/db_2" -> "db_2", "/rest/v1/rpc/merge_members" -> "rpc/merge_members"
+def table_name(url):
+    path = url.path.rstrip('/')
+    parts = path.split('/')
+    return '/'.join(parts[-2:]) if len(parts) > 1 and parts[-2] == 'rpc' else parts[-1]
+
+
+# "eq.42", "not.in.(1,2)" -> "eq.?", "not.in.?"
+OPERATOR_VALUE = re.compile(r'^((?:not\.)?[a-z]+)\..*$', re.DOTALL)
+OPERATOR_ONLY = r'\1.?'
+
+
+# Filter of a request as sent ("email=in.(a,b)&tag_list=imatch.x") and its shape, with the values left out.
+def request_filter(url):
+    conditions = [(name, value) for name, value in url.params.multi_items() if name not in NON_FILTER_PARAMS]
+    text = '&'.join(f'{name}={value}' for name, value in conditions)
+    shape = '&'.join(f'{name}={OPERATOR_VALUE.sub(OPERATOR_ONLY, value)}' for name, value in conditions)
+    return text, shape
+
+
+# Rows in a response: from Content-Range ("0-999/*", "*/0") when PostgREST sends it, else from the JSON body.
+def response_rows(response):
+    content_range = response.headers.get('content-range', '')
+    match = re.match(r'^(\d+)-(\d+)/', content_range)
+    if match:
+        return int(match.group(2)) - int(match.group(1)) + 1
+    if content_range.startswith('*/'):
+        return 0
+    try:
+        body = response.json()
+    except ValueError:
+        return 0
+    return len(body) if isinstance(body, list) else 1
+
+
+def record(response):
+    request = response.request
+    seconds = time.perf_counter() - request.extensions.get('instrumentation_started', time.perf_counter())
+    table = table_name(request.url)
+    text, shape = request_filter(request.url)
+    rows = response_rows(response)
+    sent, received = len(request.content), len(response.content)
+
+    REQUESTS.labels(table, request.method, str(response.status_code)).inc()
+    REQUEST_SECONDS.labels(table, request.method).observe(seconds)
+    ROWS.labels(table, request.method).inc(rows)
+    PAYLOAD_BYTES.labels(table, 'sent').inc(sent)
+    PAYLOAD_BYTES.labels(table, 'received').inc(received)
+    with _lock:
+        _runs[-1]['calls'].append({'table': table, 'method': request.method, 'filter': text, 'shape': shape, 'rows': rows,
+                                   'bytes_sent': sent, 'bytes_received': received, 'seconds': seconds,
+                                   'status': response.status_code, 'thread': threading.current_thread().name})
+
+
+def _on_request(request):
+    request.extensions['instrumentation_started'] = time.perf_counter()
+
+
+def _on_response(response):
+    response.read()
+    record(response)
+
+
+async def _on_request_async(request):
+    _on_request(request)
+
+
+async def _on_response_async(response):
+    await response.aread()
+    record(response)
+
+
+# Attach the hooks to a Supabase client's PostgREST session (sync or async). Safe to call again: the session is
+# recreated after an auth change, so db calls this whenever it hands out the client. Clients without a PostgREST
+# session (e.g. fake_supabase) are left alone.
+def instrument(supabase_client):
+    session = getattr(getattr(supabase_client, 'postgrest', None), 'session', None)
+    if not isinstance(session, (httpx.Client, httpx.AsyncClient)):
+        return supabase_client
+    on_request, on_response = (_on_request_async, _on_response_async) if isinstance(session, httpx.AsyncClient) else (_on_request, _on_response)
+    hooks = session.event_hooks
+    if on_request not in hooks['request']:
+        session.event_hooks = {'request': hooks['request'] + [on_request], 'response': hooks['response'] + [on_response]}
+    return supabase_client
+
+
+@contextmanager
+def timer(kind, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        SECTION_SECONDS.labels(kind, name).observe(seconds)
+        with _lock:
+            _runs[-1]['sections'].append({'kind': kind, 'name': name, 'seconds': seconds})
+
+
+# Decorator: time every call of a function as a section of `kind` ('page', 'plot', ...).
+def timed(kind, name=None):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(kind, name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def calls_frame(run):
+    return pd.DataFrame(run['calls'] if run else [], columns=['table', 'method', 'filter', 'shape', 'rows', 'bytes_sent',
+                                                             'bytes_received', 'seconds', 'status', 'thread'])
+
+
+# The n slowest calls of a rerun.
+def slowest_calls(run, n=20):
+    return calls_frame(run).nlargest(n, 'seconds').drop(columns='shape').reset_index(drop=True)
+
+
+# Query shapes sent at least N_PLUS_ONE_CALLS times in a rerun, most frequent first.
+def n_plus_one(run, threshold=N_PLUS_ONE_CALLS):
+    calls = calls_frame(run)
+    patterns = calls.groupby(['method', 'table', 'shape'], as_index=False).agg(
+        calls=('seconds', 'size'), seconds=('seconds', 'sum'), rows=('rows', 'sum'))
+    return patterns[patterns['calls'] >= threshold].sort_values('calls', ascending=False, ignore_index=True)
+
+
+# Section timings of a rerun, slowest first.
+def sections(run):
+    frame = pd.DataFrame(run['sections'] if run else [], columns=['kind', 'name', 'seconds'])
+    return frame.sort_values('seconds', ascending=False, ignore_index=True)
@@ -0,0 +1,120 @@
+import pandas as pd
+import db
+import schema
+
+# Paginated table loader.
+# A plain select('*') is silently capped by PostgREST's max-rows setting and materialises the whole JSON payload at once.
+# Here the table is read in pages with keyset pagination (key > last key seen), optionally split into key ranges
+# that are fetched concurrently on the shared async client (see db), and every page is turned into a small DataFrame
+# as soon as it arrives.
+
+# Rows per request. Supabase's default max-rows is 1000, larger pages would be cut silently.
+PAGE_SIZE = 1000
+
+# Key ranges a whole-table load is split into. They are fetched concurrently, see db.MAX_CONCURRENCY.
+RANGES = 16
+
+
+# one page of JSON rows -> DataFrame with proper column types (ints stay ints, text becomes string dtype)
+def page_frame(rows, columns=None):
+    page = pd.DataFrame.from_records(rows, columns=columns)
+    return page.convert_dtypes()
+
+
+# Concatenate typed pages. A column that is empty on one page takes the type it has on the other pages.
+def concat_pages(pages):
+    dtypes = {}
+    for page in pages:
+        for column in page.columns:
+            if column not in dtypes and page[column].notna().any():
+                dtypes[column] = page[column].dtype
+
+    pages = [page.astype({c: dtypes[c] for c in page.columns if c in dtypes and page[c].isna().all()}) for page in pages]
+    return pd.concat(pages, ignore_index=True)
+
+
+# Query for the page after `last_key` (or from `lower`), within lower <= key < upper. Works with the sync and async client.
+def page_query(client, supabase_table, key, columns, page_size, last_key=None, lower=None, upper=None, where=None):
+    query = client.table(supabase_table).select(columns).order(key).limit(page_size)
+    if where is not None:
+        query = where(query)
+    if last_key is not None:
+        query = query.gt(key, last_key)
+    elif lower is not None:
+        query = query.gte(key, lower)
+    if upper is not None:
+        query = query.lt(key, upper)
+    return query
+
+
+# Generator mode: yields one DataFrame per page, in key order. Only the current page is held in memory.
+# `lower`/`upper` restrict the key range (lower <= key < upper). `where(query)` can add extra filters to every page request.
+def iter_pages(supabase_table, key='nationbuilder_id', columns='*', page_size=PAGE_SIZE, lower=None, upper=None, where=None):
+    last_key = None
+    while True:
+        rows = page_query(db.client(), supabase_table, key, columns, page_size, last_key, lower, upper, where).execute().data
+        # stop on an empty page rather than a short one: the server may cap pages below page_size
+        if not rows:
+            return
+
+        last_key = rows[-1][key]
+        yield page_frame(rows)
+
+
+# Async task reading one key range page by page, for db.submit.
+def range_task(supabase_table, key, columns, lower, upper, page_size=PAGE_SIZE):
+    async def task(async_client):
+        pages, last_key = [], None
+        while True:
+            response = await page_query(async_client, supabase_table, key, columns, page_size, last_key, lower, upper).execute()
+            if not response.data:
+                return pages
+            last_key = response.data[-1][key]
+            pages.append(page_frame(response.data))
+    return task
+
+
+# Smallest key, largest key and number of rows of a table. Used to split the key space between concurrent readers.
+def key_bounds(supabase_table, key='nationbuilder_id'):
+    first, last = db.execute_all([
+        lambda client: client.table(supabase_table).select(key, count='exact').order(key).limit(1),
+        lambda client: client.table(supabase_table).select(key).order(key, desc=True).limit(1),
+    ])
+    if not first.data:
+        return None, None, 0
+    return first.data[0][key], last.data[0][key], first.count
+
+
+# Split [low, high] into `parts` half-open integer ranges.
+def key_ranges(low, high, parts):
+    step = max(1, -(-(high - low + 1) // parts))
+    return [(start, min(start + step, high + 1)) for start in range(low, high + 1, step)]
+
+
+# Load a whole table, cast to its declared column types (see schema); an empty table still has its columns. Numeric keys are split into ranges read concurrently on the shared async client (at most
+# db.MAX_CONCURRENCY at a time); other keys are read sequentially. `progress(rows_loaded, total_rows)` is called as pages arrive.
+def load_data(supabase_table, key='nationbuilder_id', columns='*', progress=None):
+    low, high, total = key_bounds(supabase_table, key)
+    if not total:
+        return schema.empty(supabase_table, key, columns)
+
+    pages = []
+    loaded = 0
+    if isinstance(low, int) and isinstance(high, int):
+        # more ranges than concurrent requests so one dense range does not hold everything up
+        tasks = [range_task(supabase_table, key, columns, lower, upper) for lower, upper in key_ranges(low, high, RANGES)]
+        batches = db.run_as_completed(tasks, idempotent=True)
+    else:
+        batches = ([page] for page in iter_pages(supabase_table, key, columns))
+
+    for batch in batches:
+        for page in batch:
+            pages.append(page)
+            loaded += len(page)
+            if progress:
+                progress(loaded, total)
+
+    pages = [page for page in pages if not page.empty]
+    if not pages:
+        return schema.empty(supabase_table, key, columns)
+    return schema.cast(concat_pages(pages).sort_values(key, ignore_index=True), supabase_table, report=True)
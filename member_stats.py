@@ -0,0 +1,91 @@
+import pandas as pd
+from tag_index import explode_tags
+
+# Precomputed statistics for the Key Stats page.
+# Every figure on the page is kept as a small summary table of counts (per phone number, city, tag and signup week)
+# that is updated from row deltas: rows that changed are subtracted in their old version and added in their new one.
+# Rendering the page is then a lookup, independent of the number of members.
+
+SUMMARIES = ['phones', 'cities', 'tags', 'weeks']
+
+
+# Counts for one batch of rows.
+def summarize(data, key='nationbuilder_id'):
+    summaries = {}
+    summaries['phones'] = data['phone_number'].dropna().astype(str).value_counts() if 'phone_number' in data.columns else pd.Series(dtype='int64')
+    summaries['cities'] = data['address_city'].value_counts() if 'address_city' in data.columns else pd.Series(dtype='int64')
+
+    if 'tag_list' in data.columns:
+        tags = explode_tags(data[key], data['tag_list'])
+        summaries['tags'] = tags.value_counts()
+    else:
+        summaries['tags'] = pd.Series(dtype='int64')
+
+    if 'created_at' in data.columns:
+        created_at = pd.to_datetime(data['created_at'], utc=True, format='ISO8601')
+        summaries['weeks'] = created_at.dt.strftime('%Y-%U').value_counts()
+    else:
+        summaries['weeks'] = pd.Series(dtype='int64')
+
+    for name in SUMMARIES:
+        summaries[name] = summaries[name].astype('int64').rename_axis(None).rename('count')
+    return summaries
+
+
+class MemberStats:
+
+    def __init__(self, key='nationbuilder_id'):
+        self.key = key
+        self.total = 0
+        self.summaries = {name: pd.Series(dtype='int64', name='count') for name in SUMMARIES}
+
+    @classmethod
+    def from_frame(cls, data, key='nationbuilder_id'):
+        stats = cls(key)
+        stats.add(data)
+        return stats
+
+    def _combine(self, data, sign):
+        if data is None or data.empty:
+            return
+        self.total += sign * len(data)
+        for name, counts in summarize(data, self.key).items():
+            combined = self.summaries[name].add(sign * counts, fill_value=0).astype('int64')
+            self.summaries[name] = combined[combined > 0].rename('count')
+
+    # rows that were inserted (or the new version of edited rows)
+    def add(self, data):
+        self._combine(data, 1)
+
+    # rows that were deleted (or the old version of edited rows)
+    def subtract(self, data):
+        self._combine(data, -1)
+
+    # Figures shown on the page.
+    def users_with_phones(self):
+        return len(self.summaries['phones'])
+
+    def popular_cities(self, n=10):
+        return self.summaries['cities'].sort_values(ascending=False, kind='stable').head(n).rename_axis('address_city').reset_index()
+
+    def popular_tags(self):
+        return self.summaries['tags'].sort_values(ascending=False, kind='stable').rename_axis('tag_list')
+
+    def weekly_signups(self):
+        return self.summaries['weeks'].sort_index().rename_axis('created_at_week').rename('signups').reset_index()
+
+    # Long table (summary, value, count) for storage next to the snapshot, and back.
+    def to_frame(self):
+        parts = [pd.DataFrame({'summary': 'total', 'value': '', 'count': [self.total]})]
+        for name, counts in self.summaries.items():
+            parts.append(pd.DataFrame({'summary': name, 'value': counts.index.astype(str), 'count': counts.to_numpy()}))
+        return pd.concat(parts, ignore_index=True)
+
+    @classmethod
+    def from_summary_frame(cls, frame, key='nationbuilder_id'):
+        stats = cls(key)
+        stats.total = int(frame.loc[frame['summary'] == 'total', 'count'].sum())
+        for name in SUMMARIES:
+            rows = frame[frame['summary'] == name]
+            stats.summaries[name] = pd.Series(rows['count'].to_numpy(dtype='int64'), index=rows['value'].to_numpy(), name='count')
+        return stats
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+# Precomputed statistics for the Instagram posts dashboard (b07_posts, see Plan).
+# Posts are rolled up once per (account, week): number of posts, likes, comments and the sum and count of engagement
+# rates. Each (account, week) also keeps its most liked posts. Both tables are updated from row deltas (new posts
+# added, the old version of edited posts subtracted), so the key stats, the weekly charts and the "Top Posts of the
+# Week" grids are read from the summaries and never scan the posts table. The figures take `accounts`: one account
+# name, a list of them, or None for all.
+
+ACCOUNTS = ['Nos', 'Partito Democratico', "Fratelli d'Italia"]
+
+# Posts shown in a "Top Posts of the Week" grid.
+TOP_K = 9
+
+# Posts kept per (account, week). More than shown, so deleted posts don't leave holes in the grid.
+TOP_KEPT = 3 * TOP_K
+
+# Columns kept for the top posts grid, when the table has them.
+DISPLAY_COLUMNS = ['post_link', 'image_link', 'post_format', 'posted_at']
+
+ROLLUP_COLUMNS = ['posts', 'likes', 'comments', 'engagement', 'rated']
+
+
+# Monday 00:00 UTC of the week of each timestamp.
+def week_start(timestamps):
+    timestamps = pd.to_datetime(timestamps, utc=True, format='ISO8601', errors='coerce')
+    return (timestamps - pd.to_timedelta(timestamps.dt.dayofweek, unit='D')).dt.normalize()
+
+
+# One row per post with the numbers the summaries need. Engagement rate is (likes + comments) / followers, NaN when
+# the table has no followers column (or it is empty). Posts without a date can't be placed in a week and are left out.
+def prepare(data, key='id'):
+    likes = pd.to_numeric(data['likes'], errors='coerce').fillna(0).astype('int64')
+    comments = pd.to_numeric(data['comments'], errors='coerce').fillna(0).astype('int64')
+    if 'followers' in data.columns:
+        followers = pd.to_numeric(data['followers'], errors='coerce').astype('float64')
+        engagement_rate = (likes + comments) / followers.where(followers > 0)
+    else:
+        engagement_rate = pd.Series(np.nan, index=data.index)
+
+    posts = pd.DataFrame({key: data[key], 'account': data['account'].astype(str), 'week': week_start(data['posted_at']),
+                          'likes': likes, 'comments': comments, 'engagement_rate': engagement_rate})
+    for column in DISPLAY_COLUMNS:
+        if column in data.columns:
+            posts[column] = data[column]
+    return posts[posts['week'].notna()]
+
+
+# Per (account, week) sums for one batch of posts.
+def summarize(posts):
+    return posts.groupby(['account', 'week']).agg(posts=('likes', 'size'), likes=('likes', 'sum'), comments=('comments', 'sum'),
+                                                  engagement=('engagement_rate', 'sum'), rated=('engagement_rate', 'count'))
+
+
+# Accounts argument of the figures below: one name, a list of names, or None for all.
+def account_list(accounts):
+    return [accounts] if isinstance(accounts, str) else accounts
+
+
+def averages(rollup):
+    return pd.DataFrame({'posts': rollup['posts'],
+                         'avg_likes': rollup['likes'] / rollup['posts'].where(rollup['posts'] > 0),
+                         'avg_comments': rollup['comments'] / rollup['posts'].where(rollup['posts'] > 0),
+                         'avg_engagement': rollup['engagement'] / rollup['rated'].where(rollup['rated'] > 0)})
+
+
+class PostStats:
+
+    def __init__(self, key='id'):
+        self.key = key
+        self.weekly = pd.DataFrame(columns=ROLLUP_COLUMNS, index=pd.MultiIndex.from_arrays([[], []], names=['account', 'week']), dtype='float64')
+        self.top = pd.DataFrame(columns=[key, 'account', 'week', 'likes', 'comments', 'engagement_rate'])
+
+    @classmethod
+    def from_frame(cls, data, key='id'):
+        stats = cls(key)
+        stats.add(data)
+        return stats
+
+    def _rollup(self, accounts):
+        if accounts is None:
+            return self.weekly
+        return self.weekly[self.weekly.index.get_level_values('account').isin(account_list(accounts))]
+
+    def _combine(self, posts, sign):
+        combined = self.weekly.add(sign * summarize(posts), fill_value=0)
+        self.weekly = combined[combined['posts'] > 0].sort_index()
+
+    # posts that were inserted (or the new version of edited posts)
+    def add(self, data):
+        if data is None or data.empty:
+            return
+        posts = prepare(data, self.key)
+        self._combine(posts, 1)
+        top = pd.concat([self.top[~self.top[self.key].isin(posts[self.key])], posts], ignore_index=True) if not self.top.empty else posts
+        self.top = top.sort_values('likes', ascending=False, kind='stable').groupby(['account', 'week']).head(TOP_KEPT).reset_index(drop=True)
+
+    # posts that were deleted (or the old version of edited posts)
+    def subtract(self, data):
+        if data is None or data.empty:
+            return
+        self._combine(prepare(data, self.key), -1)
+        self.top = self.top[~self.top[self.key].isin(data[self.key])].reset_index(drop=True)
+
+    # Figures shown on the pages.
+    def accounts(self):
+        return sorted(self.weekly.index.get_level_values('account').unique())
+
+    # Number of posts, average likes, comments and engagement rate.
+    def key_stats(self, accounts=None):
+        return averages(self._rollup(accounts).sum().to_frame().T).iloc[0].to_dict()
+
+    # The same figures per account and week, one row per week from the first to the last, 0 posts for weeks without any.
+    def weekly_evolution(self, accounts=None):
+        rollup = self._rollup(accounts)
+        if rollup.empty:
+            return averages(rollup).reset_index()
+        weeks = rollup.index.get_level_values('week')
+        full = pd.MultiIndex.from_product([rollup.index.get_level_values('account').unique(), pd.date_range(weeks.min(), weeks.max(), freq='W-MON')],
+                                          names=['account', 'week'])
+        return averages(rollup.reindex(full, fill_value=0)).reset_index()
+
+    # Start of the latest week with posts.
+    def latest_week(self, accounts=None):
+        rollup = self._rollup(accounts)
+        return None if rollup.empty else rollup.index.get_level_values('week').max()
+
+    # The k most liked posts of a week (the latest one with posts by default).
+    def top_posts(self, accounts=None, week=None, k=TOP_K):
+        week = week if week is not None else self.latest_week(accounts)
+        top = self.top[self.top['week'] == week]
+        if accounts is not None:
+            top = top[top['account'].isin(account_list(accounts))]
+        return top.sort_values('likes', ascending=False, kind='stable').head(k).reset_index(drop=True)
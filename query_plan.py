@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import filters
+
+# Lazy query plan over the member snapshot.
+# Projections, predicates and the sort order are only collected. Predicate masks are combined as NumPy arrays into one
+# array of matching row positions, the order is applied to those positions (copying just the sort columns of the
+# matching rows), and rows are materialized once at the end with a single take of the rows and columns asked for.
+# Filtering and sorting the member table no longer copy the frame once per filter, and a grid block costs one copy
+# of the visible block only:
+#   plan = QueryPlan(data).select(columns).where(predicates, tag_index=..., search_index=...).order_by(order)
+#   block, total = plan.take(page * page_size, (page + 1) * page_size), plan.count()
+
+
+class QueryPlan:
+
+    def __init__(self, data, key='nationbuilder_id'):
+        self.data = data
+        self.key = key
+        self.columns = list(data.columns)
+        self.predicates = []
+        self.tag_index = None
+        self.search_index = None
+        self.order = []
+        self._positions = None
+
+    # Keep only these columns, in this order (columns the frame doesn't have are skipped).
+    def select(self, columns):
+        self.columns = [column for column in columns if column in self.data.columns]
+        return self
+
+    # Add predicates (see filters.compile_filters), all of which must hold. Indexes are used when given.
+    def where(self, predicates, tag_index=None, search_index=None):
+        self.predicates += list(predicates)
+        self.tag_index = tag_index if tag_index is not None else self.tag_index
+        self.search_index = search_index if search_index is not None else self.search_index
+        self._positions = None
+        return self
+
+    # Sort by a list of (column, descending), with the key as tie-breaker.
+    def order_by(self, order):
+        self.order = list(order or [])
+        self._positions = None
+        return self
+
+    # Positions of the matching rows in the frame, in the requested order. Computed once per plan.
+    def positions(self):
+        if self._positions is None:
+            mask = np.ones(len(self.data), dtype=bool)
+            for predicate in self.predicates:
+                mask &= filters.predicate_mask(self.data, predicate, self.tag_index, self.search_index).to_numpy(dtype=bool)
+            positions = np.flatnonzero(mask)
+            order = [(column, descending) for column, descending in self.order if column in self.data.columns and column != self.key]
+            if order:
+                # only the sort columns of the matching rows are copied; the result maps back to frame positions
+                sort_columns = {column: self.data[column].take(positions).reset_index(drop=True)
+                                for column in [column for column, _ in order] + [self.key]}
+                ranked = filters.sort_rows(pd.DataFrame(sort_columns), order, self.key)
+                positions = positions[ranked.index.to_numpy()]
+            self._positions = positions
+        return self._positions
+
+    def count(self):
+        return len(self.positions())
+
+    # The matching rows start:stop (all of them by default) with the selected columns, as one new frame.
+    def take(self, start=0, stop=None):
+        # rows first: selecting the columns of the whole frame first would copy every row of them
+        rows = self.data.take(self.positions()[start:stop])
+        return rows[self.columns].reset_index(drop=True)
+
+    # The matching rows in frames of chunk_size, for exports.
+    def chunks(self, chunk_size):
+        for start in range(0, self.count(), chunk_size):
+            yield self.take(start, start + chunk_size)
@@ -0,0 +1,91 @@
+import pandas as pd
+from identity_index import normalize_emails, normalize_phones
+
+# Declared column types for the member tables.
+# Rows arrive from PostgREST as JSON (object columns, ints and strings mixed in phone_number, timestamps as text).
+# cast() turns a frame into compact typed columns once, when it is loaded: Arrow-backed strings, nullable ints,
+# a categorical for the few distinct cities and tz-aware timestamps, so later filters, groupbys and date logic don't
+# have to convert again. validate() checks import rows in bulk.
+
+TEXT = 'string[pyarrow]'
+INTEGER = 'Int64'
+CATEGORY = 'category'
+TIMESTAMP = 'datetime64[ns, UTC]'
+
+MEMBER_COLUMNS = {
+    'first_name': TEXT,
+    'last_name': TEXT,
+    'email': TEXT,
+    'phone_number': TEXT,
+    'address_city': CATEGORY,
+    'created_at': TIMESTAMP,
+    'updated_at': TIMESTAMP,
+}
+
+# table -> column -> dtype. Columns not listed keep the type they were loaded with.
+SCHEMAS = {
+    'db_2': {'nationbuilder_id': INTEGER, **MEMBER_COLUMNS, 'tag_list': TEXT},
+    'users': {'id': INTEGER, **MEMBER_COLUMNS, 'tags': TEXT},
+    # tag_list is a Postgres array here: it stays a column of lists (read, exploded and written back as lists)
+    'user_data': {'id': INTEGER, **MEMBER_COLUMNS},
+    'posts': {'id': INTEGER, 'account': CATEGORY, 'likes': INTEGER, 'comments': INTEGER, 'followers': INTEGER,
+              'post_link': TEXT, 'image_link': TEXT, 'post_format': CATEGORY, 'posted_at': TIMESTAMP,
+              'created_at': TIMESTAMP, 'updated_at': TIMESTAMP},
+}
+
+# table -> (bytes as loaded, bytes after cast) of the last full load, see cast(report=True)
+memory_reports = {}
+
+
+def cast_column(values, dtype):
+    if dtype == TIMESTAMP:
+        return pd.to_datetime(values, utc=True, format='ISO8601', errors='coerce')
+    if dtype == INTEGER:
+        return pd.to_numeric(values, errors='coerce').astype(INTEGER)
+    if dtype == CATEGORY:
+        return values.astype(TEXT).astype(CATEGORY)
+    if values.dtype == TEXT:
+        return values
+    # phone numbers read as numbers ("4321678901.0") become their digits
+    return values.astype(TEXT).str.replace(r'\.0$', '', regex=True)
+
+
+# Cast the columns of `data` that the table's schema declares. With report=True the memory used before and after
+# is kept in memory_reports (deep memory usage is slow on big frames, so only for full loads).
+def cast(data, supabase_table, report=False):
+    columns = {column: dtype for column, dtype in SCHEMAS.get(supabase_table, {}).items() if column in data.columns}
+    if not columns:
+        return data
+
+    before = data.memory_usage(deep=True).sum() if report else None
+    data = data.assign(**{column: cast_column(data[column], dtype) for column, dtype in columns.items() if str(data[column].dtype) != dtype})
+    if report:
+        memory_reports[supabase_table] = (int(before), int(data.memory_usage(deep=True).sum()))
+    return data
+
+
+# An empty frame with the table's declared columns and types (and at least the key column), for a table without rows.
+# `columns` is the select list the table was read with ('*' for all of them).
+def empty(supabase_table, key, columns='*'):
+    dtypes = {key: 'object', **SCHEMAS.get(supabase_table, {})}
+    if columns != '*':
+        dtypes = {column: dtypes.get(column, 'object') for column in (name.strip() for name in columns.split(','))}
+    return pd.DataFrame({column: pd.Series([], dtype=dtype) for column, dtype in dtypes.items()})
+
+
+# Memory saved by the last full load of a table, as (bytes as loaded, bytes typed), or None.
+def memory_report(supabase_table):
+    return memory_reports.get(supabase_table)
+
+
+# Bulk validation of import rows. Returns one error message per row (NA for valid rows): a given email must look
+# like an email and a given phone number must be a valid number (see identity_index.normalize_phones).
+def validate(df):
+    errors = pd.Series(pd.NA, index=df.index, dtype='object')
+    for column, normalize, message in (('email', normalize_emails, 'invalid email'), ('phone_number', normalize_phones, 'invalid phone number')):
+        if column not in df.columns:
+            continue
+        given = df[column].astype('string').str.strip().replace('', pd.NA).notna()
+        invalid = given & normalize(df[column]).isna().to_numpy()
+        errors = errors.where(~invalid | errors.notna(), message)
+    return errors
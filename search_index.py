@@ -0,0 +1,288 @@
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from tag_index import key_array
+
+# Trigram search index over the member text columns.
+# Every value is folded once (lowercase, accents removed: "Niccolò" -> "niccolo") and cut into trigrams; for every
+# column the index keeps a posting list of rows per trigram. A substring query intersects the posting lists of its own
+# trigrams and checks only the rows left, instead of lowercasing and scanning the whole column on every keystroke.
+# Prefix queries tolerate typos: rows sharing enough trigrams with the query are checked for a word starting with
+# something within MAX_TYPOS edits of it.
+# Postings are stored in immutable segments (one per batch of rows indexed). Changed rows are marked dead in their old
+# segment and indexed again in a new one. Segments are merged by tiers: the newest segment is merged into the one
+# before while that one holds at most MERGE_FACTOR times its live rows. Small recent segments are merged often and
+# cheaply, there are about log(rows) segments, and the base segment (the full build) is only rebuilt once the rows
+# changed since add up to a good share of it. Like the tag index, results are member keys (snapshot merges reorder
+# rows), turned into row positions of a frame by mask().
+
+SEARCH_COLUMNS = ['first_name', 'last_name', 'email', 'address_city']
+
+MERGE_FACTOR = 4
+
+# Rows turned into trigrams at a time while building (bounds the size of the temporary code point matrix).
+BUILD_CHUNK_SIZE = 50_000
+
+# Typos allowed in a prefix query of at least this many characters. Shorter queries must match exactly: with
+# fewer trigrams a typo leaves nothing in common to find candidates with.
+TYPO_LENGTHS = [(11, 2), (6, 1)]
+
+EMPTY_ROWS = np.array([], dtype=np.int32)
+
+
+# Lowercase, accent-folded text (Arrow kernels). Missing values become ''.
+def fold(values):
+    if not isinstance(values, pa.Array):
+        values = pa.array(pd.Series(values).astype('string').astype(object), type=pa.string(), from_pandas=True)
+    folded = pc.utf8_lower(pc.replace_substring_regex(pc.utf8_normalize(values, form='NFKD'), pattern=r'\p{Mn}', replacement=''))
+    return pc.fill_null(folded, '')
+
+
+def fold_query(query):
+    return fold([query])[0].as_py().strip()
+
+
+def max_typos(query):
+    return next((typos for length, typos in TYPO_LENGTHS if len(query) >= length), 0)
+
+
+# Every (row, trigram code) of a column of folded strings. A trigram code packs three code points (21 bits each).
+def trigram_codes(texts):
+    rows, codes = [], []
+    for start in range(0, len(texts), BUILD_CHUNK_SIZE):
+        chunk = np.asarray(texts[start:start + BUILD_CHUNK_SIZE], dtype=str)
+        width = chunk.dtype.itemsize // 4
+        if width < 3:
+            continue
+        points = chunk.view(np.uint32).reshape(len(chunk), width).astype(np.int64)
+        chunk_codes = (points[:, :-2] << 42) | (points[:, 1:-1] << 21) | points[:, 2:]
+        valid = points[:, 2:] != 0
+        rows.append(np.nonzero(valid)[0].astype(np.int32) + start)
+        codes.append(chunk_codes[valid])
+    if not rows:
+        return EMPTY_ROWS, np.array([], dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(codes)
+
+
+def query_codes(query):
+    return np.unique(trigram_codes([query])[1])
+
+
+# Edit distance between `query` and the closest prefix of each word (numpy array of str), for many words at once:
+# the dynamic programming table is filled one column per query character, all words side by side. Prefixes longer
+# than len(query) + limit can't be within `limit` edits and are not looked at.
+def prefix_distances(query, words, limit):
+    width = min(words.dtype.itemsize // 4, len(query) + limit)
+    points = np.zeros((len(words), len(query) + limit), dtype=np.uint32)
+    points[:, :width] = words.view(np.uint32).reshape(len(words), -1)[:, :width]
+    lengths = (points != 0).sum(axis=1)
+    previous = np.tile(np.arange(points.shape[1] + 1), (len(words), 1))
+    for i, character in enumerate(query, 1):
+        current = np.empty_like(previous)
+        current[:, 0] = i
+        substitution = previous[:, :-1] + (points != ord(character))
+        for j in range(1, points.shape[1] + 1):
+            current[:, j] = np.minimum(np.minimum(previous[:, j], current[:, j - 1]) + 1, substitution[:, j - 1])
+        previous = current
+    beyond_word = np.arange(points.shape[1] + 1) > lengths[:, None]
+    return np.where(beyond_word, limit + 1, previous).min(axis=1)
+
+
+# Rows present in every posting list (all sorted): the shortest list is looked up in the others by binary search.
+def intersect(postings):
+    postings = sorted(postings, key=len)
+    rows = postings[0]
+    for other in postings[1:]:
+        if not len(rows):
+            break
+        found = np.searchsorted(other, rows).clip(max=max(len(other) - 1, 0))
+        rows = rows[other[found] == rows] if len(other) else EMPTY_ROWS
+    return rows
+
+
+# Splits a value into words for prefix matching.
+WORD_SEPARATORS = r'[^\p{L}\p{N}]+'
+
+
+# (group, row) pairs -> sorted unique groups, offsets, and the rows of each group (sorted, no duplicates).
+def group_rows(groups, rows):
+    order = np.lexsort((rows, groups))
+    groups, rows = groups[order], rows[order]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[1:] = (groups[1:] != groups[:-1]) | (rows[1:] != rows[:-1])
+    groups, rows = groups[keep], rows[keep]
+    unique, starts = np.unique(groups, return_index=True)
+    return unique, np.append(starts, len(rows)), rows
+
+
+# Trigram -> rows of a column.
+class Postings:
+
+    def __init__(self, texts):
+        rows, codes = trigram_codes(texts)
+        self.codes, self.offsets, self.rows = group_rows(codes, rows)
+
+    def get(self, code):
+        position = np.searchsorted(self.codes, code)
+        if position == len(self.codes) or self.codes[position] != code:
+            return EMPTY_ROWS
+        return self.rows[self.offsets[position]:self.offsets[position + 1]]
+
+
+# The distinct words of a column (sorted, so a prefix is a range) with the rows of each word, and a trigram index
+# over the words themselves. Prefix queries look at the vocabulary, a few thousand names instead of every row.
+class Vocabulary:
+
+    def __init__(self, texts):
+        lists = pc.split_pattern_regex(texts, WORD_SEPARATORS)
+        rows = pc.list_parent_indices(lists).to_numpy().astype(np.int32)
+        words = pc.list_flatten(lists)
+        keep = pc.not_equal(words, '')
+        rows, words = rows[keep.to_numpy(zero_copy_only=False)], words.filter(keep)
+        encoded = pc.dictionary_encode(words)
+        order = pc.sort_indices(encoded.dictionary).to_numpy()
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        self.words = encoded.dictionary.take(pa.array(order)).to_numpy(zero_copy_only=False).astype(str)
+        word_ids = rank[encoded.indices.to_numpy(zero_copy_only=False)] if len(rank) else np.array([], dtype=np.int64)
+        _, self.offsets, self.rows = group_rows(word_ids, rows)
+        self.trigrams = Postings(self.words)
+
+    def rows_of(self, word_ids):
+        if not len(word_ids):
+            return EMPTY_ROWS
+        return np.unique(np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in word_ids]))
+
+    # Words starting with the query.
+    def prefix_ids(self, query):
+        return np.arange(np.searchsorted(self.words, query, 'left'), np.searchsorted(self.words, query + '\U0010ffff', 'left'))
+
+    # Words starting with something within `typos` edits of the query. A prefix that close shares all but at most
+    # 3 trigrams per edit with the query, which narrows the words to compare.
+    def close_ids(self, query, typos):
+        codes = query_codes(query)
+        candidates, shared = np.unique(np.concatenate([self.trigrams.get(code) for code in codes]), return_counts=True)
+        candidates = candidates[shared >= len(codes) - 3 * typos]
+        if not len(candidates):
+            return candidates
+        return candidates[prefix_distances(query, self.words[candidates], typos) <= typos]
+
+
+class Segment:
+
+    def __init__(self, keys, texts):
+        self.keys = keys
+        self.texts = texts   # column -> folded values (pa.StringArray)
+        self.alive = np.ones(len(keys), dtype=bool)
+        self.postings = {column: Postings(values.to_numpy(zero_copy_only=False)) for column, values in texts.items()}
+        self.vocabularies = {column: Vocabulary(values) for column, values in texts.items()}
+
+    # Rows whose column contains the query.
+    def substring(self, column, query):
+        texts = self.texts[column]
+        if len(query) < 3:
+            return np.flatnonzero(pc.match_substring(texts, query).to_numpy(zero_copy_only=False))
+        candidates = intersect([self.postings[column].get(code) for code in query_codes(query)])
+        if not len(candidates):
+            return EMPTY_ROWS
+        return candidates[pc.match_substring(texts.take(pa.array(candidates)), query).to_numpy(zero_copy_only=False)]
+
+    # Rows with a word in the column that starts with the query, give or take max_typos(query) edits.
+    def prefix(self, column, query):
+        vocabulary = self.vocabularies[column]
+        typos = max_typos(query)
+        word_ids = vocabulary.close_ids(query, typos) if typos else vocabulary.prefix_ids(query)
+        return vocabulary.rows_of(word_ids)
+
+
+class SearchIndex:
+
+    def __init__(self, key='nationbuilder_id', columns=SEARCH_COLUMNS):
+        self.key = key
+        self.columns = list(columns)
+        self.segments = []
+
+    @classmethod
+    def from_frame(cls, data, key='nationbuilder_id', columns=SEARCH_COLUMNS):
+        index = cls(key, columns)
+        index.add(data)
+        return index
+
+    # Index new or changed rows. Rows already in the index are re-indexed with their new values.
+    def add(self, data):
+        if data.empty:
+            return
+        self.remove(data[self.key])
+        texts = {column: fold(data[column] if column in data.columns else pd.Series(None, index=data.index, dtype='object'))
+                 for column in self.columns}
+        self.segments.append(Segment(key_array(data[self.key]), texts))
+        while len(self.segments) > 1 and self.segments[-2].alive.sum() <= MERGE_FACTOR * self.segments[-1].alive.sum():
+            self.segments[-2:] = self.merged(self.segments[-2:])
+
+    # Drop rows (e.g. deleted members).
+    def remove(self, keys):
+        keys = key_array(keys)
+        if not len(keys):
+            return
+        for segment in self.segments:
+            segment.alive &= ~np.isin(segment.keys, keys)
+
+    # Segments merged into one (as a list, empty when none of their rows is alive), leaving dead rows out.
+    def merged(self, segments):
+        live = [segment for segment in segments if segment.alive.any()]
+        if not live:
+            return []
+        keys = np.concatenate([segment.keys[segment.alive] for segment in live])
+        texts = {column: pa.concat_arrays([segment.texts[column].filter(pa.array(segment.alive)) for segment in live])
+                 for column in self.columns}
+        return [Segment(keys, texts)]
+
+    # Merge all segments into one.
+    def compact(self):
+        self.segments = self.merged(self.segments)
+
+    # Keys of the rows matching a query. Every word of the query has to match (in any of `columns`, all indexed
+    # columns by default): as a substring, or with typos=True also as a word prefix give or take a few typos.
+    # With phrase=True the whole query is one substring instead, spaces included.
+    def keys(self, query, columns=None, typos=False, phrase=False):
+        terms = [fold_query(query)] if phrase else fold_query(query).split()
+        columns = columns or self.columns
+        matches = []
+        for segment in self.segments:
+            rows = None
+            for term in terms:
+                term_rows = [segment.substring(column, term) for column in columns]
+                if typos:
+                    term_rows += [segment.prefix(column, term) for column in columns]
+                term_rows = np.unique(np.concatenate(term_rows))
+                rows = term_rows if rows is None else np.intersect1d(rows, term_rows, assume_unique=True)
+            if rows is not None and len(rows):
+                rows = rows[segment.alive[rows]]
+                matches.append(segment.keys[rows])
+        return np.unique(np.concatenate(matches)) if matches else np.array([], dtype=np.int64)
+
+    # Boolean mask over a frame of members. Snapshots are kept in key order, so positions are found by binary search.
+    def mask(self, data, query, columns=None, typos=False, phrase=False):
+        keys = key_array(data[self.key])
+        found = self.keys(query, columns, typos, phrase)
+        if len(keys) and len(found) and keys.dtype == found.dtype and (keys[1:] >= keys[:-1]).all():
+            positions = np.searchsorted(keys, found).clip(max=len(keys) - 1)
+            mask = np.zeros(len(keys), dtype=bool)
+            mask[positions[keys[positions] == found]] = True
+        else:
+            mask = np.isin(keys, found)
+        return pd.Series(mask, index=data.index)
+
+
+# The same search without an index (substring only): every word of the query in one of the columns present.
+def scan_mask(data, query, columns=SEARCH_COLUMNS):
+    mask = pd.Series(True, index=data.index)
+    folded = {column: fold(data[column]) for column in columns if column in data.columns}
+    for term in fold_query(query).split():
+        term_mask = np.zeros(len(data), dtype=bool)
+        for values in folded.values():
+            term_mask |= pc.match_substring(values, term).to_numpy(zero_copy_only=False)
+        mask &= term_mask
+    return mask
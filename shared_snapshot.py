@@ -0,0 +1,93 @@
+import os
+import json
+import threading
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Table snapshots shared by all app processes on one machine (several Streamlit replicas behind a proxy).
+# One process per table, the refresher (whoever takes the table's lock file first), reads the table from Supabase and
+# keeps it current. Every time the snapshot changes it writes it as an Arrow IPC file and swaps it in atomically, and
+# bumps a small stamp file holding the version and the keys touched by the last changes. The other processes never
+# read the table from Supabase: they memory-map the file read-only, so its string columns are pandas columns over
+# the mapped pages (shared with every other process through the page cache, not copied), and reload when the stamp's
+# version moves. An old mapping stays valid after a swap until its last reader lets go of it.
+# Enabled with SHARED_SNAPSHOTS=1; needs fcntl (POSIX), otherwise every process keeps its own snapshot.
+
+ENABLED = os.environ.get('SHARED_SNAPSHOTS') == '1' and fcntl is not None
+
+SHARED_DIR = os.environ.get('SHARED_SNAPSHOT_DIR', os.environ.get('SNAPSHOT_DIR', '.snapshots'))
+
+# Changes kept in the stamp, so processes a few versions behind can patch their indexes instead of rebuilding them.
+CHANGES_KEPT = 100
+
+# Column types when mapping a file: strings stay Arrow (zero-copy, the schema.TEXT type), the rest converts as usual.
+TYPES = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+
+_lock_files = {}
+_guard = threading.Lock()
+
+
+def _paths(supabase_table):
+    base = os.path.join(SHARED_DIR, f'{supabase_table}.arrow')
+    return base, base + '.json', base + '.lock'
+
+
+# True if this process is the table's refresher. The first process to ask takes the lock file and keeps it for its
+# lifetime; when it exits the lock is released and the next process to ask takes over.
+def is_refresher(supabase_table):
+    with _guard:
+        if supabase_table in _lock_files:
+            return True
+        os.makedirs(SHARED_DIR, exist_ok=True)
+        lock_file = open(_paths(supabase_table)[2], 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        _lock_files[supabase_table] = lock_file
+        return True
+
+
+# The stamp of the published snapshot ({'version', 'high_water', 'changes'}), or None if nothing was published yet.
+def stamp(supabase_table):
+    try:
+        with open(_paths(supabase_table)[1]) as stamp_file:
+            return json.load(stamp_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Write the snapshot and swap it in, then the stamp. `changes` is the list of {'version', 'changed', 'removed'} since
+# the last publish (keys as lists); older ones are kept up to CHANGES_KEPT.
+def publish(supabase_table, data, version, high_water=None, changes=None):
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    data_path, stamp_path, _ = _paths(supabase_table)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'version': str(version).encode()})
+    with pa.OSFile(f'{data_path}.{version}.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(f'{data_path}.{version}.tmp', data_path)
+
+    previous = stamp(supabase_table)
+    kept = (previous or {}).get('changes', []) + list(changes or [])
+    with open(stamp_path + '.tmp', 'w') as stamp_file:
+        json.dump({'version': version, 'high_water': high_water, 'changes': kept[-CHANGES_KEPT:]}, stamp_file)
+    os.replace(stamp_path + '.tmp', stamp_path)
+
+
+# Memory-map the published snapshot. Returns (data, version), or None if nothing was published yet.
+def read(supabase_table):
+    try:
+        source = pa.memory_map(_paths(supabase_table)[0], 'r')
+    except FileNotFoundError:
+        return None
+    table = pa.ipc.open_file(source).read_all()
+    version = int(table.schema.metadata[b'version'])
+    return table.to_pandas(types_mapper=TYPES.get), version
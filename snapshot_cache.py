@@ -0,0 +1,538 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import db
+import loader
+import schema
+import shared_snapshot
+from tag_index import TagIndex
+from identity_index import IdentityIndex
+from search_index import SearchIndex
+from member_stats import MemberStats
+from post_stats import PostStats
+from importer import chunks, LOOKUP_CHUNK_SIZE
+
+# Incremental delta sync cache for dashboard tables.
+# The first load of a table is written to a local Parquet snapshot. After that a refresh only pulls the rows whose
+# updated_at/created_at is newer than the snapshot's high-water mark and merges them in; reruns in between are served
+# from memory. Deleted rows are reconciled periodically by comparing the row count and, when it differs, the id set.
+# Tables with a connected change feed (see change_feed) are patched from its events instead and aren't polled.
+# With SHARED_SNAPSHOTS=1 only one process per machine reads and refreshes a table; the others map the snapshot it
+# publishes (see shared_snapshot) and follow its versions.
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '.snapshots')
+
+# Reruns within this many seconds of the last sync are served from memory without any request.
+SYNC_INTERVAL = 5
+
+# How often (seconds) to check for deleted rows.
+RECONCILE_INTERVAL = 600
+
+# Timestamp columns used for the high-water mark, first one present wins.
+WATERMARK_COLUMNS = ['updated_at', 'created_at']
+
+# table name -> {'data', 'high_water', 'synced_at', 'reconciled_at', 'version'} (and 'base_version', the published
+# version mapped, when following a shared snapshot) plus derived indexes ('tag_index', 'identity_index', 'search_index', 'stats', 'post_stats')
+_snapshots = {}
+_locks = {}
+# tables kept current by a change feed: their snapshot in memory is not polled
+_live = set()
+# tables this process refreshes in the background for the other processes (shared snapshots)
+_refreshers = set()
+
+# Seconds between two checks of the shared snapshot's version, in the processes that follow it.
+FOLLOW_INTERVAL = 1
+_locks_guard = threading.Lock()
+
+
+def _lock(supabase_table):
+    with _locks_guard:
+        return _locks.setdefault(supabase_table, threading.Lock())
+
+
+def _paths(supabase_table):
+    return (os.path.join(SNAPSHOT_DIR, f'{supabase_table}.parquet'), os.path.join(SNAPSHOT_DIR, f'{supabase_table}.json'),
+            os.path.join(SNAPSHOT_DIR, f'{supabase_table}.stats.parquet'))
+
+
+# Digest of a set of ids, used to compare the local and remote membership of a table.
+def id_checksum(ids):
+    ids = sorted(str(x) for x in ids)
+    return hashlib.sha1(','.join(ids).encode()).hexdigest()
+
+
+def watermark_column(data):
+    for column in WATERMARK_COLUMNS:
+        if column in data.columns:
+            return column
+    return None
+
+
+# Newest timestamp in the snapshot, as an ISO string PostgREST can compare against.
+def high_water_mark(data):
+    column = watermark_column(data)
+    if column is None or data.empty:
+        return None
+    newest = pd.to_datetime(data[column], utc=True, format='ISO8601').max()
+    return None if pd.isna(newest) else newest.isoformat()
+
+
+def save_snapshot(supabase_table, snapshot):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    data_path, meta_path, stats_path = _paths(supabase_table)
+
+    # write then rename, so a crash never leaves a half written snapshot behind
+    snapshot['data'].to_parquet(data_path + '.tmp', index=False)
+    os.replace(data_path + '.tmp', data_path)
+    with open(meta_path + '.tmp', 'w') as meta_file:
+        json.dump({'high_water': snapshot['high_water'], 'reconciled_at': snapshot['reconciled_at'], 'version': snapshot['version']}, meta_file)
+    os.replace(meta_path + '.tmp', meta_path)
+
+    # summary tables travel with the snapshot so a restart doesn't have to recompute them
+    if snapshot.get('stats') is not None:
+        snapshot['stats'].to_frame().to_parquet(stats_path + '.tmp', index=False)
+        os.replace(stats_path + '.tmp', stats_path)
+    elif os.path.exists(stats_path):
+        os.remove(stats_path)
+    snapshot['dirty'] = False
+
+    # for the other processes; then this one maps the published file too, instead of keeping its own copy
+    if shared_snapshot.ENABLED:
+        shared_snapshot.publish(supabase_table, snapshot['data'], snapshot['version'], snapshot['high_water'], snapshot.pop('changes', []))
+        snapshot['data'] = schema.cast(shared_snapshot.read(supabase_table)[0], supabase_table)
+        snapshot['published'] = snapshot['version']
+
+
+def read_snapshot(supabase_table, key):
+    data_path, meta_path, stats_path = _paths(supabase_table)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+
+    with open(meta_path) as meta_file:
+        meta = json.load(meta_file)
+    snapshot = {'data': pd.read_parquet(data_path), 'high_water': meta['high_water'],
+                'synced_at': 0, 'reconciled_at': meta.get('reconciled_at', 0), 'version': meta.get('version', 0)}
+    if os.path.exists(stats_path):
+        snapshot['stats'] = MemberStats.from_summary_frame(pd.read_parquet(stats_path), key)
+    return snapshot
+
+
+# Column of values with the ones at `positions` replaced by `new` (same type), as a new column: `values` is not modified.
+def replace_values(values, positions, new):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        added = pd.Index(new.dropna().astype(object).unique()).difference(categories)
+        categories = categories.append(added) if len(added) else categories
+        codes = values.cat.codes.to_numpy().copy()
+        codes[positions] = pd.Categorical(new, categories=categories).codes
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories)), name=values.name, index=values.index)
+    if isinstance(values.array, pd.arrays.ArrowStringArray):
+        # Arrow arrays are immutable: one copy of the column with the masked slots replaced, in position order
+        array = pa.array(values)
+        array = array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array
+        mask = np.zeros(len(values), dtype=bool)
+        mask[positions] = True
+        replacements = pa.array(new.iloc[np.argsort(positions)]).cast(array.type)
+        return pd.Series(pd.arrays.ArrowStringArray(pc.replace_with_mask(array, pa.array(mask), replacements)), name=values.name, index=values.index)
+    array = values.array.copy()
+    array[positions] = new.array
+    return pd.Series(array, name=values.name, index=values.index)
+
+
+# Rows at `positions` replaced by `updates` (rows with the same keys), as a new frame. Only the columns whose values
+# changed are rebuilt, the others are shared with `data`.
+def replace_rows(data, positions, updates):
+    columns = {}
+    for column in data.columns:
+        new = updates[column].reset_index(drop=True)
+        # compared as values: categories may differ
+        unchanged = data[column].take(positions).reset_index(drop=True).astype(object).equals(new.astype(object))
+        columns[column] = data[column] if unchanged else replace_values(data[column], positions, new)
+    return pd.DataFrame(columns, copy=False)
+
+
+# True if `updated` (rows whose keys are in `data`) can be patched into `data` in place: same columns and types
+# (categories may differ), and `data` sorted by key.
+def patchable(data, updated, key):
+    if set(data.columns) != set(updated.columns) or not data[key].is_monotonic_increasing:
+        return False
+    return all(updated[column].dtype == data[column].dtype or isinstance(data[column].dtype, pd.CategoricalDtype)
+               and isinstance(updated[column].dtype, pd.CategoricalDtype) for column in data.columns)
+
+
+# Apply a delta to a snapshot: `changed` rows were inserted or edited, `removed` keys were deleted.
+# The snapshot is sorted by key. Edits of existing rows are patched into the columns they change (see replace_rows);
+# inserts and deletes rebuild the frame once, sorted again only when an inserted key falls between existing ones.
+# The derived indexes and stats get the same delta: the old version of every touched row is taken out, the new one added.
+def apply_changes(supabase_table, snapshot, key, changed=None, removed=None):
+    data = snapshot['data']
+    has_changes = changed is not None and not changed.empty
+    if has_changes:
+        changed = schema.cast(changed, supabase_table).drop_duplicates(key, keep='last')
+    touched = pd.Series(False, index=data.index)
+    if has_changes:
+        touched |= data[key].isin(changed[key])
+    if removed is not None and len(removed):
+        touched |= data[key].isin(removed)
+
+    snapshot['version'] += 1
+    old_rows = data[touched]
+    if shared_snapshot.ENABLED:
+        # keys touched per version, so processes following the shared snapshot can patch their indexes
+        snapshot.setdefault('changes', []).append({'version': snapshot['version'], 'changed': changed[key].tolist() if has_changes else [],
+                                                   'removed': list(removed) if removed is not None else []})
+
+    # edits of existing rows are patched in; what's left (inserts, deletes, or any change to an unsorted or
+    # differently typed frame) rebuilds the frame
+    inserted, dropped = changed, touched
+    updated = changed[changed[key].isin(data[key])] if has_changes else None
+    if updated is not None and not updated.empty and patchable(data, updated, key):
+        data = replace_rows(data, np.searchsorted(data[key].to_numpy(), updated[key].to_numpy()), updated)
+        inserted = changed[~changed[key].isin(updated[key])]
+        dropped = data[key].isin(removed) if removed is not None and len(removed) else pd.Series(False, index=data.index)
+
+    if dropped.any() or (has_changes and not inserted.empty):
+        parts = [data[~dropped.to_numpy()]] + ([inserted] if has_changes and not inserted.empty else [])
+        data = loader.concat_pages(parts)
+        if not data[key].is_monotonic_increasing:
+            data = data.sort_values(key, ignore_index=True)
+        data = schema.cast(data, supabase_table)
+    snapshot['data'] = data
+
+    for name in ('tag_index', 'identity_index', 'search_index'):
+        if snapshot.get(name) is not None:
+            snapshot[name].remove(old_rows[key])
+            if has_changes:
+                snapshot[name].add(changed)
+    for name in ('stats', 'post_stats'):
+        if snapshot.get(name) is not None:
+            snapshot[name].subtract(old_rows)
+            if has_changes:
+                snapshot[name].add(changed)
+
+
+# Read the whole table again when the snapshot has nothing to sync from: no rows (so no high-water mark), or no key
+# column (an empty table saved before its columns were known). The derived indexes and stats are rebuilt on first use.
+def reload(supabase_table, snapshot, key):
+    data = loader.load_data(supabase_table, key=key)
+    if data.empty and key in snapshot['data'].columns:
+        return 0
+    snapshot['data'] = data
+    snapshot['high_water'] = high_water_mark(data)
+    snapshot['version'] += 1
+    for name in ('tag_index', 'identity_index', 'search_index', 'stats', 'post_stats'):
+        snapshot.pop(name, None)
+    return max(len(data), 1)
+
+
+# Pull rows at or after the high-water mark and merge them in. `gte`, not `gt`: rows committed later with the same
+# timestamp as the newest local row are not skipped. Rows already in the snapshot with that same timestamp come back
+# every time and are dropped here, so an unchanged table doesn't count as changed.
+def pull_delta(supabase_table, snapshot, key):
+    if snapshot['data'].empty or key not in snapshot['data'].columns:
+        return reload(supabase_table, snapshot, key)
+    column = watermark_column(snapshot['data'])
+    if column is None or snapshot['high_water'] is None:
+        return 0
+
+    high_water = snapshot['high_water']
+    pages = list(loader.iter_pages(supabase_table, key, where=lambda query: query.gte(column, high_water)))
+    if not pages:
+        return 0
+
+    delta = schema.cast(loader.concat_pages(pages), supabase_table).drop_duplicates(key, keep='last')
+    local = snapshot['data'].set_index(key)[column]
+    local_stamps = pd.to_datetime(local.reindex(delta[key]).to_numpy(), utc=True)
+    delta_stamps = pd.to_datetime(delta[column], utc=True, format='ISO8601')
+    delta = delta[~(local_stamps == delta_stamps.to_numpy())]
+    if delta.empty:
+        return 0
+
+    apply_changes(supabase_table, snapshot, key, changed=delta)
+    snapshot['high_water'] = high_water_mark(snapshot['data'])
+    return len(delta)
+
+
+# Rows by key, fetched in in_() chunks. Returns a frame, or None when none of them exist.
+def fetch_rows(supabase_table, ids, key):
+    responses = db.execute_all([lambda client, chunk=chunk: client.table(supabase_table).select('*').in_(key, chunk)
+                                for chunk in chunks(ids, LOOKUP_CHUNK_SIZE)])
+    pages = [loader.page_frame(response.data) for response in responses if response.data]
+    return loader.concat_pages(pages) if pages else None
+
+
+# Make the snapshot hold the same ids as the table. Cheap count check first, id set only when the counts disagree.
+# Rows deleted remotely are dropped; rows the high-water mark missed (long transactions, backfills with old
+# timestamps) are fetched.
+def reconcile_deletes(supabase_table, snapshot, key):
+    if key not in snapshot['data'].columns:
+        return reload(supabase_table, snapshot, key)
+    remote_count = db.client().table(supabase_table).select(key, count='exact').limit(1).execute().count
+    if remote_count == len(snapshot['data']):
+        return 0
+
+    remote_ids = pd.concat([page[key] for page in loader.iter_pages(supabase_table, key, columns=key)] or [pd.Series([], dtype='object')])
+    local_ids = snapshot['data'][key]
+    if id_checksum(remote_ids) == id_checksum(local_ids):
+        return 0
+
+    deleted = local_ids[~local_ids.isin(remote_ids)]
+    missing = remote_ids[~remote_ids.isin(local_ids)].tolist()
+    found = fetch_rows(supabase_table, missing, key) if missing else None
+    apply_changes(supabase_table, snapshot, key, changed=found, removed=deleted)
+    if found is not None:
+        snapshot['high_water'] = high_water_mark(snapshot['data'])
+    return len(deleted) + len(missing)
+
+
+# Fetch specific rows again, e.g. right after this app wrote them (edits don't always move the high-water mark).
+def refresh_rows(supabase_table, ids, key='nationbuilder_id'):
+    ids = [x for x in ids if pd.notna(x)]
+    with _lock(supabase_table):
+        snapshot = _snapshots.get(supabase_table)
+        if snapshot is None or not ids:
+            return
+
+        rows = fetch_rows(supabase_table, ids, key)
+        if rows is not None:
+            apply_changes(supabase_table, snapshot, key, changed=rows)
+            # a process following the shared snapshot keeps the rows for itself until the refresher publishes them
+            if _owns(supabase_table):
+                save_snapshot(supabase_table, snapshot)
+
+
+# Mark a table as kept current by the change feed (or not anymore, when the feed disconnects: polling resumes).
+def set_live(supabase_table, live):
+    with _lock(supabase_table):
+        if live:
+            _live.add(supabase_table)
+        else:
+            _live.discard(supabase_table)
+
+
+# Called by the change feed once Realtime confirmed the table's subscription: one delta sync and delete check for
+# what happened before, then the table is live.
+def catch_up(supabase_table, key='nationbuilder_id'):
+    if not _owns(supabase_table):
+        return
+    with _lock(supabase_table):
+        snapshot = _snapshots.get(supabase_table)
+        if snapshot is not None:
+            now = time.time()
+            changed = pull_delta(supabase_table, snapshot, key) + reconcile_deletes(supabase_table, snapshot, key)
+            snapshot['synced_at'] = snapshot['reconciled_at'] = now
+            if changed:
+                save_snapshot(supabase_table, snapshot)
+        _live.add(supabase_table)
+
+
+# Changes received from the change feed: `rows` inserted or updated (as JSON records), `removed` keys deleted.
+# Until the table is live (caught up), the high-water mark stays put so the catch-up still sees every older change.
+# The snapshot file is rewritten at most every SYNC_INTERVAL seconds; a restart catches up from its high-water mark.
+def apply_feed(supabase_table, rows, removed, key='nationbuilder_id'):
+    if not _owns(supabase_table):
+        return
+    with _lock(supabase_table):
+        snapshot = _snapshots.get(supabase_table)
+        if snapshot is None or not (rows or removed):
+            return
+        apply_changes(supabase_table, snapshot, key, changed=loader.page_frame(rows) if rows else None, removed=removed)
+        if supabase_table in _live:
+            snapshot['high_water'] = high_water_mark(snapshot['data'])
+        now = time.time()
+        if now - snapshot.get('saved_at', 0) > SYNC_INTERVAL:
+            save_snapshot(supabase_table, snapshot)
+            snapshot['saved_at'] = now
+        else:
+            snapshot['dirty'] = True
+
+
+# True if this process reads and writes the table's snapshot itself: always, unless another process is the
+# refresher of the shared snapshot.
+def _owns(supabase_table):
+    return not shared_snapshot.ENABLED or shared_snapshot.is_refresher(supabase_table)
+
+
+# Carry the derived indexes and stats of the previous mapping over to a newly published version, patched with the
+# rows touched in between (and the rows this process patched itself). When the stamp no longer has every version in
+# between, they are dropped and rebuilt on first use.
+def _carry_over(previous, snapshot, changes, key):
+    steps = [change for change in changes if previous['base_version'] < change['version'] <= snapshot['version']]
+    if len(steps) != snapshot['version'] - previous['base_version']:
+        return
+    touched = set()
+    for change in steps + previous.get('changes', []):
+        touched.update(change['changed'])
+        touched.update(change['removed'])
+    old_rows = previous['data'][previous['data'][key].isin(touched)]
+    new_rows = snapshot['data'][snapshot['data'][key].isin(touched)]
+    for name in ('tag_index', 'identity_index', 'search_index'):
+        if previous.get(name) is not None:
+            snapshot[name] = previous[name]
+            snapshot[name].remove(old_rows[key])
+            snapshot[name].add(new_rows)
+    for name in ('stats', 'post_stats'):
+        if previous.get(name) is not None:
+            snapshot[name] = previous[name]
+            snapshot[name].subtract(old_rows)
+            snapshot[name].add(new_rows)
+
+
+# Follow the shared snapshot another process refreshes: map each new version it publishes. Waits for the first
+# one while the refresher is still loading the table. Returns None if this process became the refresher meanwhile.
+# Callers must hold the table lock.
+def _follow(supabase_table, key):
+    now = time.time()
+    previous = _snapshots.get(supabase_table)
+    if previous is not None and now - previous['synced_at'] <= FOLLOW_INTERVAL:
+        return previous
+
+    published = shared_snapshot.stamp(supabase_table)
+    while published is None:
+        if shared_snapshot.is_refresher(supabase_table):
+            return None
+        time.sleep(FOLLOW_INTERVAL)
+        published = shared_snapshot.stamp(supabase_table)
+
+    snapshot = previous
+    if previous is None or published['version'] != previous['base_version']:
+        data, version = shared_snapshot.read(supabase_table)
+        snapshot = {'data': schema.cast(data, supabase_table), 'high_water': published['high_water'], 'reconciled_at': now,
+                    'version': version, 'base_version': version}
+        if previous is not None:
+            _carry_over(previous, snapshot, published['changes'], key)
+    snapshot['synced_at'] = now
+    _snapshots[supabase_table] = snapshot
+    return snapshot
+
+
+# Refresher of a shared snapshot: keeps syncing the table for the other processes, even when no one uses this one.
+def _refresh_loop(supabase_table, key):
+    while True:
+        time.sleep(SYNC_INTERVAL)
+        try:
+            with _lock(supabase_table):
+                _sync(supabase_table, key)
+        except Exception:
+            logging.exception('Refreshing the shared snapshot of %s failed', supabase_table)
+
+
+# Bring the table snapshot up to date (full read the first time, delta sync afterwards) and return it.
+# Callers must hold the table lock.
+def _sync(supabase_table, key, progress=None):
+    if not _owns(supabase_table):
+        snapshot = _follow(supabase_table, key)
+        if snapshot is not None:
+            return snapshot
+
+    now = time.time()
+    snapshot = _snapshots.get(supabase_table) or read_snapshot(supabase_table, key)
+
+    if snapshot is None:
+        data = loader.load_data(supabase_table, key=key, progress=progress)
+        snapshot = {'data': data, 'high_water': high_water_mark(data), 'synced_at': now, 'reconciled_at': now, 'version': int(now * 1000)}
+        save_snapshot(supabase_table, snapshot)
+
+    elif now - snapshot['synced_at'] > SYNC_INTERVAL and not (supabase_table in _live and supabase_table in _snapshots):
+        changed = pull_delta(supabase_table, snapshot, key)
+        if now - snapshot['reconciled_at'] > RECONCILE_INTERVAL:
+            changed += reconcile_deletes(supabase_table, snapshot, key)
+            snapshot['reconciled_at'] = now
+        snapshot['synced_at'] = now
+        if changed:
+            save_snapshot(supabase_table, snapshot)
+
+    # change feed events not written yet, and a snapshot the other processes haven't seen
+    if snapshot.get('dirty') or (shared_snapshot.ENABLED and snapshot.get('published') != snapshot['version']):
+        save_snapshot(supabase_table, snapshot)
+    if shared_snapshot.ENABLED and supabase_table not in _refreshers:
+        _refreshers.add(supabase_table)
+        threading.Thread(target=_refresh_loop, args=(supabase_table, key), name=f'refresh_{supabase_table}', daemon=True).start()
+
+    _snapshots[supabase_table] = snapshot
+    return snapshot
+
+
+# Table snapshot, kept current with delta syncs (or the change feed). Returns a copy the caller is free to modify.
+def load(supabase_table, key='nationbuilder_id', progress=None):
+    with _lock(supabase_table):
+        return _sync(supabase_table, key, progress)['data'].copy()
+
+
+# The snapshot, kept current with delta syncs, if the table was loaded before (in this process or on disk), else None.
+# Not a copy: callers must not modify it.
+def current(supabase_table, key='nationbuilder_id'):
+    with _lock(supabase_table):
+        if (supabase_table not in _snapshots and not os.path.exists(_paths(supabase_table)[0])
+                and not (shared_snapshot.ENABLED and shared_snapshot.stamp(supabase_table))):
+            return None
+        return _sync(supabase_table, key)['data']
+
+
+# Data version of the snapshot: changes whenever its rows do. None if the table isn't loaded.
+def version(supabase_table):
+    snapshot = _snapshots.get(supabase_table)
+    return None if snapshot is None else snapshot['version']
+
+
+# Inverted tag index over the snapshot. Built once per data load, then patched as rows change.
+def tag_index(supabase_table, key='nationbuilder_id'):
+    with _lock(supabase_table):
+        snapshot = _sync(supabase_table, key)
+        if 'tag_index' not in snapshot:
+            snapshot['tag_index'] = TagIndex.from_frame(snapshot['data'], key)
+        return snapshot['tag_index']
+
+
+# Trigram search index over the snapshot's name, email and city columns (see search_index). Patched as rows change.
+def search_index(supabase_table, key='nationbuilder_id'):
+    with _lock(supabase_table):
+        snapshot = _sync(supabase_table, key)
+        if 'search_index' not in snapshot:
+            snapshot['search_index'] = SearchIndex.from_frame(snapshot['data'], key)
+        return snapshot['search_index']
+
+
+# Email/phone identity index over the snapshot, used to resolve import rows (see identity_index). Patched as rows change.
+def identity_index(supabase_table, key='nationbuilder_id'):
+    with _lock(supabase_table):
+        snapshot = _sync(supabase_table, key)
+        if 'identity_index' not in snapshot:
+            snapshot['identity_index'] = IdentityIndex.from_frame(snapshot['data'], key)
+        return snapshot['identity_index']
+
+
+# Summary tables for the Key Stats page (see member_stats). Computed once, then kept current from row deltas.
+def member_stats(supabase_table, key='nationbuilder_id'):
+    with _lock(supabase_table):
+        snapshot = _sync(supabase_table, key)
+        if snapshot.get('stats') is None:
+            snapshot['stats'] = MemberStats.from_frame(snapshot['data'], key)
+            if _owns(supabase_table):
+                save_snapshot(supabase_table, snapshot)
+        return snapshot['stats']
+
+
+# Weekly rollup and top posts of a posts table (see post_stats). Computed once, then kept current from row deltas.
+def post_stats(supabase_table='posts', key='id'):
+    with _lock(supabase_table):
+        snapshot = _sync(supabase_table, key)
+        if snapshot.get('post_stats') is None:
+            snapshot['post_stats'] = PostStats.from_frame(snapshot['data'], key)
+        return snapshot['post_stats']
+
+
+# Forget the snapshot (memory and disk). The next load does a full read.
+def invalidate(supabase_table):
+    with _lock(supabase_table):
+        _snapshots.pop(supabase_table, None)
+        for path in _paths(supabase_table):
+            if os.path.exists(path):
+                os.remove(path)
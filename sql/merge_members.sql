@@ -0,0 +1,106 @@
+-- Server-side merge for CSV imports.
+-- Incoming rows are sent as one JSON array per chunk (supabase.rpc('merge_members', {'payload': [...]})) and merged in a
+-- single statement: existing members get the file's non-empty values and the union of old and new tags, new members
+-- are inserted. The tag union reads the row it updates under the row lock, so two imports touching the same member
+-- can't lose each other's tags. Run this file once in the Supabase SQL editor (or psql) to install the functions.
+
+
+-- Same rules as importer.merge_tags: split on ',', strip, drop empty tags, keep the first occurrence, existing tags
+-- first, join with ', '. Without incoming tags the existing value is kept as is.
+create or replace function public.merge_tag_lists(current_tags text, incoming_tags text)
+returns text
+language sql
+immutable
+as $$
+  select case
+    when coalesce(btrim(incoming_tags), '') = '' then current_tags
+    else coalesce((
+      select string_agg(tag, ', ' order by first_place)
+      from (
+        select btrim(part) as tag, min(place) as first_place
+        from unnest(string_to_array(coalesce(current_tags, '') || ',' || incoming_tags, ',')) with ordinality as parts(part, place)
+        where btrim(part) <> ''
+        group by btrim(part)
+      ) tags
+    ), '')
+  end
+$$;
+
+
+-- db_2 (dashboard import). Rows carrying a nationbuilder_id update that member, rows without one are inserted.
+-- Send one row per member per call (importer collapses duplicate rows first).
+-- Returns, for every incoming row that was written, its position in the array (1-based), its id and the outcome.
+create or replace function public.merge_members(payload jsonb)
+returns table (ord bigint, nationbuilder_id bigint, outcome text)
+language sql
+as $$
+  with incoming as (
+    select elements.ord, member.*, member.nationbuilder_id is null as is_new,
+           coalesce(member.nationbuilder_id, nextval(pg_get_serial_sequence('public.db_2', 'nationbuilder_id')))::bigint as member_id
+    from jsonb_array_elements(payload) with ordinality as elements(value, ord),
+         jsonb_populate_record(null::public.db_2, elements.value) as member
+  ),
+  updated as (
+    update public.db_2 as existing set
+      first_name = coalesce(incoming.first_name, existing.first_name),
+      last_name = coalesce(incoming.last_name, existing.last_name),
+      email = coalesce(incoming.email, existing.email),
+      phone_number = coalesce(incoming.phone_number, existing.phone_number),
+      address_city = coalesce(incoming.address_city, existing.address_city),
+      tag_list = public.merge_tag_lists(existing.tag_list, incoming.tag_list)
+    from incoming
+    where not incoming.is_new and existing.nationbuilder_id = incoming.member_id
+    returning incoming.ord, existing.nationbuilder_id::bigint
+  ),
+  inserted as (
+    insert into public.db_2 (nationbuilder_id, first_name, last_name, email, phone_number, address_city, tag_list)
+    overriding system value
+    select member_id, first_name, last_name, email, phone_number, address_city, tag_list
+    from incoming
+    where is_new
+    returning nationbuilder_id::bigint
+  )
+  select updated.ord, updated.nationbuilder_id, 'updated' from updated
+  union all
+  select incoming.ord, incoming.member_id, 'inserted' from incoming join inserted on inserted.nationbuilder_id = incoming.member_id
+$$;
+
+
+-- users (a02_upsert). Members are matched on email, case-insensitively.
+-- Send one row per email per call. Returns the same (ord, id, outcome) rows as merge_members.
+create or replace function public.merge_users(payload jsonb)
+returns table (ord bigint, id bigint, outcome text)
+language sql
+as $$
+  with incoming as (
+    select elements.ord, member.*, existing.id as existing_id,
+           coalesce(existing.id, nextval(pg_get_serial_sequence('public.users', 'id')))::bigint as member_id
+    from jsonb_array_elements(payload) with ordinality as elements(value, ord)
+    cross join jsonb_populate_record(null::public.users, elements.value) as member
+    left join lateral (
+      select users.id from public.users where lower(users.email) = lower(member.email) order by users.id limit 1
+    ) as existing on true
+  ),
+  updated as (
+    update public.users as existing set
+      first_name = coalesce(incoming.first_name, existing.first_name),
+      last_name = coalesce(incoming.last_name, existing.last_name),
+      phone_number = coalesce(incoming.phone_number, existing.phone_number),
+      address_city = coalesce(incoming.address_city, existing.address_city),
+      tags = public.merge_tag_lists(existing.tags, incoming.tags)
+    from incoming
+    where incoming.existing_id is not null and existing.id = incoming.existing_id
+    returning incoming.ord, existing.id::bigint
+  ),
+  inserted as (
+    insert into public.users (id, first_name, last_name, email, phone_number, address_city, tags)
+    overriding system value
+    select member_id, first_name, last_name, email, phone_number, address_city, tags
+    from incoming
+    where existing_id is null
+    returning id::bigint
+  )
+  select updated.ord, updated.id, 'updated' from updated
+  union all
+  select incoming.ord, incoming.member_id, 'inserted' from incoming join inserted on inserted.id = incoming.member_id
+$$;
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from functools import reduce
+
+# Inverted tag index.
+# tag_list is stored as a comma joined string; splitting and exploding it on every rerun is the most expensive part of
+# the tag filter and the "Most Popular Tags" stats. The index maps every normalized tag to a sorted array of member
+# keys (nationbuilder_id), so AND/OR filters become array intersections/unions and counts are a lookup.
+# Keys are used instead of row positions because snapshot merges reorder rows.
+
+
+# Tag as used for lookups: surrounding spaces removed, case folded.
+def normalize_tag(tag):
+    return str(tag).strip().casefold()
+
+
+# Member keys as a plain numpy array (int64 when possible, so set operations stay fast).
+def key_array(keys):
+    keys = pd.Series(keys)
+    if pd.api.types.is_integer_dtype(keys.dtype) and keys.notna().all():
+        return keys.to_numpy(dtype='int64')
+    return keys.to_numpy()
+
+
+# Series of comma joined tags -> one row per (key, tag label), empty tags dropped.
+def explode_tags(keys, tag_lists):
+    tags = pd.Series(tag_lists.to_numpy(), index=pd.Index(key_array(keys), name='key'), dtype='string')
+    tags = tags.dropna().str.split(',').explode().str.strip()
+    return tags[tags.notna() & (tags != '')]
+
+
+class TagIndex:
+
+    def __init__(self, key='nationbuilder_id', column='tag_list'):
+        self.key = key
+        self.column = column
+        self.postings = {}   # normalized tag -> sorted array of keys
+        self.labels = {}     # normalized tag -> tag as first seen, for display
+        self._counts = None
+
+    @classmethod
+    def from_frame(cls, data, key='nationbuilder_id', column='tag_list'):
+        index = cls(key, column)
+        index.add(data)
+        return index
+
+    # Index new or changed rows. Rows already in the index are re-indexed with their new tags.
+    def add(self, data):
+        if data.empty or self.column not in data.columns:
+            return
+        self.remove(data[self.key])
+
+        exploded = explode_tags(data[self.key], data[self.column])
+        frame = pd.DataFrame({'key': exploded.index, 'label': exploded.values})
+        frame['tag'] = frame['label'].map(normalize_tag)
+        for tag, group in frame.groupby('tag', sort=False):
+            self.labels.setdefault(tag, group['label'].iloc[0])
+            new_keys = np.unique(group['key'].to_numpy())
+            current = self.postings.get(tag)
+            self.postings[tag] = new_keys if current is None else np.union1d(current, new_keys)
+        self._counts = None
+
+    # Drop rows (e.g. deleted members) from every posting list.
+    def remove(self, keys):
+        keys = key_array(keys)
+        if not len(keys) or not self.postings:
+            return
+        for tag in list(self.postings):
+            remaining = self.postings[tag][~np.isin(self.postings[tag], keys)]
+            if len(remaining):
+                self.postings[tag] = remaining
+            else:
+                del self.postings[tag]
+                del self.labels[tag]
+        self._counts = None
+
+    # All tags, as displayed, alphabetically.
+    def tags(self):
+        return sorted(self.labels.values(), key=str.casefold)
+
+    # Number of members per tag, most popular first. Cached until the index changes.
+    def counts(self):
+        if self._counts is None:
+            counts = pd.Series({self.labels[tag]: len(keys) for tag, keys in self.postings.items()}, dtype='int64')
+            self._counts = counts.sort_values(ascending=False, kind='stable').rename_axis(self.column).rename('count')
+        return self._counts
+
+    # Keys of the members having all (mode='and') or any (mode='or') of the tags.
+    def keys(self, tags, mode='and'):
+        postings = [self.postings.get(normalize_tag(tag), np.array([], dtype=np.int64)) for tag in tags]
+        if not postings:
+            return np.array([], dtype=np.int64)
+        if mode == 'and':
+            return reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True), postings)
+        return reduce(np.union1d, postings)
+
+    # Boolean mask over a frame of members.
+    def mask(self, data, tags, mode='and'):
+        return pd.Series(np.isin(key_array(data[self.key]), self.keys(tags, mode)), index=data.index)
+
+
+# Split a column of comma joined tags with Arrow kernels. Returns (row position of every tag, stripped tag).
+def split_tags(values):
+    lists = pc.split_pattern(pa.array(values, type=pa.string(), from_pandas=True), ',')
+    return pc.list_parent_indices(lists).to_numpy(), pc.utf8_trim_whitespace(pc.list_flatten(lists))
+
+
+# Batch version of importer.merge_tags: merges the incoming tag_list of N matched users into their existing one.
+# Tags are split on ',', stripped, empty ones dropped and duplicates removed keeping the first occurrence, existing
+# tags first. Users without incoming tags keep their existing value untouched. Result is aligned with `existing`.
+# Splitting, de-duplication and joining all run in Arrow/NumPy kernels, there is no Python loop per user.
+def merge_tag_columns(existing, incoming):
+    existing = pd.Series(existing).to_numpy(dtype=object)
+    incoming = pd.Series(incoming).to_numpy(dtype=object)
+    existing = np.where(pd.isna(existing), None, existing)
+    incoming = np.where(pd.isna(incoming), None, incoming)
+    has_incoming = pc.fill_null(pc.not_equal(pc.utf8_trim_whitespace(pa.array(incoming, type=pa.string())), ''), False).to_numpy(zero_copy_only=False)
+    rows = np.flatnonzero(has_incoming)
+
+    # every tag with the user it belongs to, existing tags before incoming ones
+    existing_positions, existing_tags = split_tags(existing[rows])
+    incoming_positions, incoming_tags = split_tags(incoming[rows])
+    positions = np.concatenate([existing_positions, incoming_positions])
+    tags = pa.concat_arrays([existing_tags, incoming_tags])
+
+    # drop empty tags, then keep the first occurrence of every (user, tag)
+    keep = pc.not_equal(tags, '').to_numpy(zero_copy_only=False)
+    positions, tags = positions[keep], tags.filter(pa.array(keep))
+    order = np.argsort(positions, kind='stable')
+    positions, tags = positions[order], tags.take(pa.array(order))
+    codes = pc.dictionary_encode(tags).indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    _, first = np.unique(positions * (codes.max(initial=0) + 1) + codes, return_index=True)
+    first.sort()
+    positions, tags = positions[first], tags.take(pa.array(first))
+
+    # rebuild one list per user and join it
+    counts = np.bincount(positions, minlength=len(rows))
+    offsets = pa.array(np.r_[0, np.cumsum(counts)].astype(np.int32))
+    joined = pc.binary_join(pa.ListArray.from_arrays(offsets, tags), ', ')
+
+    merged = existing.copy()
+    merged[rows] = joined.to_numpy(zero_copy_only=False)
+    return pd.Series(merged, dtype=object)
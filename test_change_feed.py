@@ -0,0 +1,111 @@
+import time
+import pytest
+import db
+import change_feed
+import snapshot_cache
+from bench_suite import make_members
+from fake_supabase import FakeStore, FakeClient, FakeAsyncClient
+from fake_realtime import FakeRealtimeServer
+
+# change_feed against the local Realtime stand-in (fake_realtime) and the Supabase fake: rows written to the fake
+# reach the snapshot through the feed, and only tables whose subscription Realtime confirmed stop polling.
+# Run with: python -m pytest test_change_feed.py
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = FakeStore({'db_2': make_members(500)}, keys={'db_2': 'nationbuilder_id'})
+    db.set_clients(FakeClient(store), FakeAsyncClient(store))
+    monkeypatch.setattr(snapshot_cache, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(change_feed, 'FLUSH_INTERVAL', 0.05)
+    snapshot_cache.load('db_2')
+    yield store
+    snapshot_cache._snapshots.pop('db_2', None)
+    snapshot_cache.set_live('db_2', False)
+
+
+def feed_for(store, refused=()):
+    server = FakeRealtimeServer(store, refused=refused).start()
+    return server, change_feed.ChangeFeed(server.url).start()
+
+
+def row(supabase_table, key):
+    data = snapshot_cache.current(supabase_table)
+    return data[data['nationbuilder_id'] == key]
+
+
+def test_changes_reach_the_snapshot(store):
+    server, feed = feed_for(store)
+    try:
+        feed.subscribe('db_2')
+        assert wait_for(lambda: 'db_2' in snapshot_cache._live)
+        client = db.client()
+        key = int(snapshot_cache.current('db_2')['nationbuilder_id'].iloc[10])
+
+        client.table('db_2').update({'first_name': 'Nuovo'}).eq('nationbuilder_id', key).execute()
+        assert wait_for(lambda: row('db_2', key)['first_name'].tolist() == ['Nuovo'])
+        assert snapshot_cache.search_index('db_2').keys('Nuovo', columns=['first_name']).tolist() == [key]
+
+        new = make_members(1, seed=7).drop(columns='nationbuilder_id').to_dict('records')[0]
+        inserted = client.table('db_2').insert({**new, 'email': 'nuovo@example.com'}).execute().data[0]['nationbuilder_id']
+        assert wait_for(lambda: len(row('db_2', inserted)) == 1)
+
+        client.table('db_2').delete().eq('nationbuilder_id', key).execute()
+        assert wait_for(lambda: row('db_2', key).empty)
+        assert len(snapshot_cache.current('db_2')) == 500
+        assert len(snapshot_cache.search_index('db_2').keys('Nuovo', columns=['first_name'])) == 0
+    finally:
+        feed.stop()
+        server.stop()
+
+
+def test_live_tables_are_not_polled(store):
+    server, feed = feed_for(store)
+    try:
+        feed.subscribe('db_2')
+        assert wait_for(lambda: 'db_2' in snapshot_cache._live)
+        snapshot_cache._snapshots['db_2']['synced_at'] = 0
+        requests = store.total_requests()
+        snapshot_cache.load('db_2')
+        assert store.total_requests() == requests
+    finally:
+        feed.stop()
+        server.stop()
+
+
+def test_refused_join_keeps_polling(store):
+    server, feed = feed_for(store, refused={'db_2'})
+    try:
+        feed.subscribe('db_2')
+        time.sleep(1)
+        assert 'db_2' not in snapshot_cache._live
+        key = int(snapshot_cache.current('db_2')['nationbuilder_id'].iloc[10])
+        db.client().table('db_2').update({'first_name': 'Nuovo'}).eq('nationbuilder_id', key).execute()
+        snapshot_cache._snapshots['db_2']['synced_at'] = 0
+        data = snapshot_cache.load('db_2')
+        assert data.loc[data['nationbuilder_id'] == key, 'first_name'].tolist() == ['Nuovo']
+    finally:
+        feed.stop()
+        server.stop()
+
+
+def test_disconnect_resumes_polling(store, monkeypatch):
+    monkeypatch.setattr(change_feed, 'RECONNECT_DELAY', 30)
+    server, feed = feed_for(store)
+    try:
+        feed.subscribe('db_2')
+        assert wait_for(lambda: 'db_2' in snapshot_cache._live)
+        server.disconnect()
+        assert wait_for(lambda: 'db_2' not in snapshot_cache._live)
+    finally:
+        feed.stop()
+        server.stop()
@@ -0,0 +1,106 @@
+import io
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from PIL import Image
+import thumbnails
+
+# thumbnails against a local HTTP stand-in for the image CDNs: /red.png and /blue.png are images, /red-copy.png is
+# the same picture as /red.png under another link, /text is not an image and anything else is a 404.
+# Run with: python -m pytest test_thumbnails.py
+
+
+def image_bytes(color, size=(1200, 800)):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, format='PNG')
+    return output.getvalue()
+
+
+FILES = {'/red.png': image_bytes('red'), '/red-copy.png': image_bytes('red'), '/blue.png': image_bytes('blue'),
+         '/text': b'not an image'}
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        ImageHandler.requests.append(self.path)
+        content = FILES.get(self.path)
+        self.send_response(200 if content is not None else 404)
+        self.end_headers()
+        if content is not None:
+            self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'THUMBNAIL_DIR', str(tmp_path))
+    ImageHandler.requests.clear()
+    return tmp_path
+
+
+def objects(cache_dir):
+    return sorted(os.listdir(os.path.join(cache_dir, 'objects')))
+
+
+def test_downloads_once_and_shrinks(server):
+    urls = [f'{server}/red.png', f'{server}/blue.png']
+    first = thumbnails.thumbnails(urls)
+    second = thumbnails.thumbnails(urls)
+
+    assert first == second
+    assert sorted(ImageHandler.requests) == ['/blue.png', '/red.png']
+    with Image.open(io.BytesIO(first[urls[0]])) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (480, 320)
+
+
+def test_same_picture_stored_once(server, cache_dir):
+    found = thumbnails.thumbnails([f'{server}/red.png', f'{server}/red-copy.png'])
+    assert found[f'{server}/red.png'] == found[f'{server}/red-copy.png']
+    assert len(objects(cache_dir)) == 1
+
+
+def test_unreadable_links(server):
+    found = thumbnails.thumbnails([f'{server}/text', f'{server}/missing.png', None, ''])
+    assert found == {f'{server}/text': None, f'{server}/missing.png': None}
+
+
+def test_failed_links_wait_for_the_ttl(server, monkeypatch):
+    urls = [f'{server}/text', f'{server}/missing.png']
+    thumbnails.thumbnails(urls)
+    thumbnails.thumbnails(urls)
+    assert sorted(ImageHandler.requests) == ['/missing.png', '/text']
+
+    monkeypatch.setattr(thumbnails, 'FAILURE_TTL', 0)
+    thumbnails.thumbnails(urls)
+    assert len(ImageHandler.requests) == 4
+
+
+def test_evicts_least_recently_used(server, cache_dir):
+    red, blue = f'{server}/red.png', f'{server}/blue.png'
+    thumbnails.thumbnails([red, blue])
+    paths = [os.path.join(cache_dir, 'objects', name) for name in objects(cache_dir)]
+    # red was used before blue
+    for url, used_at in ((red, 1), (blue, 2)):
+        with open(thumbnails._link_path(url)) as link_file:
+            os.utime(thumbnails._object_path(link_file.read().strip()), (used_at, used_at))
+
+    # red is served again through another link: stored already, but now the most recently used
+    thumbnails.fetch(f'{server}/red-copy.png')
+    thumbnails.evict(max_bytes=max(os.path.getsize(path) for path in paths))
+
+    assert thumbnails.cached(red) is not None
+    assert thumbnails.cached(blue) is None
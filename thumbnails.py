@@ -0,0 +1,166 @@
+import io
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from PIL import Image, ImageOps
+
+# Local thumbnail cache for post images.
+# Each image link is downloaded once, shrunk to grid size with Pillow and stored on disk under the hash of the
+# thumbnail bytes (the same picture behind two links is stored once). A small file per link points to its thumbnail.
+# The dashboard hands the bytes to st.image, so browsers never load full-size images from the CDNs. Thumbnails not
+# used for a while are evicted (least recently used first) when the cache grows past THUMBNAIL_CACHE_BYTES. A link
+# that could not be fetched is remembered too, and not tried again for FAILURE_TTL seconds.
+
+THUMBNAIL_DIR = os.environ.get('THUMBNAIL_DIR', '.thumbnails')
+
+# Bounding box of a thumbnail, in pixels (aspect ratio is kept).
+THUMBNAIL_SIZE = (480, 480)
+
+THUMBNAIL_QUALITY = 85
+
+# Disk space for thumbnails.
+THUMBNAIL_CACHE_BYTES = 200 * 1024 * 1024
+
+# Downloads in flight at the same time, and how long one may take (seconds).
+FETCH_WORKERS = 8
+FETCH_TIMEOUT = 10
+
+# Seconds a failed link (broken, expired, not an image, timed out) is skipped before it is tried again.
+FAILURE_TTL = 3600
+
+_http = None
+_executor = None
+_guard = threading.Lock()
+
+
+# Shared HTTP client (keep-alive connections to the CDNs) and download pool, created on first use.
+def _resources():
+    global _http, _executor
+    with _guard:
+        if _http is None:
+            _http = httpx.Client(timeout=FETCH_TIMEOUT, follow_redirects=True)
+            _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='thumbnails')
+        return _http, _executor
+
+
+def _link_path(url):
+    link = hashlib.sha1(url.encode()).hexdigest()
+    return os.path.join(THUMBNAIL_DIR, 'links', link)
+
+
+# Marker of a link that failed, its modification time is when.
+def _failure_path(url):
+    link = hashlib.sha1(url.encode()).hexdigest()
+    return os.path.join(THUMBNAIL_DIR, 'failed', link)
+
+
+# True if fetching the link failed less than FAILURE_TTL seconds ago.
+def recently_failed(url):
+    try:
+        return time.time() - os.path.getmtime(_failure_path(url)) < FAILURE_TTL
+    except FileNotFoundError:
+        return False
+
+
+def _object_path(digest):
+    return os.path.join(THUMBNAIL_DIR, 'objects', f'{digest}.jpg')
+
+
+# Write then rename, so readers never see half a file.
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+# Image bytes -> JPEG thumbnail bytes (EXIF rotation applied, transparency flattened).
+def make_thumbnail(content, size=THUMBNAIL_SIZE):
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+        return output.getvalue()
+
+
+# The cached thumbnail of a link, or None. A hit refreshes its place in the LRU order.
+def cached(url):
+    link_path = _link_path(url)
+    try:
+        with open(link_path) as link_file:
+            object_path = _object_path(link_file.read().strip())
+        with open(object_path, 'rb') as object_file:
+            content = object_file.read()
+        os.utime(object_path)
+    except FileNotFoundError:
+        return None
+    return content
+
+
+# Download, shrink and store one image. Returns the thumbnail bytes, or None when the link can't be read as an image
+# (remembered, see recently_failed).
+def fetch(url):
+    http, _ = _resources()
+    try:
+        response = http.get(url)
+        response.raise_for_status()
+        content = make_thumbnail(response.content)
+    except (httpx.HTTPError, OSError, Image.DecompressionBombError):
+        _write(_failure_path(url), b'')
+        return None
+
+    digest = hashlib.sha1(content).hexdigest()
+    try:
+        # already stored (the same picture behind another link): it was just used, so it moves up the LRU order
+        os.utime(_object_path(digest))
+    except FileNotFoundError:
+        _write(_object_path(digest), content)
+    _write(_link_path(url), digest.encode())
+    if os.path.exists(_failure_path(url)):
+        os.remove(_failure_path(url))
+    return content
+
+
+# Remove the least recently used thumbnails until the cache fits THUMBNAIL_CACHE_BYTES, and expired failure markers.
+# Links to removed thumbnails are simply misses next time.
+def evict(max_bytes=THUMBNAIL_CACHE_BYTES):
+    failed_dir = os.path.join(THUMBNAIL_DIR, 'failed')
+    if os.path.isdir(failed_dir):
+        for entry in os.scandir(failed_dir):
+            if time.time() - entry.stat().st_mtime >= FAILURE_TTL:
+                os.remove(entry.path)
+
+    objects_dir = os.path.join(THUMBNAIL_DIR, 'objects')
+    if not os.path.isdir(objects_dir):
+        return
+    entries = []
+    for entry in os.scandir(objects_dir):
+        if entry.name.endswith('.jpg'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+# Thumbnails for a list of links, as {link: bytes or None}. Misses are downloaded concurrently (FETCH_WORKERS at a
+# time), except links that failed recently.
+def thumbnails(urls):
+    urls = [url for url in dict.fromkeys(urls) if isinstance(url, str) and url]
+    result = {url: cached(url) for url in urls}
+    missing = [url for url, content in result.items() if content is None and not recently_failed(url)]
+    if missing:
+        _, executor = _resources()
+        result.update(zip(missing, executor.map(fetch, missing)))
+        evict()
+    return result